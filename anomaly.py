@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Online anomaly scoring for amount histories.
+
+Each merchant keeps a rolling window of its latest amounts (arrival order) plus a
+sorted copy. Median and MAD come straight from the sorted copy: the MAD is the
+median of two already-sorted deviation sequences (left and right of the median),
+found by binary search instead of building and sorting |x - median|. Scoring a
+new amount is O(log window) comparisons, so spikes can be flagged at ingest time.
+Only increases are flagged, and only on rows newer than what a merchant already
+has stored, so a backfill of old history stays quiet.
+"""
+
+from bisect import bisect_left, insort
+from collections import deque
+
+ANOMALY_Z_THRESHOLD = 3.5
+DEFAULT_WINDOW = 24
+# The MAD never counts as less than this fraction of the median, so a flat history
+# doesn't turn a change of a few cents into a huge score
+MIN_MAD_FRACTION = 0.01
+
+# Ingest-time price alerts kept in the user data
+MAX_PRICE_ALERTS = 100
+
+class RollingRobustStats:
+    """Rolling-window median/MAD for one amount stream"""
+
+    __slots__ = ('size', 'window', 'sorted')
+
+    def __init__(self, values=(), size=DEFAULT_WINDOW):
+        self.size = size
+        self.window = deque(values, maxlen=None)
+        while len(self.window) > size:
+            self.window.popleft()
+        self.sorted = sorted(self.window)
+
+    def __len__(self):
+        return len(self.window)
+
+    def add(self, value):
+        value = float(value)
+        self.window.append(value)
+        insort(self.sorted, value)
+        if len(self.window) > self.size:
+            oldest = self.window.popleft()
+            del self.sorted[bisect_left(self.sorted, oldest)]
+
+    def median(self):
+        s, n = self.sorted, len(self.sorted)
+        return (s[(n - 1) // 2] + s[n // 2]) / 2
+
+    def _kth_deviation(self, med, split, k):
+        """k-th (1-based) smallest |x - med|, merging the left and right deviation runs"""
+        s = self.sorted
+        len_a, len_b = split, len(s) - split
+        # a(t): t-th deviation left of the median, b(t): right of it (both ascending)
+        a = lambda t: med - s[split - 1 - t]
+        b = lambda t: s[split + t] - med
+        lo, hi = max(0, k - len_b), min(k, len_a)
+        while lo < hi:
+            i = (lo + hi) // 2  # take i from the left run, k - i from the right
+            if b(k - i - 1) > a(i):
+                lo = i + 1
+            else:
+                hi = i
+        i = lo
+        candidates = []
+        if i > 0:
+            candidates.append(a(i - 1))
+        if k - i > 0:
+            candidates.append(b(k - i - 1))
+        return max(candidates)
+
+    def mad(self):
+        med = self.median()
+        n = len(self.sorted)
+        split = bisect_left(self.sorted, med)
+        lower = self._kth_deviation(med, split, (n + 1) // 2)
+        upper = self._kth_deviation(med, split, n // 2 + 1)
+        return (lower + upper) / 2 if n % 2 == 0 else lower
+
+    def score(self, value):
+        """(is_spike, robust z) of value against the current window; only increases are spikes"""
+        if len(self.sorted) < 3:
+            return False, 0.0
+        med = self.median()
+        mad = max(self.mad(), MIN_MAD_FRACTION * abs(med), 1e-6)
+        z = 0.6745 * (float(value) - med) / mad
+        return (z > ANOMALY_Z_THRESHOLD), float(z)
+
+    def observe(self, value):
+        """Add value to the stream and score it as the latest amount"""
+        self.add(value)
+        return self.score(value)
+
+def score_new_transactions(groups, transactions, size=DEFAULT_WINDOW):
+    """
+    Score each new (canonicalized) transaction against its merchant's rolling window,
+    in arrival order. Call before the transactions are added to the group state.
+    Every row feeds the window, but only rows dated after the merchant's latest stored
+    payment can raise an alert: older rows are backfilled history, and a merchant with
+    nothing stored yet has no baseline.
+    Returns (price alerts, {merchant: updated window}) for the caller to persist.
+    """
+    streams = {}
+    latest = {}
+    alerts = []
+    for transaction in transactions:
+        name = transaction.get('name', 'Unknown')
+        amount = abs(float(transaction.get('amount', 0)))
+        # Skip very small amounts, as bill grouping does
+        if amount < 5:
+            continue
+        stats = streams.get(name)
+        if stats is None:
+            group = groups.get(name) or {}
+            window = group.get('anomaly_window')
+            if window is None:
+                # Group state saved before online scoring: seed from its history
+                window = group.get('amounts', [])[-size:]
+            stats = streams[name] = RollingRobustStats(window, size=size)
+            dates = group.get('dates')
+            latest[name] = dates[-1] if dates else None
+        is_anom, score = stats.observe(amount)
+        if is_anom and latest[name] is not None and (transaction.get('date') or '') > latest[name]:
+            alerts.append({
+                'merchant': name,
+                'date': transaction.get('date'),
+                'amount': amount,
+                'median': stats.median(),
+                'score': score
+            })
+    return alerts, {name: list(stats.window) for name, stats in streams.items()}
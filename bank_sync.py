@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Concurrent bank-feed sync for user_profile.connected_accounts.
+
+Every account is pulled page by page in its own task, so a sync takes about as
+long as the slowest account rather than the sum of all of them. Requests go
+through a per-provider token bucket and a keep-alive connection pool, and
+failures are retried with exponential backoff. Pages flow through a bounded
+queue to a single consumer that hands them to a writer, so fetches keep
+running while a page is saved; run_sync makes the calling thread the writer.
+An account's cursor only moves forward after its page is ingested, so an
+interrupted sync resumes where it stopped. A malformed page fails only its
+own account.
+
+Feed API (served by FeedServer for local testing):
+
+    GET /accounts                                      {"accounts": [id, ...]}
+    GET /accounts/<id>/transactions?cursor=&limit=     {"transactions": [...], "next_cursor": ..., "has_more": bool}
+"""
+
+import json
+import random
+import asyncio
+import threading
+import zlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from queue import SimpleQueue
+from urllib.parse import urlsplit, parse_qs, quote, urlencode
+
+import metrics
+
+# Requests per second per provider (token bucket); unknown providers get the default
+PROVIDER_RATE_LIMITS = {'local': 1000.0}
+DEFAULT_RATE_LIMIT = 20.0
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_CONCURRENCY = 256
+# Pages waiting to be ingested before fetchers pause
+DEFAULT_QUEUE_SIZE = 64
+MAX_CONNECTIONS_PER_HOST = 100
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 10.0
+REQUEST_TIMEOUT = 30.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class SyncError(Exception):
+    pass
+
+class RetryableError(SyncError):
+    """A failure worth retrying: dropped connection, throttling or a server error"""
+
+class RateLimiter:
+    """Token bucket: rate requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ConnectionPool:
+    """Minimal HTTP/1.1 client keeping idle keep-alive connections per host"""
+
+    def __init__(self, limit_per_host=MAX_CONNECTIONS_PER_HOST):
+        self.limit_per_host = limit_per_host
+        self._idle = {}
+        self._slots = {}
+        self.opened = 0
+
+    async def _open(self, scheme, host, port):
+        self.opened += 1
+        metrics.count("sync_connections_opened", 1)
+        return await asyncio.open_connection(host, port, ssl=(scheme == 'https') or None)
+
+    async def get_json(self, url, headers=None, timeout=REQUEST_TIMEOUT):
+        """GET url; returns (status, response headers, decoded JSON body or None)"""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request = [f"GET {path} HTTP/1.1", f"Host: {parts.hostname}:{port}",
+                   "Accept: application/json", "Connection: keep-alive"]
+        request += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        payload = ("\r\n".join(request) + "\r\n\r\n").encode()
+
+        slots = self._slots.setdefault(key, asyncio.Semaphore(self.limit_per_host))
+        async with slots:
+            idle = self._idle.setdefault(key, [])
+            while True:
+                reused = bool(idle)
+                reader, writer = idle.pop() if reused else await self._open(*key)
+                try:
+                    writer.write(payload)
+                    status, response_headers, body = await asyncio.wait_for(self._read_response(reader), timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as exc:
+                    writer.close()
+                    if reused:
+                        # The server closed an idle connection; retry on a fresh one
+                        continue
+                    raise RetryableError(f"connection failed: {exc}") from exc
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+            if response_headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                idle.append((reader, writer))
+        return status, response_headers, json.loads(body) if body else None
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers, body
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+async def _fetch_page(pool, limiter, account, page_size):
+    """One page for account, retrying transient failures with exponential backoff and jitter"""
+    query = {'limit': page_size}
+    if account.get('cursor'):
+        query['cursor'] = account['cursor']
+    url = f"{account['url'].rstrip('/')}/accounts/{quote(account['account_id'])}/transactions?{urlencode(query)}"
+    headers = {'Authorization': f"Bearer {account['token']}"} if account.get('token') else None
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await limiter.acquire()
+        retry_after = None
+        try:
+            status, response_headers, body = await pool.get_json(url, headers=headers)
+        except (RetryableError, asyncio.TimeoutError, OSError) as exc:
+            error = exc
+        except ValueError as exc:
+            raise SyncError(f"{account['account_id']}: malformed response from {url} ({exc})") from exc
+        else:
+            metrics.count("sync_requests", 1)
+            if status == 200:
+                return body
+            if status not in RETRY_STATUSES:
+                raise SyncError(f"{account['account_id']}: HTTP {status} from {url}")
+            error = f"HTTP {status}"
+            retry_after = response_headers.get('retry-after')
+        if attempt == MAX_ATTEMPTS:
+            raise SyncError(f"{account['account_id']}: giving up after {attempt} attempts ({error})")
+        metrics.count("sync_retries", 1)
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        if retry_after is not None:
+            delay = max(delay, float(retry_after))
+        await asyncio.sleep(delay)
+
+def _page_transactions(account, page):
+    """The page's transactions, or SyncError if the body is not a page of transaction objects"""
+    transactions = page.get('transactions', []) if isinstance(page, dict) else None
+    if not isinstance(transactions, list) or not all(isinstance(t, dict) for t in transactions):
+        raise SyncError(f"{account['account_id']}: malformed page ({type(page).__name__} body)")
+    return transactions
+
+async def _pull_account(account, pool, limiter, queue, page_size):
+    """Producer: queue every page of one account; returns (pages, transactions)"""
+    pages = rows = 0
+    cursor = account.get('cursor')
+    while True:
+        page = await _fetch_page(pool, limiter, dict(account, cursor=cursor), page_size)
+        transactions = _page_transactions(account, page)
+        cursor = page.get('next_cursor') or cursor
+        await queue.put((account, transactions, cursor))
+        pages += 1
+        rows += len(transactions)
+        if not page.get('has_more') or not transactions:
+            return pages, rows
+
+async def sync_accounts(accounts, ingest, page_size=DEFAULT_PAGE_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                        queue_size=DEFAULT_QUEUE_SIZE, rate_limits=None, writer=None):
+    """
+    Pull new transactions from every account concurrently. ingest(account, transactions)
+    runs on the writer executor (by default a thread of its own) for each page, one page
+    at a time, with account['cursor'] already pointing past that page, so saving the
+    accounts along with the page records the resume point. An exception from ingest
+    restores the cursor and aborts the sync.
+    Returns one summary per account: {'account_id', 'pages', 'transactions', 'error'?}.
+    """
+    rate_limits = {**PROVIDER_RATE_LIMITS, **(rate_limits or {})}
+    limiters = {}
+    pool = ConnectionPool()
+    queue = asyncio.Queue(maxsize=queue_size)
+    gate = asyncio.Semaphore(concurrency)
+    # One thread, so pages are still ingested in order and never two at once
+    own_writer = writer is None
+    if own_writer:
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="derin-ingest")
+
+    def limiter_for(account):
+        provider = account.get('provider', 'default')
+        if provider not in limiters:
+            limiters[provider] = RateLimiter(rate_limits.get(provider, DEFAULT_RATE_LIMIT))
+        return limiters[provider]
+
+    async def producer(account):
+        async with gate:
+            try:
+                pages, rows = await _pull_account(account, pool, limiter_for(account), queue, page_size)
+                return {'account_id': account['account_id'], 'pages': pages, 'transactions': rows}
+            except SyncError as exc:
+                return {'account_id': account['account_id'], 'pages': 0, 'transactions': 0, 'error': str(exc)}
+
+    async def consumer():
+        loop = asyncio.get_running_loop()
+        while True:
+            account, transactions, cursor = await queue.get()
+            # Advanced before ingest so the save that stores the page also stores the cursor
+            previous, account['cursor'] = account.get('cursor'), cursor
+            try:
+                if transactions:
+                    # Off the event loop, so other accounts keep fetching during disk I/O and detection
+                    await loop.run_in_executor(writer, ingest, account, transactions)
+            except BaseException:
+                account['cursor'] = previous
+                raise
+            finally:
+                queue.task_done()
+
+    consumer_task = asyncio.create_task(consumer())
+    producers = asyncio.gather(*(producer(account) for account in accounts))
+    try:
+        # A failed ingest stops the sync instead of leaving fetchers blocked on a full queue
+        done, _ = await asyncio.wait({producers, consumer_task}, return_when=asyncio.FIRST_COMPLETED)
+        if consumer_task in done:
+            producers.cancel()
+            consumer_task.result()
+        summaries = producers.result()
+        drained = asyncio.ensure_future(queue.join())
+        await asyncio.wait({drained, consumer_task}, return_when=asyncio.FIRST_COMPLETED)
+        drained.cancel()
+        if consumer_task.done():
+            consumer_task.result()
+    finally:
+        consumer_task.cancel()
+        if own_writer:
+            # Let a page that is mid-ingest finish before the caller touches the data again
+            writer.shutdown(wait=True)
+        pool.close()
+    return summaries
+
+class _CallerExecutor(Executor):
+    """Executor whose calls run on whichever thread calls run_pending()"""
+
+    def __init__(self):
+        self._calls = SimpleQueue()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._calls.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True, **kwargs):
+        self._calls.put(None)
+
+    def run_pending(self):
+        """Run submitted calls in order until shutdown()"""
+        while True:
+            call = self._calls.get()
+            if call is None:
+                return
+            future, fn, args, kwargs = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+
+def run_sync(accounts, ingest, **options):
+    """
+    sync_accounts with ingest run on the calling thread while the fetches run on an
+    event loop in the background, so storage locks and SQLite connections the caller
+    holds stay usable from ingest. Blocks until the sync is done.
+    """
+    writer = _CallerExecutor()
+    outcome = {}
+
+    def fetch():
+        try:
+            outcome['summaries'] = asyncio.run(sync_accounts(accounts, ingest, writer=writer, **options))
+        except BaseException as exc:
+            outcome['error'] = exc
+        finally:
+            writer.shutdown()
+
+    thread = threading.Thread(target=fetch, name="derin-sync", daemon=True)
+    thread.start()
+    writer.run_pending()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['summaries']
+
+# --- Local stand-in feed server ---
+
+class FeedServer:
+    """
+    Serves deterministic synthetic transactions for `accounts` accounts over HTTP/1.1
+    keep-alive, with optional per-request latency and injected 429/503 errors.
+    """
+
+    def __init__(self, accounts=10, rows_per_account=200, latency=0.0, error_rate=0.0, seed=0):
+        self.account_ids = [f"acct_{i:04d}" for i in range(accounts)]
+        self.rows_per_account = rows_per_account
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self._feeds = {}
+        self.requests = 0
+
+    def feed(self, account_id):
+        if account_id not in self._feeds:
+            from dummy_data import generate_synthetic_transactions
+            rows = []
+            for t in generate_synthetic_transactions(self.rows_per_account, num_merchants=40,
+                                                     seed=zlib.crc32(account_id.encode())):
+                t['id'] = f"{account_id}_{t['id']}"
+                t['account_id'] = account_id
+                rows.append(t)
+            self._feeds[account_id] = rows
+        return self._feeds[account_id]
+
+    def respond(self, path, query):
+        """(status, extra headers, body) for one GET"""
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self.rng.choice((429, 503)), {'Retry-After': '0'}, {'error': 'try again'}
+        parts = path.strip('/').split('/')
+        if parts == ['accounts']:
+            return 200, {}, {'accounts': self.account_ids}
+        if len(parts) == 3 and parts[0] == 'accounts' and parts[2] == 'transactions' and parts[1] in self.account_ids:
+            rows = self.feed(parts[1])
+            offset = int(query.get('cursor', ['0'])[0] or 0)
+            limit = int(query.get('limit', [str(DEFAULT_PAGE_SIZE)])[0])
+            page = rows[offset:offset + limit]
+            return 200, {}, {
+                'transactions': page,
+                'next_cursor': str(offset + len(page)),
+                'has_more': offset + len(page) < len(rows)
+            }
+        return 404, {}, {'error': 'not found'}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                target = urlsplit(request_line.split()[1].decode())
+                status, headers, body = self.respond(target.path, parse_qs(target.query))
+                payload = json.dumps(body).encode()
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                        "Content-Type: application/json", f"Content-Length: {len(payload)}",
+                        "Connection: keep-alive"]
+                head += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        return await asyncio.start_server(self._handle, host, port)
+
+async def discover_accounts(url):
+    """Account ids offered by a feed"""
+    pool = ConnectionPool()
+    try:
+        status, _, body = await pool.get_json(f"{url.rstrip('/')}/accounts")
+    finally:
+        pool.close()
+    if status != 200:
+        raise SyncError(f"HTTP {status} listing accounts at {url}")
+    return body['accounts']
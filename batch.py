@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Parallel multi-user batch detection
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import utils
+from due_index import build_due_index
+from importer import stream_transactions
+from columnar import TransactionColumns
+
+BATCH_INPUT_FORMATS = ('.json', '.csv', '.jsonl', '.ndjson')
+
+# Written next to the per-user results; the underscore keeps it clear of user ids
+BATCH_FORECAST_FILE = "_forecast.json"
+
+def find_user_files(input_dir):
+    """Per-user transaction files in input_dir; the file stem is the user id"""
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if os.path.splitext(name)[1].lower() in BATCH_INPUT_FORMATS
+    )
+
+def read_user_transactions(path):
+    """A user's transactions as a columnar store"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        # Either a bare transaction list or a saved Derin data file
+        return TransactionColumns.from_dicts(data.get('transactions', []) if isinstance(data, dict) else data)
+    return TransactionColumns.from_dicts(t for chunk in stream_transactions(path) for t in chunk)
+
+def _init_worker(canonicalizer, embedder, threads_per_worker):
+    """Runs once per worker process: pick the canonicalizer and warm the model"""
+    utils.CANONICALIZER = canonicalizer
+    # Each user is clustered on their own: the shared canonical index would carry one
+    # customer's merchant labels into another's results, and workers would contend on it
+    utils.CANONICAL_INDEX = False
+    if canonicalizer != "embeddings":
+        return
+    import utils_embeddings
+    utils_embeddings.EMBEDDER = embedder
+    utils_embeddings.EMBED_THREADS = threads_per_worker
+    if utils_embeddings.resolve_method(canonicalizer) == "embeddings":
+        utils_embeddings.get_embedder().load()
+
+def process_user(path, output_dir):
+    """Detect bills for one user and write <output_dir>/<user>.json; returns a summary"""
+    user_id = os.path.splitext(os.path.basename(path))[0]
+    transactions = read_user_transactions(path)
+    bill_groups = {}
+    bills = utils.detect_recurring_bills(transactions, groups=bill_groups)
+
+    result = {
+        'user_id': user_id,
+        'bills': bills,
+        'bill_groups': bill_groups,
+        'due_index': build_due_index(bills),
+        'transaction_count': len(transactions)
+    }
+    out_path = os.path.join(output_dir, f"{user_id}.json")
+    with open(out_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return {'user_id': user_id, 'bills': len(bills), 'transactions': len(transactions), 'output': out_path}
+
+def run_batch(input_dir, output_dir, workers=None, max_pending=None, on_result=None):
+    """
+    Run detection for every user file across a process pool. At most max_pending
+    users are queued at once; all workers share the on-disk embedding cache.
+    """
+    paths = find_user_files(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    import utils_embeddings
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(utils.CANONICALIZER, utils_embeddings.EMBEDDER, threads_per_worker)) as pool:
+        pending = {}
+        queue = iter(paths)
+        while True:
+            # Keep the queue topped up without submitting every user at once
+            for path in queue:
+                pending[pool.submit(process_user, path, output_dir)] = path
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    summary = future.result()
+                except Exception as exc:
+                    summary = {'user_id': os.path.splitext(os.path.basename(path))[0], 'error': str(exc)}
+                summaries.append(summary)
+                if on_result:
+                    on_result(summary)
+    return summaries
+
+def forecast_batch(summaries, output_dir, months, start=None):
+    """Project the bills of every processed user in one pass; written to BATCH_FORECAST_FILE"""
+    from forecast import forecast_users
+
+    bills_by_user = {}
+    for summary in summaries:
+        if 'error' not in summary:
+            with open(summary['output'], 'r') as f:
+                bills_by_user[summary['user_id']] = json.load(f)['bills']
+    result = forecast_users(bills_by_user, months=months, start=start)
+    result['output'] = os.path.join(output_dir, BATCH_FORECAST_FILE)
+    with open(result['output'], 'w') as f:
+        json.dump({key: value for key, value in result.items() if key != 'output'}, f, indent=2)
+    return result
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: times each pipeline stage on seeded synthetic data and
+fails on regressions against stored baselines.
+
+    python benchmark.py --sizes 1000 --sizes 1000000
+    python benchmark.py --update-baseline
+"""
+
+import os
+import sys
+import json
+import copy
+import time
+import tempfile
+
+import click
+import numpy as np
+
+import utils
+from dummy_data import generate_synthetic_transactions, generate_synthetic_bills
+from storage import JsonStorage, SqliteStorage
+from columnar import TransactionColumns
+from canonical_index import CanonicalIndex
+from forecast import forecast_bills
+from recurrence import (_segment_starts, columns_from_transactions, detect_bills_columnar,
+                        robust_anomaly_scores)
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Stages shorter than this are too noisy to gate on
+MIN_GATED_SECONDS = 0.005
+
+# Synthetic rows per user: about two years of bills and purchases
+ROWS_PER_USER = 250
+
+def _best_of(repeat, fn, setup=None):
+    """Best wall time of fn() (or fn(setup()), setup untimed) over repeat runs, and its last result"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _user_columns(transactions):
+    """
+    columns_from_transactions with one group per (user, merchant): detection runs per
+    user, as batch mode does, so users paying the same merchant don't share a history
+    """
+    ids, labels, dates, amounts, strings = columns_from_transactions(transactions)
+    _, users = np.unique([t['account_id'] for t in transactions], return_inverse=True)
+    pairs, ids = np.unique(users * len(labels) + ids, return_inverse=True)
+    return ids, [labels[i] for i in (pairs % len(labels)).tolist()], dates, amounts, strings
+
+def _split_users(transactions):
+    users = {}
+    for t in transactions:
+        users.setdefault(t['account_id'], []).append(t)
+    return list(users.values())
+
+def run_stages(num_rows, repeat=3, seed=0):
+    """Time every stage on num_rows synthetic transactions; returns ({stage: seconds}, bills detected)"""
+    num_users = max(1, num_rows // ROWS_PER_USER)
+    transactions = list(generate_synthetic_transactions(num_rows, num_users=num_users,
+                                                        num_merchants=200, seed=seed))
+    users = _split_users(transactions)
+    timings = {}
+
+    timings['canonicalize'], canonical = _best_of(
+        repeat, utils._canonicalize, setup=lambda: copy.deepcopy(transactions))
+
+    def group():
+        ids, labels, dates, amounts, strings = _user_columns(canonical)
+        order = np.lexsort((dates, ids))
+        return (ids, labels, dates, amounts, strings), order, _segment_starts(ids[order])
+    timings['group'], (columns, order, (starts, counts)) = _best_of(repeat, group)
+
+    ids, labels, dates, amounts, strings = columns
+    timings['recurrence'], (bills_detected, _) = _best_of(repeat, lambda: detect_bills_columnar(
+        ids, labels, dates, amounts, date_strings=strings, classify_many=utils.classify_bill_types))
+
+    sorted_amounts = np.abs(amounts[order])
+    seg_ids = np.repeat(np.arange(len(starts)), counts)
+    timings['anomaly'], _ = _best_of(repeat, lambda: robust_anomaly_scores(
+        sorted_amounts, seg_ids, starts, counts))
+
+    # End to end on the columnar store: build, canonicalize the name table, detect
+    timings['columnar_build'], _ = _best_of(repeat, lambda: TransactionColumns.from_dicts(transactions))
+    # One store and one detection per user, like batch mode
+    timings['detect_columnar'], _ = _best_of(
+        repeat, lambda stores: [utils.detect_recurring_bills(store) for store in stores],
+        setup=lambda: [TransactionColumns.from_dicts(user) for user in users])
+
+    bill_groups = {}
+    for user in _split_users(canonical):
+        utils.detect_recurring_bills(copy.deepcopy(user), groups=bill_groups)
+    data = {
+        # One document holds one bill per merchant
+        'bills': list({bill['merchant']: bill for bill in bills_detected}.values()),
+        'transactions': canonical,
+        'bill_groups': bill_groups,
+        'user_profile': {}
+    }
+    # One bill per transaction row, so the 100k size projects 100k bills over a year
+    bills = generate_synthetic_bills(num_rows, seed=seed)
+    timings['forecast'], _ = _best_of(repeat, lambda: forecast_bills(bills, months=12, start='2025-01-01'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Warm canonical index: every name is an alias hit, nothing is embedded
+        index = CanonicalIndex(utils.CANONICALIZER, path=os.path.join(tmp, 'canonical.sqlite'))
+        names = [t['name'] for t in transactions]
+        index.canonicalize(names)
+        timings['canonicalize_indexed'], _ = _best_of(repeat, lambda: index.canonicalize(names))
+        index.close()
+
+        for name, storage in (('json', JsonStorage(os.path.join(tmp, 'bench.json'))),
+                              ('sqlite', SqliteStorage(os.path.join(tmp, 'bench.db')))):
+            timings[f'save_data_{name}'], _ = _best_of(repeat, lambda: storage.save(data))
+            timings[f'load_data_{name}'], _ = _best_of(repeat, storage.load)
+            if hasattr(storage, 'close'):
+                storage.close()
+
+    return timings, len(bills_detected)
+
+def report_embedders(num_rows, seed=0):
+    """Names/second for every embedder backend on the unique names of num_rows transactions"""
+    from utils_embeddings import measure_throughput
+
+    names = list(dict.fromkeys(t['name'] for t in generate_synthetic_transactions(
+        num_rows, num_users=max(1, num_rows // ROWS_PER_USER), num_merchants=200, seed=seed)))
+    print(f"\nEmbedding {len(names):,} unique names")
+    print("-" * 60)
+    print(f"{'Backend':<14} {'Load (s)':>10} {'Encode (s)':>12} {'Names/s':>14}")
+    print("-" * 60)
+    for row in measure_throughput(names):
+        if 'error' in row:
+            print(f"{row['backend']:<14} skipped: {row['error']}")
+        else:
+            print(f"{row['backend']:<14} {row['load_seconds']:>10.2f} {row['encode_seconds']:>12.3f} "
+                  f"{row['names_per_second']:>14,.0f}")
+
+def compare(results, baseline, tolerance):
+    """Return (size, stage, seconds, baseline_seconds) for every regression"""
+    regressions = []
+    for size, stages in results.items():
+        for stage, seconds in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None or max(seconds, base) < MIN_GATED_SECONDS:
+                continue
+            if seconds > base * (1 + tolerance):
+                regressions.append((size, stage, seconds, base))
+    return regressions
+
+@click.command()
+@click.option('--sizes', type=int, multiple=True, default=DEFAULT_SIZES, show_default=True,
+              help="Transaction counts to benchmark (10^3 to 10^7).")
+@click.option('--repeat', type=click.IntRange(min=1), default=3, show_default=True,
+              help="Runs per stage; the best time is kept.")
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--baseline', 'baseline_file', type=click.Path(dir_okay=False), default=BASELINE_FILE,
+              show_default=True)
+@click.option('--tolerance', type=float, default=0.25, show_default=True,
+              help="Allowed slowdown over the baseline before failing (0.25 = 25%).")
+@click.option('--update-baseline', is_flag=True, help="Store these results as the new baseline.")
+@click.option('--embedders', is_flag=True,
+              help="Report encoding throughput per embedder backend instead of stage timings.")
+def main(sizes, repeat, seed, baseline_file, tolerance, update_baseline, embedders):
+    """Benchmark Derin's pipeline stages on synthetic transactions"""
+    if embedders:
+        report_embedders(sizes[0], seed)
+        return
+
+    # The model-free canonicalizer keeps timings independent of model downloads and cache state
+    utils.CANONICALIZER = os.environ.get("DERIN_CANONICALIZER", "ngram")
+    # Time the clustering itself, and keep synthetic names out of the user's canonical index
+    utils.CANONICAL_INDEX = False
+
+    results = {}
+    empty = []
+    for size in sizes:
+        timings, bills = run_stages(size, repeat=repeat, seed=seed)
+        results[str(size)] = timings
+        print(f"\n{size:,} transactions ({bills:,} bills detected)")
+        print("-" * 40)
+        for stage, seconds in timings.items():
+            print(f"{stage:<20} {seconds * 1000:>12.1f} ms")
+        if not bills:
+            empty.append(size)
+
+    if update_baseline:
+        if empty:
+            # Detection and anomaly timings would measure an empty workload
+            raise click.ClickException(f"No bills detected at size {', '.join(map(str, empty))}; "
+                                       "not recording a baseline.")
+        baseline = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file, 'r') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline updated: {baseline_file}")
+        return
+
+    if not os.path.exists(baseline_file):
+        print(f"\nNo baseline at {baseline_file}; run with --update-baseline to create one.")
+        return
+
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, tolerance)
+    if regressions:
+        print("\nRegressions:")
+        for size, stage, seconds, base in regressions:
+            print(f"  {size} {stage}: {seconds * 1000:.1f} ms (baseline {base * 1000:.1f} ms)")
+        sys.exit(1)
+    print("\nNo regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Persistent canonical merchant index.
+
+Canonical clusters (label + centroid) and the alias table mapping every raw
+name seen so far to its cluster are kept in SQLite, one set per embedding space
+and threshold. Known names are resolved by alias lookup; only unseen names are
+embedded and assigned to the nearest centroid (or start a new cluster), so labels
+stay stable across runs and each run costs O(new names). Names are embedded
+before the write lock is taken, so other writers never wait on the model.
+recluster() rebuilds the clusters from every alias when they have drifted.
+"""
+
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import metrics
+from utils_embeddings import (CLUSTER_BLOCK_SIZE, _CentroidMatrix, _cluster_greedy, default_threshold,
+                              embed_texts, embedding_space)
+
+CANONICAL_INDEX_FILE = os.path.expanduser("~/.derin_canonical.sqlite")
+
+_indexes = {}
+
+def _raw_name(name: Optional[str]) -> str:
+    return (name or "").strip() or "Unknown"
+
+class CanonicalIndex:
+    """Clusters and aliases for one (embedding space, threshold) pair"""
+
+    def __init__(self, method: str, path: str = CANONICAL_INDEX_FILE, sim_threshold: Optional[float] = None):
+        self.method = method
+        self.path = path
+        self.sim_threshold = default_threshold(method) if sim_threshold is None else sim_threshold
+        self.space = f"{embedding_space(method)}@{self.sim_threshold}"
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Autocommit mode: write transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS clusters (
+                    space TEXT NOT NULL, id INTEGER NOT NULL, label TEXT NOT NULL, centroid BLOB NOT NULL,
+                    PRIMARY KEY (space, id)
+                );
+                CREATE TABLE IF NOT EXISTS aliases (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    space TEXT NOT NULL, name TEXT NOT NULL, cluster INTEGER NOT NULL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_aliases_name ON aliases (space, name);
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _lookup(self, conn: sqlite3.Connection, names: List[str]) -> Dict[str, tuple]:
+        """name -> (cluster id, label) for names already in the alias table"""
+        found = {}
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT a.name, a.cluster, c.label FROM aliases a JOIN clusters c"
+                f" ON c.space = a.space AND c.id = a.cluster WHERE a.space = ? AND a.name IN ({marks})",
+                [self.space, *chunk],
+            )
+            for name, cluster, label in rows:
+                found[name] = (cluster, label)
+        return found
+
+    def _load_clusters(self, conn: sqlite3.Connection, dim: int):
+        rows = conn.execute("SELECT label, centroid FROM clusters WHERE space = ? ORDER BY id", (self.space,)).fetchall()
+        centroids = _CentroidMatrix(dim, capacity=len(rows) + 256)
+        for _, blob in rows:
+            centroids.append(np.frombuffer(blob, dtype=np.float32))
+        return centroids, [label for label, _ in rows]
+
+    @metrics.timed("canonical_index")
+    def canonicalize(self, names: List[Optional[str]]) -> Dict[str, str]:
+        """Map raw names (stripped, '' -> 'Unknown') to canonical labels, adding unseen names"""
+        raw = list(dict.fromkeys(_raw_name(name) for name in names))
+        if not raw:
+            return {}
+        conn = self._connect()
+        found = self._lookup(conn, raw)
+        unseen = [name for name in raw if name not in found]
+        metrics.count("alias_hits", len(found))
+        metrics.count("names_unseen", len(unseen))
+        if unseen:
+            vecs = np.asarray(embed_texts(unseen, self.method), dtype=np.float32)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another writer may have added some of them while we embedded
+                found.update(self._lookup(conn, unseen))
+                keep = [i for i, name in enumerate(unseen) if name not in found]
+                if keep:
+                    found.update(self._assign(conn, [unseen[i] for i in keep], vecs[keep]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return {name: found[name][1] for name in raw}
+
+    def _assign(self, conn: sqlite3.Connection, unseen: List[str], vecs: np.ndarray) -> Dict[str, tuple]:
+        """Cluster unseen names (embedded as vecs) against the stored centroids and persist the result"""
+        centroids, labels = self._load_clusters(conn, vecs.shape[1])
+        existing = centroids.size
+        assignment = _cluster_greedy(vecs, self.sim_threshold, centroids=centroids)
+
+        # A new cluster is labelled by the first name that created it
+        result = {}
+        for name, j in zip(unseen, assignment):
+            if j == len(labels):
+                labels.append(name)
+            result[name] = (j, labels[j])
+
+        # Stored clusters that took a new member had their centroid re-normalized
+        moved = sorted({j for j in assignment if j < existing})
+        conn.executemany(
+            "UPDATE clusters SET centroid = ? WHERE space = ? AND id = ?",
+            [(centroids.data[j].tobytes(), self.space, j) for j in moved],
+        )
+        conn.executemany(
+            "INSERT INTO clusters (space, id, label, centroid) VALUES (?, ?, ?, ?)",
+            [(self.space, j, labels[j], centroids.data[j].tobytes()) for j in range(existing, centroids.size)],
+        )
+        conn.executemany(
+            "INSERT INTO aliases (space, name, cluster) VALUES (?, ?, ?)",
+            [(self.space, name, j) for name, (j, _) in result.items()],
+        )
+        return result
+
+    def _alias_labels(self, conn: sqlite3.Connection) -> List[tuple]:
+        """(name, label) of every alias in the order the names were first seen"""
+        return conn.execute(
+            "SELECT a.name, c.label FROM aliases a JOIN clusters c ON c.space = a.space AND c.id = a.cluster"
+            " WHERE a.space = ? ORDER BY a.seq", (self.space,)
+        ).fetchall()
+
+    def recluster(self) -> Dict[str, str]:
+        """
+        Rebuild the clusters from scratch out of every alias, in the order the names
+        were first seen (see _rebuild_clusters), and label each by its first member.
+        Returns {name: new label} for every alias whose label changed.
+        """
+        conn = self._connect()
+        vectors: Dict[str, np.ndarray] = {}
+        while True:
+            names = [name for name, _ in self._alias_labels(conn)]
+            missing = [name for name in names if name not in vectors]
+            if missing:
+                vectors.update(zip(missing, np.asarray(embed_texts(missing, self.method), dtype=np.float32)))
+            conn.execute("BEGIN IMMEDIATE")
+            rows = self._alias_labels(conn)
+            if all(name in vectors for name, _ in rows):
+                break
+            # Names arrived while we embedded: embed those too, outside the lock
+            conn.execute("ROLLBACK")
+
+        try:
+            names = [name for name, _ in rows]
+            old = dict(rows)
+            conn.execute("DELETE FROM aliases WHERE space = ?", (self.space,))
+            conn.execute("DELETE FROM clusters WHERE space = ?", (self.space,))
+            if not names:
+                conn.execute("COMMIT")
+                return {}
+
+            assignment, centroids = _rebuild_clusters(np.vstack([vectors[name] for name in names]),
+                                                      self.sim_threshold)
+            labels: Dict[int, str] = {}
+            for name, j in zip(names, assignment):
+                labels.setdefault(j, name)
+
+            conn.executemany(
+                "INSERT INTO clusters (space, id, label, centroid) VALUES (?, ?, ?, ?)",
+                [(self.space, j, labels[j], centroids[j].tobytes()) for j in range(len(centroids))],
+            )
+            conn.executemany(
+                "INSERT INTO aliases (space, name, cluster) VALUES (?, ?, ?)",
+                [(self.space, name, j) for name, j in zip(names, assignment)],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return {name: labels[j] for name, j in zip(names, assignment) if labels[j] != old[name]}
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        clusters = conn.execute("SELECT COUNT(*) FROM clusters WHERE space = ?", (self.space,)).fetchone()[0]
+        aliases = conn.execute("SELECT COUNT(*) FROM aliases WHERE space = ?", (self.space,)).fetchone()[0]
+        return {"clusters": clusters, "aliases": aliases}
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def _rebuild_clusters(vecs: np.ndarray, sim_threshold: float):
+    """
+    Cluster vecs from scratch. A greedy pass seeds the clusters, then every vector is
+    re-scored against the final centroids: greedy centroids drift as members join, so
+    early members can end up far from their own cluster. Each vector moves to its most
+    similar final centroid; vectors no centroid covers any more are clustered among
+    themselves, which splits clusters that drifted apart. Returns (assignment, unit-norm
+    centroids), clusters numbered in order of their first member.
+    """
+    centroids = _CentroidMatrix(vecs.shape[1], capacity=min(len(vecs), 1024))
+    _cluster_greedy(vecs, sim_threshold, centroids=centroids)
+    seeds = centroids.active
+    assignment = np.empty(len(vecs), dtype=np.int64)
+    best = np.empty(len(vecs), dtype=vecs.dtype)
+    for start in range(0, len(vecs), CLUSTER_BLOCK_SIZE):
+        sims = vecs[start:start + CLUSTER_BLOCK_SIZE] @ seeds.T
+        assignment[start:start + len(sims)] = sims.argmax(axis=1)
+        best[start:start + len(sims)] = sims.max(axis=1)
+    loose = best < sim_threshold
+    if loose.any():
+        assignment[loose] = len(seeds) + np.asarray(_cluster_greedy(vecs[loose], sim_threshold))
+
+    # Renumber by first member, dropping clusters every member left
+    _, first, inverse = np.unique(assignment, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    assignment = rank[inverse]
+    sums = np.zeros((len(first), vecs.shape[1]), dtype=np.float64)
+    np.add.at(sums, assignment, vecs)
+    centroids = (sums / np.linalg.norm(sums, axis=1, keepdims=True)).astype(np.float32)
+    return assignment.tolist(), centroids
+
+def get_canonical_index(method: str, path: str = CANONICAL_INDEX_FILE) -> CanonicalIndex:
+    """Shared index for the current embedding space of method"""
+    key = (path, embedding_space(method), default_threshold(method))
+    if key not in _indexes:
+        _indexes[key] = CanonicalIndex(method, path=path)
+    return _indexes[key]
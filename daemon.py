@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Resident daemon: keeps the embedding model, loaded data and imports warm in one
+process and runs CLI commands for thin clients over a Unix socket.
+
+Protocol: the client sends one JSON line {"argv": [...], "cwd": ..., "env": {...}}
+and reads back one JSON object {"stdout": ..., "stderr": ..., "exit_code": ...}.
+"""
+
+import io
+import os
+import json
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+# The client side lives in daemon_client so forwarding never imports this module
+from daemon_client import SOCKET_PATH, DaemonClient
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # DaemonClient.connect() probing whether we are up
+            return
+        request = json.loads(line)
+        if request.get('argv') == ['__shutdown__']:
+            self._reply({'stdout': "Derin daemon stopping.\n", 'stderr': "", 'exit_code': 0})
+            self.server.stopping = True
+            return
+        self._reply(self.server.execute(request))
+
+    def _reply(self, response):
+        self.wfile.write(json.dumps(response).encode())
+
+class DerinDaemon(socketserver.UnixStreamServer):
+    """Single-threaded server: requests run one at a time against the shared warm state"""
+
+    def __init__(self, cli, path=SOCKET_PATH):
+        self.cli = cli
+        self.stopping = False
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+
+    def warm_up(self):
+        import utils
+        utils.CACHE_DATA = True
+        utils.load_data()
+        import utils_embeddings
+        if utils_embeddings.resolve_method(utils.CANONICALIZER) == "embeddings":
+            utils_embeddings.get_embedder().load()
+
+    def execute(self, request):
+        import click
+        import metrics
+        import utils
+        import utils_embeddings
+
+        saved = (utils.CANONICALIZER, utils.STORAGE_BACKEND, utils_embeddings.EMBEDDER, os.getcwd())
+        env = request.get('env', {})
+        utils.CANONICALIZER = env.get('DERIN_CANONICALIZER', saved[0])
+        utils.STORAGE_BACKEND = env.get('DERIN_STORAGE', saved[1])
+        utils_embeddings.EMBEDDER = env.get('DERIN_EMBEDDER', saved[2])
+        out, err = io.StringIO(), io.StringIO()
+        exit_code = 0
+        try:
+            os.chdir(request.get('cwd') or saved[3])
+            with redirect_stdout(out), redirect_stderr(err):
+                try:
+                    result = self.cli.main(args=request['argv'], prog_name='main.py', standalone_mode=False)
+                    exit_code = result if isinstance(result, int) else 0
+                except click.ClickException as exc:
+                    exc.show()
+                    exit_code = exc.exit_code
+                except click.exceptions.Exit as exc:
+                    exit_code = exc.exit_code
+                except click.Abort:
+                    print("Aborted!", file=err)
+                    exit_code = 1
+                except Exception as exc:
+                    print(f"Error: {exc}", file=err)
+                    exit_code = 1
+        finally:
+            utils.CANONICALIZER, utils.STORAGE_BACKEND, utils_embeddings.EMBEDDER = saved[:3]
+            os.chdir(saved[3])
+            # --profile in one request must not leak into the next
+            metrics.disable()
+            metrics.reset()
+        return {'stdout': out.getvalue(), 'stderr': err.getvalue(), 'exit_code': exit_code}
+
+    def serve(self):
+        try:
+            while not self.stopping:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.server_address):
+                os.unlink(self.server_address)
+
+def stop_daemon(path=SOCKET_PATH):
+    client = DaemonClient.connect(path)
+    if client is None:
+        return False
+    client.run(['__shutdown__'])
+    return True
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Thin client for the resident daemon (daemon.py). main.py imports this before
+anything else, so a forwarded command costs interpreter startup plus one
+socket round trip; keep it to standard-library modules that load quickly.
+"""
+
+import os
+import sys
+import json
+import socket
+
+SOCKET_PATH = os.path.expanduser("~/.derin.sock")
+
+# Commands that must run in the calling process
+LOCAL_COMMANDS = {'serve', 'ask', 'batch', 'sync', 'feed-server'}
+
+# Environment variables forwarded from the client
+FORWARDED_ENV = ('DERIN_CANONICALIZER', 'DERIN_STORAGE', 'DERIN_EMBEDDER')
+
+CONNECT_TIMEOUT = 0.05
+
+class DaemonClient:
+    """Connection-per-request client for a running daemon"""
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+
+    @classmethod
+    def connect(cls, path=SOCKET_PATH):
+        """Return a client if a daemon answers on path, else None"""
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+            return None
+        client = cls(path)
+        try:
+            client._open().close()
+        except OSError:
+            return None
+        return client
+
+    def _open(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(None)
+        return sock
+
+    def run(self, argv):
+        """Run a CLI command in the daemon; returns {"stdout", "stderr", "exit_code"}"""
+        return self._request(self._open(), argv)
+
+    def _request(self, sock, argv):
+        request = {
+            'argv': list(argv),
+            'cwd': os.getcwd(),
+            'env': {key: os.environ[key] for key in FORWARDED_ENV if key in os.environ}
+        }
+        with sock:
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile('rb') as f:
+                return json.loads(f.read())
+
+def forward(argv, path=SOCKET_PATH):
+    """
+    Run argv in the daemon if one is running and the command can be forwarded.
+    Returns the exit code, or None when the caller should run in-process.
+    """
+    # Without click loaded the command can't be parsed out of argv; any local
+    # command name in it keeps the run in-process, which is always correct
+    if any(arg in LOCAL_COMMANDS for arg in argv):
+        return None
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    client = DaemonClient(path)
+    try:
+        sock = client._open()
+    except OSError:
+        # Stale socket file: no daemon behind it
+        return None
+    # Once connected, the command may already be running: never fall back and run it twice
+    response = client._request(sock, argv)
+    print(response['stdout'], end='')
+    if response['stderr']:
+        print(response['stderr'], end='', file=sys.stderr)
+    return response['exit_code']
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Ingest-time transaction de-duplication.
+
+Every stored transaction has a 16-byte key: its id (scoped to the account) when
+it has one, else a fingerprint of date|amount|name|account plus its occurrence
+number among identical rows of the same batch, so two real purchases of the same
+amount at the same merchant on the same day are both kept. Keys live in a
+SQLite sidecar next to the data store, so checking a row is one primary-key
+lookup, with no scan of the stored transactions. An optional in-memory Bloom filter
+answers "definitely new" for most rows of a large import without touching SQLite.
+
+The index records a token that ingests also write into the user data; when the
+two disagree (a full save, a crash between the two writes, a copied data file),
+the index is rebuilt from the stored transactions.
+"""
+
+import os
+import uuid
+import sqlite3
+import hashlib
+
+import numpy as np
+
+import metrics
+
+# Bloom filter sizing
+BLOOM_ERROR_RATE = 0.01
+BLOOM_MIN_CAPACITY = 1_000_000
+
+def _key_text(transaction):
+    account = transaction.get('account_id') or ""
+    if transaction.get('id'):
+        return f"id|{account}|{transaction['id']}"
+    return (f"fp|{transaction.get('date', '')}|{float(transaction.get('amount', 0)):.2f}"
+            f"|{transaction.get('name', '')}|{account}")
+
+def transaction_key(transaction, occurrence=0):
+    """id-based key when the feed gives one, else a content fingerprint (and its occurrence)"""
+    text = _key_text(transaction)
+    if occurrence and text.startswith("fp|"):
+        text += f"|{occurrence}"
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def transaction_keys(transactions):
+    """Keys of a batch: the n-th row with the same fingerprint gets occurrence n"""
+    seen = {}
+    keys = []
+    for transaction in transactions:
+        text = _key_text(transaction)
+        occurrence = seen[text] = seen.get(text, -1) + 1
+        keys.append(transaction_key(transaction, occurrence))
+    return keys
+
+class BloomFilter:
+    """Bit-array Bloom filter over 16-byte keys (double hashing on the key's two halves)"""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        self.size = max(64, int(-capacity * np.log(error_rate) / np.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * np.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, keys):
+        halves = np.frombuffer(b"".join(keys), dtype=np.uint64).reshape(-1, 2)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (halves[:, :1] + steps * (halves[:, 1:] | np.uint64(1))) % np.uint64(self.size)
+
+    def add(self, keys):
+        if keys:
+            positions = self._positions(keys).ravel()
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                             np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+            self.count += len(keys)
+
+    def might_contain(self, keys):
+        """Boolean array: False means the key was never added"""
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(keys)
+        hit = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return hit.all(axis=1)
+
+class DedupIndex:
+    """Persistent set of transaction keys for one data store"""
+
+    def __init__(self, path, bloom=False):
+        self.path = path
+        self.use_bloom = bloom
+        self._bloom = None
+        self._conn = None
+        # id(transaction) -> key for rows filter() accepted, recorded by add()
+        self._accepted = {}
+        self.skipped = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """)
+            self._conn = conn
+        return self._conn
+
+    def token(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'token'").fetchone()
+        return row[0] if row else None
+
+    def is_current(self, token):
+        return token is not None and token == self.token()
+
+    @metrics.timed("dedup_rebuild")
+    def rebuild(self, transactions):
+        """Replace the keys with those of transactions; returns the new token"""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM seen")
+            conn.executemany("INSERT OR IGNORE INTO seen (key) VALUES (?)",
+                             ((key,) for key in transaction_keys(transactions)))
+            token = self._set_token(conn)
+        self._bloom = None
+        return token
+
+    def _set_token(self, conn):
+        token = uuid.uuid4().hex
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('token', ?)", (token,))
+        return token
+
+    def _get_bloom(self):
+        if self._bloom is None:
+            conn = self._connect()
+            count = conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+            self._bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, 2 * count))
+            cursor = conn.execute("SELECT key FROM seen")
+            while True:
+                rows = cursor.fetchmany(100_000)
+                if not rows:
+                    break
+                self._bloom.add([key for (key,) in rows])
+        return self._bloom
+
+    def _stored(self, keys):
+        """The subset of keys already in the index"""
+        conn = self._connect()
+        found = set()
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            found.update(key for (key,) in conn.execute(f"SELECT key FROM seen WHERE key IN ({marks})", chunk))
+        return found
+
+    @metrics.timed("dedup")
+    def filter(self, transactions):
+        """
+        Transactions not seen before, in order. A repeated id within the batch is
+        dropped; repeated fingerprints are numbered, so identical rows all count.
+        """
+        keys = transaction_keys(transactions)
+        candidates = keys
+        if self.use_bloom:
+            # Only keys the filter may have seen need an index lookup
+            maybe = self._get_bloom().might_contain(keys)
+            candidates = [key for key, hit in zip(keys, maybe) if hit]
+        stored = self._stored(candidates)
+
+        fresh, batch = [], set()
+        self._accepted = {}
+        for t, key in zip(transactions, keys):
+            if key in stored or key in batch:
+                continue
+            batch.add(key)
+            fresh.append(t)
+            self._accepted[id(t)] = key
+        skipped = len(transactions) - len(fresh)
+        self.skipped += skipped
+        metrics.count("duplicates_skipped", skipped)
+        return fresh
+
+    def add(self, transactions):
+        """Record the keys of accepted transactions, numbered as filter() saw them; returns the new token"""
+        keys = [self._accepted.get(id(t), key) for t, key in zip(transactions, transaction_keys(transactions))]
+        self._accepted = {}
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO seen (key) VALUES (?)", ((key,) for key in keys))
+            token = self._set_token(conn)
+        if self._bloom is not None:
+            self._bloom.add(keys)
+        return token
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
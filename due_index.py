@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Due-date index: bills sorted by next due date, persisted with the user data
+and updated when bills change, for logarithmic range queries.
+"""
+
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+
+# Bills due within this many days show up under "Upcoming Bills", unless the
+# user's 'upcoming_days' preference says otherwise
+UPCOMING_WINDOW_DAYS = 7
+
+def next_due_date(last_paid):
+    """Next due date (ISO string) of a monthly bill last paid on last_paid"""
+    return (datetime.fromisoformat(last_paid) + relativedelta(months=1)).date().isoformat()
+
+def build_due_index(bills):
+    """
+    Index layout: 'entries' is a list of [next_due, merchant] sorted by date,
+    'by_merchant' maps merchant -> next_due for updates.
+    """
+    entries = sorted([next_due_date(bill['last_paid']), bill['merchant']] for bill in bills)
+    return {
+        'entries': entries,
+        'by_merchant': {merchant: due for due, merchant in entries}
+    }
+
+def update_due_index(index, bills, merchants):
+    """Re-index only the given merchants (bills may have changed, appeared or disappeared)"""
+    current = {bill['merchant']: bill for bill in bills if bill['merchant'] in merchants}
+    entries, by_merchant = index['entries'], index['by_merchant']
+    for merchant in merchants:
+        old_due = by_merchant.pop(merchant, None)
+        if old_due is not None:
+            i = bisect_left(entries, [old_due, merchant])
+            if i < len(entries) and entries[i] == [old_due, merchant]:
+                del entries[i]
+        bill = current.get(merchant)
+        if bill is not None:
+            due = next_due_date(bill['last_paid'])
+            insort(entries, [due, merchant])
+            by_merchant[merchant] = due
+    return index
+
+def refresh_due_index(data, merchants=None):
+    """Bring data['due_index'] up to date after data['bills'] changed"""
+    index = data.get('due_index')
+    if index is None or merchants is None:
+        data['due_index'] = build_due_index(data.get('bills', []))
+    else:
+        update_due_index(index, data.get('bills', []), set(merchants))
+    return data['due_index']
+
+def due_between(index, start=None, end=None):
+    """[next_due, merchant] entries with start <= next_due <= end (ISO dates, inclusive)"""
+    entries = index['entries']
+    lo = 0 if start is None else bisect_left(entries, [start])
+    # Any [end, merchant] sorts after [end] but before the next date
+    hi = len(entries) if end is None else bisect_left(entries, [_day_after(end)])
+    return entries[lo:hi]
+
+def overdue(index, today=None):
+    """Entries whose next due date is before today"""
+    today = today or datetime.now().date()
+    return due_between(index, end=(today - timedelta(days=1)).isoformat())
+
+def upcoming_window(user_data):
+    """Days ahead that count as upcoming for this user"""
+    preferences = (user_data.get('user_profile') or {}).get('preferences', {})
+    return preferences.get('upcoming_days', UPCOMING_WINDOW_DAYS)
+
+def upcoming(index, now=None, days=UPCOMING_WINDOW_DAYS):
+    """
+    (merchant, next_due, days_until_due) for bills with days_until_due <= days,
+    overdue ones included. days_until_due is counted from now like the alerts always have.
+    """
+    now = now or datetime.now()
+    results = []
+    for due, merchant in due_between(index, end=(now + timedelta(days=days + 1)).date().isoformat()):
+        days_until_due = (datetime.fromisoformat(due) - now).days
+        if days_until_due <= days:
+            results.append((merchant, due, days_until_due))
+    return results
+
+def _day_after(iso_date):
+    return (datetime.fromisoformat(iso_date) + timedelta(days=1)).date().isoformat()
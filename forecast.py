@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Multi-month bill forecast.
+
+Every bill is projected month by month from its last payment (same day of the
+month, clamped to the month's last day like relativedelta), for all bills at once
+as a (bills x months) array. Amounts follow amount_trend: stable bills repeat
+their average, increasing/decreasing bills continue the least-squares slope of
+their amount_history from the last payment. The fit leaves out a last payment
+flagged as an anomaly, a fit that explains little of the history falls back to
+the average, the slope is capped at MAX_MONTHLY_TREND of the level and each
+further month adds TREND_DAMPING times the previous month's step, so no trend
+runs away however far out the horizon is. Occurrences are summed per day and
+per calendar month with bincount.
+"""
+
+from datetime import date
+from itertools import chain
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+import metrics
+
+DEFAULT_FORECAST_MONTHS = 12
+
+# Largest trend followed, as a share of the bill's level per month
+MAX_MONTHLY_TREND = 0.02
+
+# Each month's trend step is this share of the previous one (damped trend): a
+# bill never moves more than slope * TREND_DAMPING / (1 - TREND_DAMPING) from its level
+TREND_DAMPING = 0.9
+
+# Trend lines explaining less of the history than this (R^2) are not followed
+MIN_TREND_FIT = 0.5
+
+def _fit_history(bill):
+    """amount_history without a last payment flagged as an anomaly"""
+    history = bill.get('amount_history') or []
+    if bill.get('anomaly', {}).get('is_anomaly'):
+        return history[:-1]
+    return history
+
+def bill_columns(bills):
+    """(last_paid, level, slope) arrays: the amount k payments ahead is level + slope * damped_steps(k)"""
+    last_paid = np.array([bill['last_paid'][:10] for bill in bills], dtype='datetime64[D]')
+    averages = np.fromiter((bill['amount'] for bill in bills), dtype=np.float64, count=len(bills))
+    # Payment number of the last payment, counted over the full history
+    last_x = np.fromiter((len(bill.get('amount_history') or ()) - 1 for bill in bills), dtype=np.float64,
+                         count=len(bills))
+    histories = [_fit_history(bill) for bill in bills]
+    lengths = np.fromiter((len(h) for h in histories), dtype=np.int64, count=len(bills))
+    history = np.fromiter(chain.from_iterable(histories), dtype=np.float64, count=int(lengths.sum()))
+    trend = np.array([bill.get('amount_trend', 'stable') for bill in bills], dtype=object)
+    increasing, decreasing = trend == 'increasing', trend == 'decreasing'
+
+    # Least-squares line through each history against payment number 0..n-1
+    n = lengths.astype(np.float64)
+    starts = np.cumsum(lengths) - lengths
+    x = np.arange(len(history)) - np.repeat(starts, lengths)
+    nonempty = lengths > 0
+    sum_y = np.zeros(len(bills))
+    sum_xy = np.zeros(len(bills))
+    sum_yy = np.zeros(len(bills))
+    if len(history):
+        sum_y[nonempty] = np.add.reduceat(history, starts[nonempty])
+        sum_xy[nonempty] = np.add.reduceat(x * history, starts[nonempty])
+        sum_yy[nonempty] = np.add.reduceat(history * history, starts[nonempty])
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    denom = n * sum_xx - sum_x ** 2
+    spread = n * sum_yy - sum_y ** 2
+    covariance = n * sum_xy - sum_x * sum_y
+    fitted = (n >= 2) & (denom > 0)
+    slope = np.divide(covariance, denom, out=np.zeros(len(bills)), where=fitted)
+    # Share of the history's variance the line explains (a flat history has nothing to explain)
+    r_squared = np.divide(covariance ** 2, denom * spread, out=np.zeros(len(bills)), where=fitted & (spread > 1e-9))
+    # The slope only carries the detected trend's direction, and only on a good fit
+    slope = np.where(increasing, np.maximum(slope, 0), np.where(decreasing, np.minimum(slope, 0), 0.0))
+    slope = np.where(r_squared >= MIN_TREND_FIT, slope, 0.0)
+
+    # Trending bills continue from the line's value at the last payment, stable ones from the average
+    mean_y = np.divide(sum_y, n, out=averages.copy(), where=fitted)
+    mean_x = np.divide(sum_x, n, out=np.zeros(len(bills)), where=fitted)
+    level = np.where(slope != 0, mean_y + slope * (last_x - mean_x), averages)
+    # Going forward the trend is capped against that level
+    cap = MAX_MONTHLY_TREND * np.abs(level)
+    return last_paid, level, np.clip(slope, -cap, cap)
+
+def damped_steps(ahead):
+    """Trend steps accumulated k payments ahead: TREND_DAMPING + TREND_DAMPING^2 + ... + TREND_DAMPING^k"""
+    return TREND_DAMPING * (1 - TREND_DAMPING ** ahead) / (1 - TREND_DAMPING)
+
+def project(last_paid, level, slope, start, end):
+    """
+    Due dates in [start, end) for every bill. Returns flat (bill index, due date,
+    amount) arrays of the occurrences, ordered by bill then date.
+    """
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    last_month = last_paid.astype('datetime64[M]')
+    day = (last_paid - last_month.astype('datetime64[D]')).astype(np.int64)
+    # First payment that can fall in the start month, then one per month through the end month
+    first = np.maximum(1, (start.astype('datetime64[M]') - last_month).astype(np.int64))
+    span = int((end.astype('datetime64[M]') - start.astype('datetime64[M]')).astype(np.int64)) + 1
+    ahead = first[:, None] + np.arange(span)
+
+    # Work on month numbers and day numbers; the first day of each month the grid can
+    # reach comes from a small table instead of casting the whole grid to dates
+    month = last_month.astype(np.int64)[:, None] + ahead
+    low = int(month.min(initial=0))
+    month_starts = np.arange(low, int(month.max(initial=0)) + 2).astype('datetime64[M]').astype('datetime64[D]')
+    month_starts = month_starts.astype(np.int64)
+    first_day = month_starts[month - low]
+    last_day = month_starts[month - low + 1] - 1
+    due = np.minimum(first_day + day[:, None], last_day)
+
+    bill_index, column = np.nonzero((due >= start.astype(np.int64)) & (due < end.astype(np.int64)))
+    amounts = np.maximum(level[bill_index] + slope[bill_index] * damped_steps(ahead[bill_index, column]), 0.0)
+    return bill_index, due[bill_index, column].astype('datetime64[D]'), amounts
+
+def _horizon(months, start):
+    """(start, end) dates and the number of calendar months the horizon touches"""
+    start = date.fromisoformat(start) if isinstance(start, str) else (start or date.today())
+    end = start + relativedelta(months=months)
+    last_day = np.datetime64(end - relativedelta(days=1), 'D')
+    num_months = int((last_day.astype('datetime64[M]') - np.datetime64(start, 'M')).astype(np.int64)) + 1
+    return start, end, num_months
+
+def _project_bills(bills, start, end):
+    if not bills:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype='datetime64[D]'), np.zeros(0)
+    return project(*bill_columns(bills), start, end)
+
+@metrics.timed("forecast")
+def forecast_bills(bills, months=DEFAULT_FORECAST_MONTHS, start=None):
+    """
+    Project bills over [start, start + months) (start defaults to today).
+    Returns {'start', 'end', 'total', 'occurrences',
+             'months': [YYYY-MM], 'monthly_totals', 'monthly_counts',
+             'days': [YYYY-MM-DD], 'daily_totals', 'bill_totals' (aligned with bills)}.
+    Calendar months cut by the horizon are partial.
+    """
+    start, end, num_months = _horizon(months, start)
+    day0 = np.datetime64(start, 'D')
+    month0 = day0.astype('datetime64[M]')
+    num_days = (end - start).days
+
+    bill_index, due, amounts = _project_bills(bills, start, end)
+    metrics.count("occurrences", len(amounts))
+    month_index = (due.astype('datetime64[M]') - month0).astype(np.int64)
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'total': float(amounts.sum()),
+        'occurrences': len(amounts),
+        'months': np.datetime_as_string(month0 + np.arange(num_months), unit='M').tolist(),
+        'monthly_totals': np.bincount(month_index, weights=amounts, minlength=num_months).tolist(),
+        'monthly_counts': np.bincount(month_index, minlength=num_months).tolist(),
+        'days': np.datetime_as_string(day0 + np.arange(num_days), unit='D').tolist(),
+        'daily_totals': np.bincount((due - day0).astype(np.int64), weights=amounts, minlength=num_days).tolist(),
+        'bill_totals': np.bincount(bill_index, weights=amounts, minlength=len(bills)).tolist()
+    }
+
+@metrics.timed("forecast")
+def forecast_users(bills_by_user, months=DEFAULT_FORECAST_MONTHS, start=None):
+    """
+    Project every user's bills in one pass. Returns {'start', 'end', 'months',
+    'monthly_totals' (all users), 'users': {user_id: monthly totals}}.
+    """
+    start, end, num_months = _horizon(months, start)
+    month0 = np.datetime64(start, 'M')
+    users = list(bills_by_user)
+    bills = list(chain.from_iterable(bills_by_user[user] for user in users))
+    owner = np.repeat(np.arange(len(users)), [len(bills_by_user[user]) for user in users])
+
+    bill_index, due, amounts = _project_bills(bills, start, end)
+    metrics.count("occurrences", len(amounts))
+    month_index = (due.astype('datetime64[M]') - month0).astype(np.int64)
+    cells = owner[bill_index] * num_months + month_index
+    per_user = np.bincount(cells, weights=amounts, minlength=len(users) * num_months).reshape(len(users), num_months)
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'months': np.datetime_as_string(month0 + np.arange(num_months), unit='M').tolist(),
+        'monthly_totals': per_user.sum(axis=0).tolist(),
+        'users': {user: row.tolist() for user, row in zip(users, per_user)}
+    }
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Streaming bulk importer for CSV/JSONL bank exports
+"""
+
+import os
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+import metrics
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Common bank-export column names mapped to Derin's transaction fields
+FIELD_ALIASES = {
+    'id': ('id', 'transaction_id', 'txn_id', 'reference'),
+    'date': ('date', 'posted_date', 'transaction_date', 'posting_date'),
+    'amount': ('amount', 'value', 'debit'),
+    'name': ('name', 'description', 'payee', 'memo'),
+    'merchant_name': ('merchant_name', 'merchant'),
+    'account_id': ('account_id', 'account', 'account_number'),
+}
+
+_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%d.%m.%Y')
+
+def _read_lines(path, stats):
+    """Yield decoded lines, counting bytes consumed for progress reporting"""
+    with open(path, 'rb') as f:
+        for raw in f:
+            stats['bytes_read'] += len(raw)
+            yield raw.decode('utf-8-sig')
+
+def read_csv(path, stats):
+    yield from csv.DictReader(_read_lines(path, stats))
+
+def read_jsonl(path, stats):
+    for line in _read_lines(path, stats):
+        if line.strip():
+            yield json.loads(line)
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f"Cannot infer import format from '{path}'; pass it explicitly")
+
+def _parse_date(value):
+    value = (value or '').strip()
+    try:
+        return datetime.fromisoformat(value[:10]).date().isoformat()
+    except ValueError:
+        pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {value!r}")
+
+def _parse_amount(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).replace('$', '').replace(',', '').strip())
+
+def _pick(row, field):
+    for key in FIELD_ALIASES[field]:
+        value = row.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+def validate(rows, stats):
+    """Map export columns onto transaction fields, dropping rows without a usable date/amount"""
+    for row in rows:
+        stats['rows_read'] += 1
+        try:
+            transaction = {
+                'date': _parse_date(_pick(row, 'date')),
+                'amount': _parse_amount(_pick(row, 'amount')),
+            }
+        except (TypeError, ValueError):
+            stats['rows_rejected'] += 1
+            continue
+        for field in ('id', 'name', 'merchant_name', 'account_id'):
+            value = _pick(row, field)
+            if value is not None:
+                transaction[field] = str(value)
+        yield transaction
+
+def normalize_names(transactions):
+    """Collapse whitespace in transaction names before canonicalization"""
+    for transaction in transactions:
+        transaction['name'] = " ".join((transaction.get('name') or '').split()) or "Unknown"
+        yield transaction
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def stream_transactions(path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, stats=None):
+    """parse -> validate -> normalize -> chunk, without materializing the file"""
+    if stats is None:
+        stats = new_import_stats(path)
+    reader = READERS[fmt or detect_format(path)]
+    return chunked(normalize_names(validate(reader(path, stats), stats)), chunk_size)
+
+def new_import_stats(path):
+    return {
+        'rows_read': 0,
+        'rows_imported': 0,
+        'rows_rejected': 0,
+        'rows_duplicate': 0,
+        'chunks': 0,
+        'bytes_read': 0,
+        'total_bytes': os.path.getsize(path),
+    }
+
+def import_file(path, storage, ingest, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None,
+                open_dedup=None):
+    """
+    Stream an export into storage. Each chunk is canonicalized (one embedding batch),
+    grouped by ingest(data, chunk, dedup) -> touched merchants and appended with
+    save_ingest, so memory stays bounded by the chunk size plus merchant group
+    state. The storage write lock is held for the whole import.
+    open_dedup(storage, data) gives the dedup index passed to ingest, which drops
+    rows already stored from the chunk (re-importing an overlapping export).
+    """
+    stats = new_import_stats(path)
+    with storage.locked():
+        data = storage.load(storage.ingest_sections)
+        dedup = open_dedup(storage, data) if open_dedup else None
+        for chunk in stream_transactions(path, fmt=fmt, chunk_size=chunk_size, stats=stats):
+            rows = len(chunk)
+            touched = ingest(data, chunk, dedup)
+            stats['rows_duplicate'] += rows - len(chunk)
+            storage.save_ingest(data, chunk, touched)
+            # Rows now live in storage; don't accumulate them here
+            data['transactions'] = []
+            stats['rows_imported'] += len(chunk)
+            stats['chunks'] += 1
+            if progress:
+                progress(stats)
+
+    metrics.count("bytes_read", stats['bytes_read'])
+    stats['bill_count'] = len(data.get('bills', []))
+    return stats
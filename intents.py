@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Intent routing for 'ask': questions are embedded and matched against example
+phrases for each intent, then answered from aggregates precomputed once per
+data version. Routed questions and answers are cached with the aggregates, so a
+repeated question costs a dictionary lookup and a data change drops them all.
+"""
+
+import re
+from collections import OrderedDict
+from datetime import date
+
+from due_index import UPCOMING_WINDOW_DAYS, build_due_index, upcoming
+
+# Example phrasings per intent; the closest example decides the intent
+INTENT_EXAMPLES = {
+    'totals': [
+        "how much do I spend on bills each month",
+        "what is my total monthly bill amount",
+        "how many recurring bills do I have",
+        "total spending on bills",
+    ],
+    'highest_bill': [
+        "what is my highest bill",
+        "which bill is the most expensive",
+        "biggest bill",
+        "largest payment each month",
+    ],
+    'subscriptions': [
+        "what subscriptions do I have",
+        "how much do I spend on subscriptions",
+        "which streaming services am I paying for",
+        "cancel subscriptions to save money",
+    ],
+    'anomalies': [
+        "any unusual charges",
+        "did any bill increase in price",
+        "which bills went up",
+        "price increases or spikes",
+        "anything strange or suspicious on my bills",
+    ],
+    'upcoming': [
+        "what bills are due soon",
+        "upcoming payments this week",
+        "when is my next bill due",
+        "any overdue bills",
+    ],
+}
+
+# Minimum cosine similarity to trust a routed intent, per embedding method
+INTENT_THRESHOLDS = {"embeddings": 0.35, "ngram": 0.35}
+
+# Words too generic to identify a merchant mentioned in a question
+_STOP_TOKENS = {
+    'bill', 'bills', 'payment', 'payments', 'monthly', 'month', 'my', 'the', 'how', 'much',
+    'what', 'is', 'did', 'do', 'i', 'for', 'on', 'a', 'to', 'pay', 'paid', 'history',
+}
+
+# Routed questions and answers kept per data version
+CACHE_SIZE = 256
+
+_example_vectors = {}
+_aggregates = {}
+
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+def data_version(user_data):
+    """Bumped whenever bills change (see utils.bump_data_version)"""
+    version = user_data.get('data_version')
+    # Without a stored version nothing can be reused: a fresh token never matches a cached one
+    return object() if version is None else version
+
+def build_aggregates(user_data):
+    """Everything the intents answer from, computed once per data version"""
+    bills = user_data.get('bills', [])
+    subscriptions = [bill for bill in bills if bill['amount'] < 50]
+    return {
+        'version': data_version(user_data),
+        'bill_count': len(bills),
+        'total': sum(bill['amount'] for bill in bills),
+        'highest': max(bills, key=lambda x: x['amount']) if bills else None,
+        'subscriptions': subscriptions,
+        'subscription_total': sum(sub['amount'] for sub in subscriptions),
+        'anomalies': [bill for bill in bills if bill.get('anomaly', {}).get('is_anomaly')],
+        'price_alerts': user_data.get('price_alerts', []),
+        'due_index': user_data.get('due_index') or build_due_index(bills),
+        'by_merchant': {bill['merchant']: bill for bill in bills},
+        'merchant_tokens': {
+            bill['merchant']: set(_tokens(bill['merchant'])) - _STOP_TOKENS for bill in bills
+        },
+        # Only valid for this version; replaced along with the aggregates
+        'routes': OrderedDict(),
+        'answers': OrderedDict(),
+    }
+
+def get_aggregates(user_data, source=None):
+    """
+    Aggregates for user_data, reused while it comes from the same store (source,
+    e.g. backend and path) at the same data version
+    """
+    key = (source, user_data.get('store_id'), data_version(user_data))
+    cached = _aggregates.get('current')
+    if cached is None or cached[0] != key:
+        cached = (key, build_aggregates(user_data))
+        _aggregates['current'] = cached
+    return cached[1]
+
+def _tokens(text):
+    return [tok for tok in re.split(r"[^a-z0-9]+", text.lower()) if tok]
+
+def _intent_vectors(method):
+    """(labels, example matrix) for the method, embedded once per process"""
+    if method not in _example_vectors:
+        from utils_embeddings import embed_texts
+        labels, phrases = [], []
+        for intent, examples in INTENT_EXAMPLES.items():
+            labels.extend([intent] * len(examples))
+            phrases.extend(examples)
+        _example_vectors[method] = (labels, embed_texts(phrases, method=method))
+    return _example_vectors[method]
+
+def route(question, aggregates, method):
+    """Return (intent, merchant) for a question; intent is None when nothing matches well"""
+    from utils_embeddings import embed_texts, resolve_method
+
+    method = resolve_method(method)
+    normalized = " ".join(_tokens(question))
+    cache = aggregates['routes']
+    key = (method, normalized)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    # A named merchant beats any generic intent
+    question_tokens = set(normalized.split())
+    for merchant, tokens in aggregates['merchant_tokens'].items():
+        if tokens & question_tokens:
+            return _remember(cache, key, ('merchant_history', merchant))
+
+    labels, vectors = _intent_vectors(method)
+    sims = vectors @ embed_texts([question], method=method)[0]
+    best = int(sims.argmax())
+    intent = labels[best] if sims[best] >= INTENT_THRESHOLDS[method] else None
+    return _remember(cache, key, (intent, None))
+
+def _answer(intent, merchant, agg, user_name, upcoming_days=UPCOMING_WINDOW_DAYS):
+    if intent == 'totals':
+        return f"Hi {user_name}! You have {agg['bill_count']} recurring bills totaling ${agg['total']:.2f}/month."
+    if intent == 'highest_bill':
+        if not agg['highest']:
+            return "You don't have any recurring bills yet."
+        highest = agg['highest']
+        return f"Your highest bill is {highest['merchant']} at ${highest['amount']:.2f}."
+    if intent == 'subscriptions':
+        if not agg['subscriptions']:
+            return "I didn't find any subscriptions under $50/month."
+        lines = [f"You're spending ${agg['subscription_total']:.2f}/month on subscriptions:"]
+        lines += [f"  - {sub['merchant']}: ${sub['amount']:.2f}/month" for sub in agg['subscriptions']]
+        lines.append("Consider reviewing these services.")
+        return "\n".join(lines)
+    if intent == 'anomalies':
+        lines = [f"{bill['merchant']} has increased unusually. Please review the alerts for details."
+                 for bill in agg['anomalies']]
+        lines += [f"{alert['merchant']} charged ${alert['amount']:.2f} on {alert['date']}, well above its usual ${alert['median']:.2f}."
+                  for alert in agg['price_alerts'][-5:]]
+        return "\n".join(lines) or "No unusual price increases detected."
+    if intent == 'upcoming':
+        due = upcoming(agg['due_index'], days=upcoming_days)
+        if not due:
+            return f"Nothing is due in the next {upcoming_days} days."
+        lines = []
+        for name, next_due, days in due:
+            bill = agg['by_merchant'][name]
+            when = "overdue" if days <= 0 else f"due in {days} days"
+            lines.append(f"{name}: ${bill['amount']:.2f} {when} ({next_due})")
+        return "\n".join(lines)
+    if intent == 'merchant_history':
+        bill = agg['by_merchant'][merchant]
+        history = ", ".join(f"${amount:.2f}" for amount in bill.get('amount_history', []))
+        return (f"{merchant}: ${bill['amount']:.2f}/month on average over {bill['transaction_count']} payments "
+                f"(last paid {bill['last_paid']}, trend {bill.get('amount_trend', 'stable')}). History: {history}.")
+    return None
+
+def answer_question(user_data, question, method, user_name, upcoming_days=UPCOMING_WINDOW_DAYS, source=None):
+    """
+    Answer from precomputed aggregates; None if the question matched no intent.
+    upcoming_days is how far ahead 'upcoming' questions look; source identifies the
+    store user_data was loaded from.
+    """
+    agg = get_aggregates(user_data, source)
+    intent, merchant = route(question, agg, method)
+    if intent is None:
+        return None
+    cache = agg['answers']
+    key = (intent, merchant)
+    if intent == 'upcoming':
+        # Days until due change daily even when the data doesn't
+        key += (date.today(), upcoming_days)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    return _remember(cache, key, _answer(intent, merchant, agg, user_name, upcoming_days))
@@ -3,23 +3,66 @@
 Derin - AI Financial Companion for Recurring Bills
 """
 
+import sys
+
+if __name__ == "__main__":
+    # Thin client: hand the command to a running daemon before importing click,
+    # numpy or any of Derin's modules, else fall through and run in-process
+    from daemon_client import forward
+    _exit_code = forward(sys.argv[1:])
+    if _exit_code is not None:
+        sys.exit(_exit_code)
+
 import click
+import json
+import metrics
+import utils
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 # Import utility functions
-from utils import load_data, save_data, detect_recurring_bills, get_insight
+from utils import (load_data, save_data, get_storage, detect_recurring_bills, ingest_transactions, build_bill_groups,
+                   bump_data_version, get_insight, open_dedup_index, invalidate_dedup_index)
+from storage import JsonStorage, SqliteStorage, SnapshotStorage, migrate_json_to_sqlite, export_snapshot, import_snapshot
+from importer import import_file, DEFAULT_CHUNK_SIZE
 from dummy_data import get_sample_transactions
+from daemon_client import DaemonClient
+from due_index import build_due_index, refresh_due_index, next_due_date, upcoming, upcoming_window
 
 @click.group()
-def cli():
+@click.option('--canonicalizer', type=click.Choice(['embeddings', 'ngram']), default=None,
+              help="Merchant-name canonicalizer (default: $DERIN_CANONICALIZER or 'embeddings').")
+@click.option('--embedder', type=click.Choice(['transformer', 'quantized', 'hashing']), default=None,
+              help="Embedding backend for the 'embeddings' canonicalizer (default: $DERIN_EMBEDDER or 'transformer').")
+@click.option('--storage', type=click.Choice(['json', 'sqlite', 'snapshot']), default=None,
+              help="Storage backend (default: $DERIN_STORAGE or 'json').")
+@click.option('--profile', is_flag=True, help="Print per-stage timings, counters and peak memory.")
+@click.option('--metrics-file', type=click.Path(dir_okay=False), default=None,
+              help="Write the same metrics as JSON to this file.")
+@click.pass_context
+def cli(ctx, canonicalizer, embedder, storage, profile, metrics_file):
     """Derin - AI Financial Companion for Recurring Bills"""
-    pass
+    if profile or metrics_file:
+        metrics.enable()
+
+        def emit():
+            if profile:
+                click.echo(metrics.report(), err=True)
+            if metrics_file:
+                metrics.write(metrics_file, command=ctx.invoked_subcommand)
+        ctx.call_on_close(emit)
+    if canonicalizer:
+        utils.CANONICALIZER = canonicalizer
+    if embedder:
+        # Only importing utils_embeddings (numpy) when a backend is actually chosen
+        import utils_embeddings
+        utils_embeddings.EMBEDDER = embedder
+    if storage:
+        utils.STORAGE_BACKEND = storage
 
 @cli.command()
 def bills():
     """Show all detected recurring bills"""
-    data = load_data()
+    data = load_data(sections=('bills', 'due_index'))
     bills = data.get('bills', [])
     
     if not bills:
@@ -31,9 +74,11 @@ def bills():
     print(f"{'Merchant':<35} {'Amount':<12} {'Type':<15} {'Last Paid':<12} {'Next Due':<12}")
     print("-" * 90)
     
+    due_by_merchant = (data.get('due_index') or build_due_index(bills))['by_merchant']
     for bill in bills:
         last_paid = datetime.fromisoformat(bill['last_paid']).strftime('%m/%d/%y')
-        next_due = (datetime.fromisoformat(bill['last_paid']) + relativedelta(months=1)).strftime('%m/%d/%y')
+        next_due = due_by_merchant.get(bill['merchant']) or next_due_date(bill['last_paid'])
+        next_due = datetime.fromisoformat(next_due).strftime('%m/%d/%y')
         
         # Shorten long names
         merchant_name = bill['merchant'][:32] + "..." if len(bill['merchant']) > 35 else bill['merchant']
@@ -45,12 +90,17 @@ def bills():
     print("-" * 90)
     print(f"Total Monthly Bills: ${total:.2f}")
 
+# What answering a question needs loaded
+ASK_SECTIONS = ('bills', 'due_index', 'price_alerts', 'data_version', 'user_profile', 'store_id')
+
 @cli.command()
 def ask():
     """Ask Derin about your bills and financial health"""
-    data = load_data()
+    # With a daemon running, each answer is a round trip to the warm process
+    client = DaemonClient.connect()
+    data = None if client else load_data(sections=ASK_SECTIONS)
     
-    if not data.get('bills'):
+    if data is not None and not data.get('bills'):
         print("No bills detected yet. Run 'python main.py demo' first.")
         return
     
@@ -62,13 +112,28 @@ def ask():
             break
         
         if question:
-            insight = get_insight(data, question)
-            print(f"\nDerin's Response: {insight}")
+            if client:
+                print(client.run(['answer', question])['stdout'], end='')
+            else:
+                insight = get_insight(data, question)
+                print(f"\nDerin's Response: {insight}")
+
+@cli.command(hidden=True)
+@click.argument('question')
+def answer(question):
+    """Answer a single question (used by 'ask' through the daemon)"""
+    data = load_data(sections=ASK_SECTIONS)
+    if not data.get('bills'):
+        print("No bills detected yet. Run 'python main.py demo' first.")
+        return
+    print(f"\nDerin's Response: {get_insight(data, question)}")
 
 @cli.command()
-def alerts():
+@click.option('--days', 'window_days', type=click.IntRange(min=0), default=None,
+              help="Show bills due within this many days (default: the 'upcoming_days' preference, or 7).")
+def alerts(window_days):
     """Show smart alerts and subscription insights"""
-    data = load_data()
+    data = load_data(sections=('bills', 'due_index', 'price_alerts', 'user_profile'))
     bills = data.get('bills', [])
     
     if not bills:
@@ -89,25 +154,32 @@ def alerts():
             avg_amt = sum(bill['amount_history'][:-1]) / len(bill['amount_history'][:-1]) if len(bill['amount_history']) > 1 else bill['amount']
             increase = last_amt - avg_amt
             print(f"UNUSUAL PRICE: {bill['merchant']} charged ${last_amt:.2f} (usually ${avg_amt:.2f}, +${increase:.2f}). This is unusually higher than normal.")
+    
+    # Spikes flagged on arrival by ingest/import, for merchants not reported above
+    reported = {bill['merchant'] for bill in bills if bill.get('anomaly', {}).get('is_anomaly')}
+    for alert in data.get('price_alerts', [])[-5:]:
+        if alert['merchant'] not in reported:
+            found_anom = True
+            print_price_alert(alert)
     if not found_anom:
         print("No unusual price increases detected.")
     
     # Check for upcoming bills
     print("\nUpcoming Bills:")
-    today = datetime.now()
+    preferences = data.get('user_profile', {}).get('preferences', {})
+    due_soon_days = preferences.get('alert_days_before', 3)
+    window = upcoming_window(data) if window_days is None else window_days
+    due_index = data.get('due_index') or build_due_index(bills)
+    bills_by_merchant = {bill['merchant']: bill for bill in bills}
     alerts = []
     
-    for bill in bills:
-        last_paid = datetime.fromisoformat(bill['last_paid'])
-        next_due = last_paid + relativedelta(months=1)
-        days_until_due = (next_due - today).days
-        
-        if days_until_due <= 7:  # Due within a week
-            alerts.append({
-                'bill': bill,
-                'days_until_due': days_until_due,
-                'next_due': next_due
-            })
+    # Due within the window (overdue included), straight from the sorted index
+    for merchant, next_due, days_until_due in upcoming(due_index, days=window):
+        alerts.append({
+            'bill': bills_by_merchant[merchant],
+            'days_until_due': days_until_due,
+            'next_due': next_due
+        })
     
     if alerts:
         for alert in alerts:
@@ -116,7 +188,7 @@ def alerts():
             
             if days <= 0:
                 status = "OVERDUE"
-            elif days <= 3:
+            elif days <= due_soon_days:
                 status = "DUE SOON"
             else:
                 status = "UPCOMING"
@@ -136,6 +208,41 @@ def alerts():
         
         print(f"\nTIP: Consider reviewing these services - you could save ${total_subscriptions:.2f}/month if you cancel unused ones!")
 
+@cli.command()
+@click.option('--months', type=click.IntRange(min=1), default=None,
+              help="Months to project (default: 12).")
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="First day of the forecast (default: today).")
+@click.option('--daily', is_flag=True, help="Also list every day with bills due.")
+def forecast(months, start, daily):
+    """Project your bills over the coming months"""
+    # Imported here: forecast pulls in numpy, which the other read commands don't need
+    from forecast import DEFAULT_FORECAST_MONTHS, forecast_bills
+
+    months = months or DEFAULT_FORECAST_MONTHS
+    data = load_data(sections=('bills',))
+    bills = data.get('bills', [])
+
+    if not bills:
+        print("No recurring bills detected yet. Run 'python main.py demo' to load sample data.")
+        return
+
+    result = forecast_bills(bills, months=months, start=start.date() if start else None)
+    print(f"\nBill Forecast {result['start']} to {result['end']} (trending bills follow their trend):")
+    print("-" * 40)
+    print(f"{'Month':<12} {'Bills Due':<12} {'Total':<12}")
+    print("-" * 40)
+    for month, count, total in zip(result['months'], result['monthly_counts'], result['monthly_totals']):
+        print(f"{month:<12} {count:<12} ${total:<11.2f}")
+    print("-" * 40)
+    print(f"Total over {months} months: ${result['total']:.2f}")
+
+    if daily:
+        print("\nBy Day:")
+        for day, total in zip(result['days'], result['daily_totals']):
+            if total:
+                print(f"  {day}  ${total:.2f}")
+
 @cli.command()
 def demo():
     """Load demo data to showcase the AI companion features"""
@@ -147,11 +254,17 @@ def demo():
     # Load data and add sample transactions
     data = load_data()
     data['transactions'] = sample_transactions
+    # Alerts point at transactions that are gone now
+    data['price_alerts'] = []
     
     # Detect recurring bills
     print("AI is analyzing your transactions for recurring bills...")
-    detected_bills = detect_recurring_bills(data['transactions'])
+    bill_groups = {}
+    detected_bills = detect_recurring_bills(data['transactions'], groups=bill_groups)
     data['bills'] = detected_bills
+    data['bill_groups'] = bill_groups
+    refresh_due_index(data)
+    bump_data_version(data)
     
     save_data(data)
     
@@ -174,5 +287,275 @@ def demo():
     print("  • python main.py ask - Chat with Derin")
     print("  • python main.py alerts - See bill alerts")
 
+def print_price_alert(alert):
+    print(f"PRICE SPIKE: {alert['merchant']} charged ${alert['amount']:.2f} on {alert['date']} "
+          f"(typically ${alert['median']:.2f}, score {alert['score']:.1f})")
+
+@cli.command()
+@click.argument('transactions_file', type=click.Path(exists=True, dir_okay=False))
+def ingest(transactions_file):
+    """Append new transactions from a JSON file and update affected bills"""
+    with open(transactions_file, 'r') as f:
+        new_transactions = json.load(f)
+
+    storage = get_storage()
+    with storage.locked():
+        data = storage.load(storage.ingest_sections)
+        bill_count = len(data.get('bills', []))
+        received = len(new_transactions)
+        touched = ingest_transactions(data, new_transactions, on_price_alert=print_price_alert,
+                                      dedup=open_dedup_index(storage, data))
+        storage.save_ingest(data, new_transactions, touched)
+
+    print(f"Ingested {len(new_transactions)} transactions across {len(touched)} merchants.")
+    if received > len(new_transactions):
+        print(f"Skipped {received - len(new_transactions)} transactions already stored.")
+    print(f"Recurring bills: {bill_count} -> {len(data['bills'])}")
+
+@cli.command(name='import')
+@click.argument('export_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help="Export format (default: inferred from the file extension).")
+@click.option('--chunk-size', type=click.IntRange(min=1), default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help="Transactions canonicalized and written per batch.")
+def import_cmd(export_file, fmt, chunk_size):
+    """Stream a CSV/JSONL bank export into Derin"""
+    def report(stats):
+        percent = 100.0 * stats['bytes_read'] / stats['total_bytes'] if stats['total_bytes'] else 100.0
+        print(f"  {percent:5.1f}%  {stats['rows_imported']} imported, {stats['rows_duplicate']} duplicate, "
+              f"{stats['rows_rejected']} rejected")
+
+    print(f"Importing {export_file} in chunks of {chunk_size}...")
+    def ingest(data, chunk, dedup):
+        return ingest_transactions(data, chunk, on_price_alert=print_price_alert, dedup=dedup)
+
+    stats = import_file(export_file, get_storage(), ingest, fmt=fmt,
+                        chunk_size=chunk_size, progress=report, open_dedup=open_dedup_index)
+
+    print(f"Imported {stats['rows_imported']} of {stats['rows_read']} rows "
+          f"({stats['rows_duplicate']} already stored, {stats['rows_rejected']} rejected).")
+    print(f"Recurring bills: {stats['bill_count']}")
+
+@cli.command()
+@click.argument('account_ids', nargs=-1)
+@click.option('--url', required=True, help="Base URL of the bank feed.")
+@click.option('--provider', default='local', show_default=True, help="Feed provider (selects its rate limit).")
+@click.option('--all', 'discover', is_flag=True, help="Connect every account the feed offers.")
+def connect(account_ids, url, provider, discover):
+    """Add bank-feed accounts to your connected accounts"""
+    import asyncio
+    from bank_sync import discover_accounts
+
+    if discover:
+        account_ids = asyncio.run(discover_accounts(url))
+    if not account_ids:
+        raise click.UsageError("Give account ids or --all.")
+
+    storage = get_storage()
+    with storage.locked():
+        data = storage.load(storage.ingest_sections)
+        accounts = data.setdefault('user_profile', {}).setdefault('connected_accounts', [])
+        known = {account['account_id'] for account in accounts}
+        added = [account_id for account_id in account_ids if account_id not in known]
+        accounts.extend({'account_id': account_id, 'provider': provider, 'url': url, 'cursor': None}
+                        for account_id in added)
+        storage.save_ingest(data, [], [])
+    print(f"Connected {len(added)} accounts ({len(accounts)} total). Run 'python main.py sync' to pull transactions.")
+
+@cli.command()
+@click.option('--page-size', type=click.IntRange(min=1), default=500, show_default=True,
+              help="Transactions requested per page.")
+@click.option('--concurrency', type=click.IntRange(min=1), default=256, show_default=True,
+              help="Accounts pulled at once.")
+@click.option('--queue-size', type=click.IntRange(min=1), default=64, show_default=True,
+              help="Pages buffered ahead of ingest.")
+def sync(page_size, concurrency, queue_size):
+    """Pull new transactions from every connected account"""
+    from bank_sync import run_sync
+
+    storage = get_storage()
+    with storage.locked():
+        data = storage.load(storage.ingest_sections)
+        accounts = data.get('user_profile', {}).get('connected_accounts', [])
+        if not accounts:
+            print("No connected accounts. Add some with 'python main.py connect'.")
+            return
+        bill_count = len(data.get('bills', []))
+        # Feeds can resend rows around a cursor; the dedup index drops them
+        dedup = open_dedup_index(storage, data)
+        # An account's first sync pulls its whole history, which is no news
+        first_sync = {account['account_id'] for account in accounts if not account.get('cursor')}
+
+        def ingest(account, transactions):
+            touched = ingest_transactions(data, transactions, on_price_alert=print_price_alert, dedup=dedup,
+                                          backfill=account['account_id'] in first_sync)
+            # The page and the account's advanced cursor are saved together
+            storage.save_ingest(data, transactions, touched)
+            data['transactions'] = []
+
+        print(f"Syncing {len(accounts)} accounts...")
+        # ingest runs on this thread, which holds the storage lock, while pages are fetched
+        summaries = run_sync(accounts, ingest, page_size=page_size,
+                             concurrency=concurrency, queue_size=queue_size)
+        # Cursors of accounts whose last page was empty
+        storage.save_ingest(data, [], [])
+
+    for summary in summaries:
+        if 'error' in summary:
+            print(f"  {summary['account_id']}: FAILED ({summary['error']})")
+    rows = sum(summary['transactions'] for summary in summaries)
+    failed = sum(1 for summary in summaries if 'error' in summary)
+    print(f"Synced {rows} transactions from {len(summaries) - failed} accounts ({failed} failed).")
+    if dedup is not None and dedup.skipped:
+        print(f"Skipped {dedup.skipped} transactions already stored.")
+    print(f"Recurring bills: {bill_count} -> {len(data.get('bills', []))}")
+
+@cli.command(name='feed-server')
+@click.option('--port', type=int, default=8765, show_default=True)
+@click.option('--accounts', type=click.IntRange(min=1), default=10, show_default=True)
+@click.option('--rows', type=click.IntRange(min=0), default=200, show_default=True,
+              help="Transactions per account.")
+@click.option('--latency', type=float, default=0.0, show_default=True, help="Seconds added to every response.")
+@click.option('--error-rate', type=click.FloatRange(0, 1), default=0.0, show_default=True,
+              help="Share of requests answered with 429/503.")
+def feed_server(port, accounts, rows, latency, error_rate):
+    """Run a local stand-in bank feed for testing sync"""
+    import asyncio
+    from bank_sync import FeedServer
+
+    async def run():
+        server = await FeedServer(accounts, rows, latency, error_rate).start(port=port)
+        print(f"Serving {accounts} accounts on http://127.0.0.1:{port} (Ctrl-C to stop)")
+        print(f"Connect them with: python main.py connect --all --url http://127.0.0.1:{port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+@cli.command()
+@click.argument('input_dir', type=click.Path(exists=True, file_okay=False))
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help="Worker processes (default: one per CPU).")
+@click.option('--max-pending', type=click.IntRange(min=1), default=None,
+              help="Users queued at once (default: 2 x workers).")
+@click.option('--forecast-months', type=click.IntRange(min=1), default=None,
+              help="Also project every user's bills over this many months (written to _forecast.json).")
+def batch(input_dir, output_dir, workers, max_pending, forecast_months):
+    """Detect bills for every per-user transaction file in INPUT_DIR"""
+    from batch import run_batch, forecast_batch
+
+    def report(summary):
+        if 'error' in summary:
+            print(f"  {summary['user_id']}: FAILED ({summary['error']})")
+        else:
+            print(f"  {summary['user_id']}: {summary['bills']} bills from {summary['transactions']} transactions")
+
+    summaries = run_batch(input_dir, output_dir, workers=workers, max_pending=max_pending, on_result=report)
+    failed = sum(1 for summary in summaries if 'error' in summary)
+    print(f"Processed {len(summaries)} users ({failed} failed). Results in {output_dir}")
+    if forecast_months:
+        result = forecast_batch(summaries, output_dir, forecast_months)
+        print(f"Forecast {result['start']} to {result['end']} for {len(result['users'])} users: "
+              f"${sum(result['monthly_totals']):.2f} in bills. Written to {result['output']}")
+
+@cli.command()
+def migrate():
+    """Copy ~/.derin_bills.json into the SQLite store (~/.derin_bills.db)"""
+    json_storage = get_storage('json')
+    if not json_storage.exists():
+        print(f"Nothing to migrate: {json_storage.path} does not exist.")
+        return
+
+    sqlite_storage = SqliteStorage(utils.SQLITE_FILE)
+    data = migrate_json_to_sqlite(json_storage, sqlite_storage, build_groups=build_bill_groups)
+    print(f"Migrated {len(data.get('transactions', []))} transactions and {len(data.get('bills', []))} bills to {sqlite_storage.path}.")
+    print("Use --storage sqlite or export DERIN_STORAGE=sqlite to read from it.")
+
+@cli.command(name='export-snapshot')
+@click.option('--source', type=click.Choice(['json', 'sqlite']), default='json', show_default=True,
+              help="Backend to read from.")
+def export_snapshot_cmd(source):
+    """Write the stored data into the memory-mapped snapshot (~/.derin_snapshot)"""
+    source_storage = get_storage(source)
+    if not source_storage.exists():
+        print(f"Nothing to export: {source_storage.path} does not exist.")
+        return
+
+    snapshot = SnapshotStorage(utils.SNAPSHOT_DIR)
+    data = export_snapshot(source_storage, snapshot, build_groups=build_bill_groups)
+    print(f"Exported {len(data.get('transactions', []))} transactions and {len(data.get('bills', []))} bills to {snapshot.path}.")
+    print("Use --storage snapshot or export DERIN_STORAGE=snapshot to read from it.")
+
+@cli.command(name='import-snapshot')
+@click.option('--target', type=click.Choice(['json', 'sqlite']), default='json', show_default=True,
+              help="Backend to write to.")
+def import_snapshot_cmd(target):
+    """Write the memory-mapped snapshot back into the JSON (or SQLite) store"""
+    snapshot = SnapshotStorage(utils.SNAPSHOT_DIR)
+    if not snapshot.exists():
+        print(f"Nothing to import: {snapshot.path} does not exist.")
+        return
+
+    target_storage = JsonStorage(utils.DATA_FILE) if target == 'json' else SqliteStorage(utils.SQLITE_FILE)
+    data = import_snapshot(snapshot, target_storage)
+    print(f"Imported {len(data['transactions'])} transactions and {len(data.get('bills', []))} bills into {target_storage.path}.")
+
+@cli.command(name='canonical-index')
+@click.option('--recluster', is_flag=True,
+              help="Rebuild the merchant clusters from scratch out of every known name and re-detect bills.")
+def canonical_index_cmd(recluster):
+    """Show or rebuild the persistent canonical merchant index"""
+    from canonical_index import get_canonical_index
+
+    index = get_canonical_index(utils.CANONICALIZER)
+    stats = index.stats()
+    print(f"Canonical index {index.space}: {stats['clusters']} merchants, {stats['aliases']} known names")
+    if not recluster:
+        return
+
+    renamed = index.recluster()
+    stats = index.stats()
+    print(f"Reclustered into {stats['clusters']} merchants; {len(renamed)} names changed merchant.")
+    if not renamed:
+        return
+
+    # Stored transactions carry the old labels: re-detect so groups and bills follow the new ones
+    storage = get_storage()
+    with storage.locked():
+        data = storage.load()
+        bill_groups = {}
+        data['bills'] = detect_recurring_bills(data.get('transactions', []), groups=bill_groups)
+        data['bill_groups'] = bill_groups
+        # Alerts carry the old merchant labels
+        data['price_alerts'] = []
+        refresh_due_index(data)
+        bump_data_version(data)
+        invalidate_dedup_index(data)
+        storage.save(data)
+    print(f"Recurring bills: {len(data['bills'])}")
+
+@cli.command()
+@click.option('--stop', is_flag=True, help="Stop a running daemon.")
+def serve(stop):
+    """Run the resident daemon that keeps the model and data warm"""
+    from daemon import DerinDaemon, SOCKET_PATH, stop_daemon
+
+    if stop:
+        print("Derin daemon stopped." if stop_daemon() else "No daemon is running.")
+        return
+    if DaemonClient.connect():
+        print(f"A Derin daemon is already running on {SOCKET_PATH}.")
+        return
+
+    server = DerinDaemon(cli)
+    print("Warming up (model and data)...")
+    server.warm_up()
+    print(f"Derin daemon listening on {SOCKET_PATH} (stop with 'python main.py serve --stop').")
+    server.serve()
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
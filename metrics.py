@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Lightweight built-in instrumentation: stage timers, counters and peak memory.
+
+Everything is a no-op until enable() is called (the CLI's --profile/--metrics-file).
+"""
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+_enabled = False
+_started = None
+_stages = {}
+_counters = {}
+
+def enable():
+    global _enabled, _started
+    _enabled = True
+    _started = time.perf_counter()
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+@contextmanager
+def stage(name):
+    """Time a block under name; nested stages are timed independently"""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        entry['calls'] += 1
+        entry['seconds'] += time.perf_counter() - start
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def peak_memory_bytes():
+    """Peak resident set size of this process, or None where unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def snapshot():
+    return {
+        'wall_seconds': (time.perf_counter() - _started) if _started else 0.0,
+        'stages': {name: dict(entry) for name, entry in _stages.items()},
+        'counters': dict(_counters),
+        'peak_memory_bytes': peak_memory_bytes(),
+        'pid': os.getpid()
+    }
+
+def report():
+    """Human-readable summary of the current snapshot"""
+    snap = snapshot()
+    lines = ["", "Profile:", "-" * 50, f"{'Stage':<28} {'Calls':>6} {'Time (ms)':>12}", "-" * 50]
+    for name, entry in sorted(snap['stages'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append(f"{name:<28} {entry['calls']:>6} {entry['seconds'] * 1000:>12.1f}")
+    lines.append("-" * 50)
+    for name, value in sorted(snap['counters'].items()):
+        lines.append(f"{name:<35} {value:>14,}")
+    if snap['peak_memory_bytes'] is not None:
+        lines.append(f"{'peak_memory_mb':<35} {snap['peak_memory_bytes'] / 2**20:>14.1f}")
+    lines.append(f"{'wall_ms':<35} {snap['wall_seconds'] * 1000:>14.1f}")
+    return "\n".join(lines)
+
+def write(path, command=None):
+    """Write the snapshot as JSON (one object per run)"""
+    snap = snapshot()
+    snap['command'] = command
+    snap['timestamp'] = time.time()
+    with open(path, 'w') as f:
+        json.dump(snap, f, indent=2)
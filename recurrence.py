@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Columnar (NumPy) recurrence detection core.
+
+Transactions are sorted once by (merchant id, date) and every per-merchant check
+from utils.evaluate_bill_group -- monthly gaps, amount variance, trend and the MAD
+anomaly score -- is computed with segmented array operations over all merchants.
+Sums are accumulated position by position across merchants so they round exactly
+like Python's left-to-right sum(), keeping the bill dicts identical. Dates keep
+their time of day when they have one, and a gap is the whole days between two
+payments, rounded down like datetime subtraction's .days.
+"""
+
+import numpy as np
+
+import metrics
+from anomaly import ANOMALY_Z_THRESHOLD
+
+MIN_BILL_AMOUNT = 5
+MIN_GAP_DAYS = 25
+MAX_GAP_DAYS = 35
+MAX_VARIANCE_RATIO = 0.8
+
+def _segment_starts(sorted_ids):
+    """Start offsets and lengths of runs of equal ids in a sorted array"""
+    if len(sorted_ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_ids)])
+    return starts, counts
+
+def _sequential_sums(values, starts, lengths):
+    """Per-segment sum of values[start:start+length], added left to right like sum()"""
+    acc = np.zeros(len(starts), dtype=np.float64)
+    for k in range(int(lengths.max(initial=0))):
+        live = lengths > k
+        acc[live] += values[starts[live] + k]
+    return acc
+
+def _segment_median(values, seg_ids, starts, counts):
+    """Per-segment median (mean of the two middle values for even lengths)"""
+    order = np.lexsort((values, seg_ids))
+    ordered = values[order]
+    lo = starts + (counts - 1) // 2
+    hi = starts + counts // 2
+    return (ordered[lo] + ordered[hi]) / 2
+
+def _date_strings(strs, days, start, end):
+    """Date strings of sorted rows start:end, formatted from days when no originals were given"""
+    if strs is not None:
+        return strs[start:end].tolist()
+    return np.datetime_as_string(days[start:end], unit='D').tolist()
+
+@metrics.timed("anomaly")
+def robust_anomaly_scores(amounts, seg_ids, starts, counts, z_thresh=ANOMALY_Z_THRESHOLD):
+    """Vectorized robust_anomaly_flag for every segment (amounts in date order)"""
+    med = _segment_median(amounts, seg_ids, starts, counts)
+    abs_dev = np.abs(amounts - med[seg_ids])
+    mad = _segment_median(abs_dev, seg_ids, starts, counts)
+    mad = np.where(mad == 0, 1e-6, mad)  # avoid divide-by-zero
+    last = amounts[starts + counts - 1]
+    scores = 0.6745 * (last - med) / mad
+    short = counts < 3
+    scores = np.where(short, 0.0, scores)
+    return (~short) & (np.abs(scores) > z_thresh), scores
+
+@metrics.timed("recurrence")
+def detect_bills_columnar(merchant_ids, labels, dates, amounts, date_strings=None,
+                          classify_many=None, with_groups=False):
+    """
+    merchant_ids: int array of canonical merchant ids (any numbering; labels may hold unused names)
+    labels: merchant name per id
+    dates: datetime64 array (day resolution, or finer when times of day matter; see parse_dates)
+    amounts: signed float array
+    date_strings: original date strings per row (kept verbatim in last_paid/group state);
+                  when omitted, dates are reported as YYYY-MM-DD
+    Returns (bills, groups) where groups is the utils bill group state when with_groups is set.
+    """
+    merchant_ids = np.asarray(merchant_ids, dtype=np.int64)
+    dates = np.asarray(dates)
+    if dates.dtype.kind != 'M':
+        dates = dates.astype('datetime64[D]')
+    amounts = np.abs(np.asarray(amounts, dtype=np.float64))
+    if date_strings is not None:
+        date_strings = np.asarray(date_strings, dtype=object)
+
+    with metrics.stage("group"):
+        # Skip very small amounts (likely not bills); stable sort by (merchant, date)
+        keep = np.flatnonzero(amounts >= MIN_BILL_AMOUNT)
+        order = keep[np.lexsort((dates[keep], merchant_ids[keep]))]
+        ids, days, amts = merchant_ids[order], dates[order], amounts[order]
+        # Without original strings, dates are formatted only for the rows that are reported
+        strs = date_strings[order] if date_strings is not None else None
+        starts, counts = _segment_starts(ids)
+        # Merchants are reported in order of their first kept row, like the dict-based grouping
+        rank = np.argsort(np.minimum.reduceat(order, starts), kind='stable') if len(order) else starts
+    metrics.count("groups_evaluated", len(starts))
+
+    # Gaps between consecutive payments of the same merchant
+    gaps = (np.diff(days) // np.timedelta64(1, 'D')).astype(np.int64)
+    same = ids[1:] == ids[:-1]
+    irregular = same & ~((gaps >= MIN_GAP_DAYS) & (gaps <= MAX_GAP_DAYS))
+    irregular_counts = np.bincount(np.searchsorted(starts, np.flatnonzero(irregular) + 1, side='right') - 1,
+                                   minlength=len(starts))
+
+    groups = None
+    if with_groups:
+        groups = {}
+        for g in rank.tolist():
+            start, count = int(starts[g]), int(counts[g])
+            end = start + count
+            groups[labels[ids[start]]] = {
+                'dates': _date_strings(strs, days, start, end),
+                'amounts': amts[start:end].tolist(),
+                'last_gap': int(gaps[end - 2]) if count >= 2 else None,
+                'irregular_gaps': int(irregular_counts[g])
+            }
+
+    # Candidates: at least two payments, all about a month apart
+    is_cand = (counts >= 2) & (irregular_counts == 0)
+    cand = rank[is_cand[rank]]
+    if len(cand) == 0:
+        return [], groups
+    c_starts, c_counts = starts[cand], counts[cand]
+
+    # Pack candidate rows contiguously so segment ops only touch them
+    row_idx = np.repeat(c_starts, c_counts) + (np.arange(c_counts.sum()) - np.repeat(np.cumsum(c_counts) - c_counts, c_counts))
+    c_amts = amts[row_idx]
+    c_seg = np.repeat(np.arange(len(cand)), c_counts)
+    p_starts = np.cumsum(c_counts) - c_counts
+
+    totals = _sequential_sums(c_amts, p_starts, c_counts)
+    avg = totals / c_counts
+    variance = np.maximum.reduceat(c_amts, p_starts) - np.minimum.reduceat(c_amts, p_starts)
+    passes = variance / avg < MAX_VARIANCE_RATIO
+
+    # Amount trend: last two payments against everything before them
+    last_idx = p_starts + c_counts - 1
+    recent_avg = (c_amts[last_idx - 1] + c_amts[last_idx]) / 2
+    older_len = np.maximum(c_counts - 2, 1)
+    older_avg = _sequential_sums(c_amts, p_starts, np.maximum(c_counts - 2, 0)) / older_len
+    has_trend = c_counts >= 3
+    increasing = has_trend & (recent_avg > older_avg * 1.1)
+    decreasing = has_trend & ~increasing & (recent_avg < older_avg * 0.9)
+
+    is_anom, scores = robust_anomaly_scores(c_amts, c_seg, p_starts, c_counts)
+
+    passing = np.flatnonzero(passes).tolist()
+    names = [labels[ids[c_starts[i]]] for i in passing]
+    types = classify_many(names) if classify_many else ["Other"] * len(names)
+
+    bills = []
+    for i, name, bill_type in zip(passing, names, types):
+        start, count = int(p_starts[i]), int(c_counts[i])
+        avg_amount = float(avg[i])
+        bills.append({
+            'merchant': name,
+            'amount': avg_amount,
+            'frequency': 'monthly',
+            'type': bill_type,
+            'last_paid': _date_strings(strs, days, c_starts[i] + count - 1, c_starts[i] + count)[0],
+            'transaction_count': count,
+            'amount_trend': "increasing" if increasing[i] else "decreasing" if decreasing[i] else "stable",
+            'amount_history': c_amts[start:start + count].tolist(),
+            'anomaly': {
+                'is_anomaly': bool(is_anom[i]),
+                'score': float(scores[i])
+            }
+        })
+    metrics.count("bills_emitted", len(bills))
+    return bills, groups
+
+def parse_dates(date_strings):
+    """
+    datetime64 array of ISO date strings: day resolution when every string is a plain
+    YYYY-MM-DD, microseconds otherwise, so a payment at 23:00 and the next one at 01:00
+    are a day less apart than their calendar dates
+    """
+    if all(len(d) == 10 for d in date_strings):
+        return np.array(date_strings, dtype='datetime64[D]')
+    return np.array(date_strings, dtype='datetime64[us]')
+
+def columns_from_transactions(transactions):
+    """Convert canonicalized transaction dicts to (merchant_ids, labels, dates, amounts, date_strings)"""
+    label_ids = {}
+    merchant_ids = np.fromiter(
+        (label_ids.setdefault(t.get('name', 'Unknown'), len(label_ids)) for t in transactions),
+        dtype=np.int64, count=len(transactions),
+    )
+    date_strings = [t.get('date') for t in transactions]
+    dates = parse_dates(date_strings)
+    amounts = np.fromiter((float(t.get('amount', 0)) for t in transactions), dtype=np.float64,
+                          count=len(transactions))
+    return merchant_ids, list(label_ids), dates, amounts, date_strings
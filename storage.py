@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+Storage backends for Derin's user data
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks (Windows): writers are not serialized across processes
+    fcntl = None
+
+# Top-level sections of the user data document
+SECTIONS = ('bills', 'transactions', 'bill_groups', 'user_profile')
+
+# Transaction fields stored as indexed columns; anything else goes to `extra`
+TRANSACTION_COLUMNS = ('id', 'date', 'amount', 'name', 'merchant_name', 'account_id')
+
+def _default_data():
+    from dummy_data import get_default_user_data
+    return get_default_user_data()
+
+# Appended snapshot parts are merged back into one past this many
+MAX_SNAPSHOT_PARTS = 32
+
+# The JSON journal is folded into the document once it is larger than both this and the document
+JOURNAL_COMPACT_BYTES = 8 * 1024 * 1024
+
+def _file_version(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _file_mode(path):
+    """path's permission bits, or those open() would give a new file (0666 less the umask)"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def _atomic_write(path, write):
+    """Call write(f) on a temp file next to path, fsync it and rename it over path"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    mode = _file_mode(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        # mkstemp creates 0600; keep the permissions the replaced file had
+        os.chmod(tmp, mode)
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+class FileLock:
+    """
+    Advisory lock on a sidecar file: shared for readers, exclusive for writers.
+    Reentrant within a thread; other threads of the same process wait on a mutex.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mutex = threading.RLock()
+        self._fd = None
+        self._depth = 0
+        self._exclusive = False
+
+    def shared(self):
+        return self._hold(exclusive=False)
+
+    def exclusive(self):
+        return self._hold(exclusive=True)
+
+    @contextmanager
+    def _hold(self, exclusive):
+        with self._mutex:
+            if self._depth == 0:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None and (self._depth == 0 or (exclusive and not self._exclusive)):
+                fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            outer = self._exclusive
+            self._exclusive = outer or exclusive
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                self._exclusive = outer
+                if self._depth == 0:
+                    # Closing the descriptor releases the lock
+                    os.close(self._fd)
+                    self._fd = None
+
+class Journal:
+    """
+    Append-only JSON-lines journal. Every record gets a sequence number; the first
+    line after a compaction is a checkpoint {"seq": N} so numbering survives it.
+    Writers already hold the storage lock for their whole load-modify-save, so
+    each append is written and fsynced on its own.
+    """
+
+    def __init__(self, path, lock):
+        self.path = path
+        self.lock = lock
+        self._tail = None     # (file size, last seq) after our last write
+
+    def read(self):
+        """All complete records in order; a torn last line from a crash is ignored"""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            lines = f.read().split(b"\n")
+        records = []
+        for line in lines[:-1]:
+            records.append(json.loads(line))
+        return records
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def last_seq(self):
+        records = self.read()
+        return records[-1]['seq'] if records else 0
+
+    def append(self, record):
+        """Add a record; returns once it is durable on disk"""
+        with self.lock.exclusive():
+            size = self.size()
+            if self._tail is not None and self._tail[0] == size:
+                seq = self._tail[1] + 1
+            else:
+                # Another process appended (or this is our first write): find the last record
+                self._repair()
+                size, seq = self.size(), self.last_seq() + 1
+            payload = (json.dumps(dict(record, seq=seq)) + "\n").encode()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, payload)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._tail = (size + len(payload), seq)
+        metrics.count("journal_records", 1)
+        metrics.count("bytes_written", len(payload))
+
+    def _repair(self):
+        """Drop a torn last line left by a crash so new records start on a fresh line"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            content = f.read()
+            end = content.rfind(b"\n") + 1
+            if end != len(content):
+                f.truncate(end)
+
+    def reset(self, seq):
+        """Replace the journal with a checkpoint at seq (after its records were folded in)"""
+        with self.lock.exclusive():
+            _atomic_write(self.path, lambda f: f.write(json.dumps({'seq': seq}) + "\n"))
+            self._tail = (self.size(), seq)
+
+class JsonStorage:
+    """
+    The original single-file backend. Full saves write a temp file and rename it
+    over the document; ingests append a record to <path>.journal instead of
+    rewriting it, and loads replay the journal on top of the document. All of it
+    runs under <path>.lock, so readers always see a consistent state.
+    """
+
+    # Sections an ingest needs loaded (None: all, since compaction rewrites the document)
+    ingest_sections = None
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(path + ".lock")
+        self.journal = Journal(path + ".journal", self._lock)
+
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.journal.path)
+
+    def version(self):
+        """Changes whenever the stored data changes (used to invalidate in-memory copies)"""
+        return (_file_version(self.path), _file_version(self.journal.path))
+
+    def locked(self):
+        """Hold the write lock across a load-modify-save so concurrent writers don't lose updates"""
+        return self._lock.exclusive()
+
+    @metrics.timed("load_data")
+    def load(self, sections=None):
+        with self._lock.shared():
+            if not os.path.exists(self.path):
+                data = _default_data()
+            else:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                metrics.count("bytes_read", os.path.getsize(self.path))
+            applied = data.pop('journal_seq', 0)
+            for record in self.journal.read():
+                if record['seq'] > applied and 'sections' in record:
+                    self._apply(data, record)
+        if sections is not None:
+            data = {key: value for key, value in data.items() if key in sections}
+        return data
+
+    @staticmethod
+    def _apply(data, record):
+        data.setdefault('transactions', []).extend(record['transactions'])
+        data.setdefault('bill_groups', {}).update(record['bill_groups'])
+        data.update(record['sections'])
+
+    @metrics.timed("save_data")
+    def save(self, data):
+        """Atomically replace the document; the journal is folded into it"""
+        with self._lock.exclusive():
+            seq = self.journal.last_seq()
+            document = dict(data, journal_seq=seq) if seq else data
+
+            def write(f):
+                json.dump(document, f, indent=2)
+            _atomic_write(self.path, write)
+            if seq:
+                self.journal.reset(seq)
+        metrics.count("bytes_written", os.path.getsize(self.path))
+
+    def save_ingest(self, data, new_transactions, touched):
+        """Journal the new transactions, touched groups and small sections"""
+        groups = data.get('bill_groups', {})
+        self.journal.append({
+            'transactions': list(new_transactions),
+            'bill_groups': {merchant: groups[merchant] for merchant in touched if merchant in groups},
+            'sections': {key: value for key, value in data.items() if key not in ('transactions', 'bill_groups')}
+        })
+        # Compacting only once the journal outgrows the document keeps rewrites amortized
+        document_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self.journal.size() > max(JOURNAL_COMPACT_BYTES, document_size):
+            self.compact()
+
+    def compact(self):
+        """Fold the journal into the document"""
+        with self._lock.exclusive():
+            self.save(self.load())
+
+    def load_transactions(self, merchant=None, start=None, end=None, account_id=None):
+        return [
+            t for t in self.load(('transactions',)).get('transactions', [])
+            if (merchant is None or t.get('name') == merchant)
+            and (start is None or t.get('date', '') >= start)
+            and (end is None or t.get('date', '') <= end)
+            and (account_id is None or t.get('account_id') == account_id)
+        ]
+
+class SqliteStorage:
+    """
+    SQLite backend: transactions are rows indexed on merchant, date and account,
+    bills and merchant groups are rows keyed by merchant, and every write is one
+    transaction. Commands load only the sections they need.
+    """
+
+    ingest_sections = ('bills', 'bill_groups', 'due_index', 'price_alerts', 'data_version', 'user_profile',
+                       'dedup_token', 'store_id')
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = FileLock(path + ".lock")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def version(self):
+        # WAL-mode commits land in the -wal file before checkpointing
+        return (_file_version(self.path), _file_version(self.path + "-wal"))
+
+    def locked(self):
+        """Hold the write lock across a load-modify-save (each save is already one SQLite transaction)"""
+        return self._lock.exclusive()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS transactions (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT, date TEXT, amount REAL, name TEXT,
+                    merchant_name TEXT, account_id TEXT, extra TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_transactions_name ON transactions (name, date);
+                CREATE INDEX IF NOT EXISTS idx_transactions_merchant ON transactions (merchant_name);
+                CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+                CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions (account_id, date);
+                CREATE TABLE IF NOT EXISTS bills (
+                    merchant TEXT PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS bill_groups (
+                    merchant TEXT PRIMARY KEY, data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY, value TEXT NOT NULL
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    # --- Reads ---
+
+    @metrics.timed("load_data")
+    def load(self, sections=None):
+        if not self.exists():
+            data = _default_data()
+            if sections is not None:
+                data = {key: value for key, value in data.items() if key in sections}
+            return data
+
+        conn = self._connect()
+        wanted = SECTIONS if sections is None else sections
+        data = {}
+        # One read transaction: every table is read from the same committed state
+        conn.execute("BEGIN")
+        try:
+            if 'bills' in wanted:
+                data['bills'] = self.load_bills()
+            if 'transactions' in wanted:
+                data['transactions'] = self.load_transactions()
+            if 'bill_groups' in wanted:
+                data['bill_groups'] = {
+                    merchant: json.loads(blob)
+                    for merchant, blob in conn.execute("SELECT merchant, data FROM bill_groups")
+                }
+            # A full load carries every meta key (data_version included) so a full save keeps them
+            for key, blob in conn.execute("SELECT key, value FROM meta"):
+                if sections is None or key in wanted:
+                    data[key] = json.loads(blob)
+        finally:
+            conn.rollback()
+        if 'user_profile' in wanted and 'user_profile' not in data:
+            data['user_profile'] = _default_data()['user_profile']
+        return data
+
+    def load_bills(self):
+        return [
+            json.loads(blob)
+            for (blob,) in self._connect().execute("SELECT data FROM bills ORDER BY position")
+        ]
+
+    def load_transactions(self, merchant=None, start=None, end=None, account_id=None):
+        clauses, params = [], []
+        for column, op, value in (('name', '=', merchant), ('date', '>=', start),
+                                  ('date', '<=', end), ('account_id', '=', account_id)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT {', '.join(TRANSACTION_COLUMNS)}, extra FROM transactions{where} ORDER BY seq", params
+        )
+        return [self._row_to_transaction(row) for row in rows]
+
+    # --- Writes ---
+
+    @metrics.timed("save_data")
+    def save(self, data):
+        """Replace the whole document in one transaction"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._bump_version(conn, data)
+            conn.execute("DELETE FROM transactions")
+            self._insert_transactions(conn, data.get('transactions', []))
+            self._replace_bills(conn, data.get('bills', []))
+            conn.execute("DELETE FROM bill_groups")
+            self._upsert_groups(conn, data.get('bill_groups', {}), data.get('bill_groups', {}).keys())
+            conn.execute("DELETE FROM meta")
+            self._save_meta(conn, data)
+
+    @metrics.timed("save_data")
+    def save_ingest(self, data, new_transactions, touched):
+        """Append new transactions and write back only the touched groups and the bills"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._bump_version(conn, data)
+            self._insert_transactions(conn, new_transactions)
+            self._upsert_groups(conn, data.get('bill_groups', {}), touched)
+            self._replace_bills(conn, data.get('bills', []))
+            self._save_meta(conn, data)
+
+    @staticmethod
+    def _bump_version(conn, data):
+        """
+        Move data_version past the stored one inside the write transaction, so a
+        writer that loaded a stale (or no) version can never reuse a number
+        """
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        stored = json.loads(row[0]) if row else 0
+        data['data_version'] = max(data.get('data_version') or 0, stored + 1)
+
+    def _insert_transactions(self, conn, transactions):
+        conn.executemany(
+            f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._transaction_to_row(t) for t in transactions),
+        )
+
+    def _replace_bills(self, conn, bills):
+        conn.execute("DELETE FROM bills")
+        conn.executemany(
+            "INSERT INTO bills (merchant, position, data) VALUES (?, ?, ?)",
+            ((bill['merchant'], i, json.dumps(bill)) for i, bill in enumerate(bills)),
+        )
+
+    def _upsert_groups(self, conn, groups, merchants):
+        conn.executemany(
+            "INSERT OR REPLACE INTO bill_groups (merchant, data) VALUES (?, ?)",
+            ((merchant, json.dumps(groups[merchant])) for merchant in merchants),
+        )
+
+    def _save_meta(self, conn, data):
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            ((key, json.dumps(value)) for key, value in data.items()
+             if key not in ('bills', 'transactions', 'bill_groups')),
+        )
+
+    @staticmethod
+    def _transaction_to_row(transaction):
+        extra = {k: v for k, v in transaction.items() if k not in TRANSACTION_COLUMNS}
+        row = []
+        for column in TRANSACTION_COLUMNS:
+            value = transaction.get(column)
+            if value is not None and column != 'amount' and not isinstance(value, str):
+                # TEXT columns would turn 1001 into '1001': keep the original in extra, which wins on load
+                extra[column] = value
+                value = str(value)
+            row.append(value)
+        return tuple(row) + (json.dumps(extra) if extra else None,)
+
+    @staticmethod
+    def _row_to_transaction(row):
+        transaction = {column: value for column, value in zip(TRANSACTION_COLUMNS, row) if value is not None}
+        if row[-1]:
+            transaction.update(json.loads(row[-1]))
+        return transaction
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def _write_json_replace(path, value):
+    """Atomically replace path with value as JSON"""
+    _atomic_write(path, lambda f: json.dump(value, f))
+
+class SnapshotStorage:
+    """
+    Memory-mapped snapshot directory for fast reads of large histories:
+
+        meta.json          every section except transactions/bill_groups, plus the part list
+        bill_groups.json   merchant group state (only ingests read it)
+        parts/NNNNNN/      transaction columns as .npy arrays plus a string table
+
+    Transactions load as a columnar.TransactionColumns whose arrays are memory-mapped,
+    so only the columns a command touches are paged in. Ingests append a part;
+    meta.json is replaced last, so readers never see a half-written snapshot.
+    """
+
+    ingest_sections = ('bills', 'bill_groups', 'due_index', 'price_alerts', 'data_version', 'user_profile',
+                       'dedup_token', 'store_id')
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = FileLock(path + ".lock")
+
+    def locked(self):
+        """Hold the write lock across a load-modify-save so concurrent writers don't lose updates"""
+        return self._lock.exclusive()
+
+    def _file(self, *names):
+        return os.path.join(self.path, *names)
+
+    def exists(self):
+        return os.path.exists(self._file('meta.json'))
+
+    def version(self):
+        return _file_version(self._file('meta.json'))
+
+    def _read_meta(self):
+        with open(self._file('meta.json'), 'r') as f:
+            meta = json.load(f)
+        metrics.count("bytes_read", os.path.getsize(self._file('meta.json')))
+        return meta
+
+    # --- Reads ---
+
+    @metrics.timed("load_data")
+    def load(self, sections=None):
+        if not self.exists():
+            data = _default_data()
+            if sections is not None:
+                data = {key: value for key, value in data.items() if key in sections}
+            return data
+
+        # Held until the parts are mapped: compaction deletes parts no longer listed
+        with self._lock.shared():
+            meta = self._read_meta()
+            data = {key: value for key, value in meta['sections'].items() if sections is None or key in sections}
+            if sections is None or 'bill_groups' in sections:
+                with open(self._file('bill_groups.json'), 'r') as f:
+                    data['bill_groups'] = json.load(f)
+            if sections is None or 'transactions' in sections:
+                data['transactions'] = self._load_parts(meta['parts'])
+        if (sections is None or 'user_profile' in sections) and 'user_profile' not in data:
+            data['user_profile'] = _default_data()['user_profile']
+        return data
+
+    def _load_parts(self, parts):
+        from columnar import TransactionColumns, load_columns
+        return TransactionColumns.concat(load_columns(self._file('parts', part)) for part in parts)
+
+    def load_bills(self):
+        return self.load(('bills',)).get('bills', [])
+
+    def load_transactions(self, merchant=None, start=None, end=None, account_id=None):
+        import numpy as np
+        if not self.exists():
+            return []
+        with self._lock.shared():
+            store = self._load_parts(self._read_meta()['parts'])
+        mask = np.ones(len(store), dtype=bool)
+        for ids, table, value in ((store.name_ids, store.names, merchant),
+                                  (store.account_ids, store.accounts, account_id)):
+            if value is not None:
+                mask &= ids == table.index.get(value, -2)
+        rows = (store.row_dict(i) for i in np.flatnonzero(mask).tolist())
+        return [
+            t for t in rows
+            if (start is None or t['date'] >= start) and (end is None or t['date'] <= end)
+        ]
+
+    # --- Writes ---
+
+    def _write_part(self, meta, transactions):
+        """Write transactions (dicts or a TransactionColumns) as a new part; returns its name"""
+        from columnar import TransactionColumns, save_columns
+        if not isinstance(transactions, TransactionColumns):
+            transactions = TransactionColumns.from_dicts(transactions)
+        part = f"{meta['next_part']:06d}"
+        meta['next_part'] += 1
+        save_columns(transactions, self._file('parts', part))
+        meta['parts'].append(part)
+        return part
+
+    def _commit(self, meta, data, groups=True):
+        meta['sections'] = {key: value for key, value in data.items()
+                            if key not in ('transactions', 'bill_groups')}
+        if groups:
+            _write_json_replace(self._file('bill_groups.json'), data.get('bill_groups', {}))
+        _write_json_replace(self._file('meta.json'), meta)
+        # Parts dropped by a rewrite or compaction are no longer referenced
+        for part in os.listdir(self._file('parts')):
+            if part not in meta['parts']:
+                shutil.rmtree(self._file('parts', part), ignore_errors=True)
+
+    def _empty_meta(self):
+        next_part = 0
+        if self.exists():
+            next_part = self._read_meta()['next_part']
+        return {'format': 1, 'parts': [], 'next_part': next_part, 'sections': {}}
+
+    @metrics.timed("save_data")
+    def save(self, data):
+        """Rewrite the snapshot as a single part"""
+        with self._lock.exclusive():
+            os.makedirs(self._file('parts'), exist_ok=True)
+            meta = self._empty_meta()
+            self._write_part(meta, data.get('transactions', []))
+            self._commit(meta, data)
+
+    @metrics.timed("save_data")
+    def save_ingest(self, data, new_transactions, touched):
+        """Append new transactions as a part, merging parts once there are too many"""
+        with self._lock.exclusive():
+            if not self.exists():
+                self.save(dict(data, transactions=new_transactions))
+                return
+            meta = self._read_meta()
+            if new_transactions:
+                self._write_part(meta, new_transactions)
+            if len(meta['parts']) > MAX_SNAPSHOT_PARTS:
+                merged = self._load_parts(meta['parts'])
+                meta['parts'] = []
+                self._write_part(meta, merged)
+            self._commit(meta, data)
+
+def migrate_json_to_sqlite(json_storage, sqlite_storage, build_groups=None):
+    """Copy the JSON document into SQLite, building merchant group state if it is missing"""
+    data = json_storage.load()
+    if 'bill_groups' not in data and build_groups is not None:
+        data['bill_groups'] = build_groups(data.get('transactions', []))
+    sqlite_storage.save(data)
+    return data
+
+def export_snapshot(source, snapshot_storage, build_groups=None):
+    """Write everything in source (a JSON or SQLite backend) into a snapshot"""
+    data = source.load()
+    if 'bill_groups' not in data and build_groups is not None:
+        data['bill_groups'] = build_groups(data.get('transactions', []))
+    snapshot_storage.save(data)
+    return data
+
+def import_snapshot(snapshot_storage, target):
+    """Write a snapshot back into target as plain transaction dicts"""
+    data = snapshot_storage.load()
+    data['transactions'] = data['transactions'].to_dicts()
+    target.save(data)
+    return data
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+
+@pytest.fixture
+def derin_home(tmp_path, monkeypatch):
+    """Point every store at tmp_path and use the model-free canonicalizer"""
+    monkeypatch.setattr(utils, 'DATA_FILE', str(tmp_path / "bills.json"))
+    monkeypatch.setattr(utils, 'SQLITE_FILE', str(tmp_path / "bills.db"))
+    monkeypatch.setattr(utils, 'SNAPSHOT_DIR', str(tmp_path / "snapshot"))
+    monkeypatch.setattr(utils, 'CANONICALIZER', "ngram")
+    monkeypatch.setattr(utils, 'CANONICAL_INDEX', False)
+    monkeypatch.setattr(utils, 'STORAGE_BACKEND', "json")
+    return tmp_path
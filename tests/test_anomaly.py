@@ -0,0 +1,72 @@
+import json
+
+from click.testing import CliRunner
+
+from anomaly import RollingRobustStats, score_new_transactions
+from main import cli
+
+
+def _group(amounts, dates):
+    return {'amounts': list(amounts), 'dates': list(dates)}
+
+
+def _rows(name, *rows):
+    return [{'name': name, 'date': date, 'amount': -amount} for date, amount in rows]
+
+
+def test_flat_history_ignores_a_few_cents():
+    stats = RollingRobustStats([15.99] * 6)
+    is_spike, z = stats.score(16.49)
+    assert not is_spike and z < 5
+    assert stats.score(31.98)[0]
+
+
+def test_price_drops_are_not_spikes():
+    stats = RollingRobustStats([12.12, 12.15, 12.10, 12.12])
+    is_spike, z = stats.score(9.99)
+    assert not is_spike and z < 0
+
+
+def test_only_rows_after_the_stored_history_alert():
+    dates = ['2025-06-01', '2025-07-01', '2025-08-01']
+    groups = {'Rent': _group([1200.0] * 3, dates)}
+
+    backfill = _rows('Rent', ('2020-03-01', 2400.0))
+    alerts, _ = score_new_transactions(groups, backfill)
+    assert alerts == []
+
+    alerts, _ = score_new_transactions(groups, _rows('Rent', ('2025-09-01', 2400.0)))
+    assert [(a['merchant'], a['date']) for a in alerts] == [('Rent', '2025-09-01')]
+
+
+def test_a_new_merchant_has_no_baseline():
+    rows = _rows('Gym', ('2025-01-05', 30.0), ('2025-02-05', 30.0), ('2025-03-05', 30.0), ('2025-04-05', 90.0))
+    alerts, windows = score_new_transactions({}, rows)
+    assert alerts == []
+    assert windows['Gym'] == [30.0, 30.0, 30.0, 90.0]
+
+
+def test_demo_drops_old_price_alerts(derin_home):
+    runner = CliRunner()
+    assert runner.invoke(cli, ['demo']).exit_code == 0
+    spike = derin_home / "spike.json"
+    spike.write_text(json.dumps([{'id': 'rent_sep', 'date': '2025-09-01', 'amount': -2400.0,
+                                  'name': 'Monthly Rent Payment', 'account_id': 'checking'}]))
+    result = runner.invoke(cli, ['ingest', str(spike)])
+    assert "PRICE SPIKE: Monthly Rent Payment" in result.output
+
+    question = ['answer', "any unusual charges"]
+    assert "charged $2400.00" in runner.invoke(cli, question).output
+    assert runner.invoke(cli, ['demo']).exit_code == 0
+    assert "charged $2400.00" not in runner.invoke(cli, question).output
+
+
+def test_backfill_ingest_raises_no_alerts(derin_home):
+    from utils import build_bill_groups, ingest_transactions
+
+    history = _rows('Rent', ('2025-06-01', 1200.0), ('2025-07-01', 1200.0), ('2025-08-01', 1200.0))
+    spike = _rows('Rent', ('2025-09-01', 2400.0))
+    for backfill, expected in ((True, 0), (False, 1)):
+        data = {'transactions': list(history), 'bill_groups': build_bill_groups(history)}
+        ingest_transactions(data, [dict(row) for row in spike], backfill=backfill)
+        assert len(data.get('price_alerts', [])) == expected
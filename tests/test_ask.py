@@ -0,0 +1,39 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import utils
+from main import cli
+
+
+def _write_bill(path, name, amount):
+    transactions = [
+        {'id': f"{path.stem}_{month}", 'date': f"2025-{month:02d}-05", 'amount': -amount,
+         'name': name, 'account_id': 'checking'}
+        for month in (6, 7, 8)
+    ]
+    path.write_text(json.dumps(transactions))
+    return str(path)
+
+
+def _total(runner):
+    result = runner.invoke(cli, ['answer', "what is my total monthly bill amount"])
+    assert result.exit_code == 0, result.output
+    return result.output.split("totaling ")[1].split("/month")[0]
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_ask_follows_ingest_after_demo_reload(derin_home, monkeypatch, backend):
+    monkeypatch.setattr(utils, 'STORAGE_BACKEND', backend)
+    runner = CliRunner()
+
+    assert runner.invoke(cli, ['demo']).exit_code == 0
+    runner.invoke(cli, ['ingest', _write_bill(derin_home / "water.json", "City Water", 40.0)])
+    assert _total(runner) == "$1379.48"
+
+    # Reloading the demo must not hand out a data version that cached answers already used
+    assert runner.invoke(cli, ['demo']).exit_code == 0
+    runner.invoke(cli, ['ingest', _write_bill(derin_home / "water_raised.json", "City Water", 215.0)])
+    assert _total(runner) == "$1554.48"
+    assert "Total Monthly Bills: $1554.48" in runner.invoke(cli, ['bills']).output
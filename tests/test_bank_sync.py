@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+from bank_sync import FeedServer, run_sync, sync_accounts
+
+
+class BrokenFeed(FeedServer):
+    """Answers pages of one account with a null body and another with a non-list"""
+
+    def respond(self, path, query):
+        if '/acct_0001/' in path:
+            return 200, {}, None
+        if '/acct_0002/' in path:
+            return 200, {}, {'transactions': 'oops'}
+        return super().respond(path, query)
+
+
+def _accounts(server, port):
+    return [{'account_id': account_id, 'url': f"http://127.0.0.1:{port}", 'provider': 'local'}
+            for account_id in server.account_ids]
+
+
+def _serve_in_thread(server):
+    """Start server on an event loop of its own; returns (port, stop)"""
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(server.start(port=0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def shutdown():
+        listener.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    return listener.sockets[0].getsockname()[1], stop
+
+
+def _check(accounts, summaries, ingested):
+    by_account = {summary['account_id']: summary for summary in summaries}
+    assert 'error' not in by_account['acct_0000']
+    assert by_account['acct_0000']['transactions'] == 120
+    assert len(ingested['acct_0000']) == 120
+    assert accounts[0]['cursor'] == '120'
+    for account_id in ('acct_0001', 'acct_0002'):
+        assert 'malformed page' in by_account[account_id]['error']
+        assert account_id not in ingested
+
+
+def test_malformed_pages_fail_only_their_account():
+    server = BrokenFeed(accounts=3, rows_per_account=120)
+    ingested = {}
+    threads = set()
+
+    def ingest(account, transactions):
+        threads.add(threading.current_thread().name)
+        ingested.setdefault(account['account_id'], []).extend(transactions)
+
+    async def run():
+        listener = await server.start(port=0)
+        accounts = _accounts(server, listener.sockets[0].getsockname()[1])
+        try:
+            return accounts, await sync_accounts(accounts, ingest, page_size=50)
+        finally:
+            listener.close()
+
+    accounts, summaries = asyncio.run(run())
+    _check(accounts, summaries, ingested)
+    # Pages are ingested off the event loop, on the one writer thread
+    assert threads and threading.current_thread().name not in threads
+    assert len(threads) == 1
+
+
+def test_run_sync_ingests_on_the_calling_thread():
+    server = BrokenFeed(accounts=3, rows_per_account=120)
+    port, stop = _serve_in_thread(server)
+    ingested = {}
+    caller = threading.current_thread()
+    lock = threading.RLock()
+
+    def ingest(account, transactions):
+        assert threading.current_thread() is caller
+        # Thread-affine state the caller set up is still usable here
+        with lock:
+            ingested.setdefault(account['account_id'], []).extend(transactions)
+
+    accounts = _accounts(server, port)
+    try:
+        with lock:
+            summaries = run_sync(accounts, ingest, page_size=50)
+    finally:
+        stop()
+    _check(accounts, summaries, ingested)
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import utils
+from batch import BATCH_FORECAST_FILE, run_batch
+from dummy_data import generate_synthetic_transactions
+from main import cli
+
+
+def _write_users(input_dir):
+    users = {}
+    for user in range(3):
+        rows = list(generate_synthetic_transactions(120, num_merchants=20, seed=user))
+        users[f"user{user}"] = rows
+        (input_dir / f"user{user}.json").write_text(json.dumps(rows))
+    (input_dir / "broken.json").write_text("{not json")
+    (input_dir / "notes.txt").write_text("not a user")
+    return users
+
+
+def test_every_user_gets_their_own_results(derin_home):
+    input_dir, output_dir = derin_home / "in", derin_home / "out"
+    input_dir.mkdir()
+    users = _write_users(input_dir)
+
+    seen = []
+    summaries = run_batch(str(input_dir), str(output_dir), workers=2, max_pending=1, on_result=seen.append)
+    assert seen == summaries
+    by_user = {summary['user_id']: summary for summary in summaries}
+    assert set(by_user) == {"user0", "user1", "user2", "broken"}
+    assert 'error' in by_user['broken']
+
+    for user_id, rows in users.items():
+        result = json.loads((output_dir / f"{user_id}.json").read_text())
+        # The same bills detection gives for that user alone
+        assert result['bills'] == json.loads(json.dumps(utils.detect_recurring_bills(rows)))
+        assert result['bills'] and by_user[user_id]['bills'] == len(result['bills'])
+        assert result['transaction_count'] == len(rows)
+
+
+def test_batch_command_reports_and_forecasts(derin_home):
+    input_dir, output_dir = derin_home / "in", derin_home / "out"
+    input_dir.mkdir()
+    _write_users(input_dir)
+
+    result = CliRunner().invoke(cli, ['batch', str(input_dir), str(output_dir), '--workers', '1',
+                                      '--forecast-months', '3'])
+    assert result.exit_code == 0, result.output
+    assert "Processed 4 users (1 failed)" in result.output
+    assert "broken: FAILED" in result.output
+    forecast = json.loads((output_dir / BATCH_FORECAST_FILE).read_text())
+    assert set(forecast['users']) == {"user0", "user1", "user2"}
+    totals = [sum(month) for month in zip(*forecast['users'].values())]
+    assert forecast['monthly_totals'] == pytest.approx(totals) and sum(totals) > 0
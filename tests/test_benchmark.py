@@ -0,0 +1,53 @@
+import itertools
+
+import pytest
+
+import benchmark
+import utils
+from dummy_data import _SYNTHETIC_SHOPS, generate_synthetic_bills, generate_synthetic_transactions
+
+
+def test_generator_is_seeded_lazy_and_sized():
+    first = list(generate_synthetic_transactions(2000, num_users=4, seed=3))
+    assert first == list(generate_synthetic_transactions(2000, num_users=4, seed=3))
+    assert first != list(generate_synthetic_transactions(2000, num_users=4, seed=4))
+    assert len(first) == 2000 and len({t['id'] for t in first}) == 2000
+    assert len({t['account_id'] for t in first}) == 4
+
+    # Rows come out one at a time, so 10^7 rows never sit in memory at once
+    huge = generate_synthetic_transactions(10_000_000, num_users=40_000, seed=3)
+    assert len(list(itertools.islice(huge, 10))) == 10
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_every_generated_biller_is_detected(derin_home, seed):
+    rows = list(generate_synthetic_transactions(250, num_merchants=30, variant_rate=0, seed=seed))
+    billers = {t['name'] for t in rows} - set(_SYNTHETIC_SHOPS)
+    assert len(billers) >= 3
+    assert {bill['merchant'] for bill in utils.detect_recurring_bills(rows)} == billers
+
+
+def test_synthetic_bills_follow_their_trend():
+    bills = generate_synthetic_bills(50, seed=2)
+    assert bills == generate_synthetic_bills(50, seed=2)
+    for bill in bills:
+        history = bill['amount_history']
+        if bill['amount_trend'] == 'increasing':
+            assert history == sorted(history)
+        elif bill['amount_trend'] == 'decreasing':
+            assert history == sorted(history, reverse=True)
+
+
+def test_run_stages_times_every_stage_on_real_bills(derin_home):
+    timings, bills = benchmark.run_stages(1000, repeat=1)
+    assert bills > 0
+    assert {'canonicalize', 'recurrence', 'anomaly', 'forecast', 'save_data_json',
+            'load_data_sqlite'} <= set(timings)
+    assert all(seconds >= 0 for seconds in timings.values())
+
+
+def test_compare_flags_only_real_regressions():
+    baseline = {'1000': {'recurrence': 0.100, 'anomaly': 0.001}}
+    results = {'1000': {'recurrence': 0.130, 'anomaly': 0.004, 'new_stage': 1.0}}
+    assert benchmark.compare(results, baseline, tolerance=0.25) == [('1000', 'recurrence', 0.130, 0.100)]
+    assert benchmark.compare(results, baseline, tolerance=0.5) == []
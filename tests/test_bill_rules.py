@@ -0,0 +1,32 @@
+from bill_rules import BillClassifier, get_classifier
+
+RULES = [{'type': "Utilities", 'keywords': ["water", "power"]},
+         {'type': "Subscription", 'keywords': ["netflix", "power bi"]}]
+
+
+def _substring_chain(merchant):
+    """The if/elif keyword checks the compiled matcher replaced"""
+    for rule in RULES:
+        if any(keyword in merchant.lower() for keyword in rule['keywords']):
+            return rule['type']
+    return "Other"
+
+
+def test_first_matching_rule_wins():
+    classifier = BillClassifier(RULES)
+    for merchant in ["City Water", "NETFLIX.COM", "Microsoft Power BI", "Corner Deli", ""]:
+        assert classifier.classify(merchant) == _substring_chain(merchant)
+
+
+def test_memoized_names_are_bounded():
+    classifier = BillClassifier(RULES, cache_size=64)
+    merchants = [f"Water District {i}" for i in range(1000)] + [f"Shop {i}" for i in range(1000)]
+    merchants += merchants[:3]
+    assert classifier.classify_many(merchants) == [_substring_chain(m) for m in merchants]
+    info = classifier.classify.cache_info()
+    assert info.maxsize == 64 and info.currsize == 64
+
+
+def test_the_shipped_rules_load():
+    assert get_classifier().classify.cache_info().maxsize is not None
+    assert get_classifier().classify("Comcast Cable") != get_classifier().default
@@ -0,0 +1,31 @@
+import numpy as np
+
+from canonical_index import CanonicalIndex, _rebuild_clusters
+from utils_embeddings import _cluster_greedy
+
+
+def _unit_vectors(degrees):
+    angles = np.radians(degrees)
+    return np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+
+
+def test_rebuild_splits_a_cluster_that_drifted_apart():
+    vecs = _unit_vectors([0, 30, 50, 66, 80, 95, 108, 120])
+    # The greedy pass lets the second cluster's centroid walk from 50 to 120 degrees
+    assert _cluster_greedy(vecs, 0.85) == [0, 0, 1, 1, 1, 1, 1, 1]
+
+    assignment, centroids = _rebuild_clusters(vecs, 0.85)
+    assert assignment == [0, 0, 1, 1, 2, 2, 2, 2]
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1.0)
+
+
+def test_recluster_keeps_a_clean_index(tmp_path):
+    index = CanonicalIndex("ngram", path=str(tmp_path / "canonical.sqlite"))
+    names = ["NETFLIX.COM", "Netflix Inc", "Monthly Rent Payment", "Spotify Premium", "SPOTIFY PREMIUM"]
+    labels = index.canonicalize(names)
+    assert labels["Netflix Inc"] == labels["NETFLIX.COM"] == "NETFLIX.COM"
+    assert labels["SPOTIFY PREMIUM"] == "Spotify Premium"
+
+    assert index.recluster() == {}
+    assert index.canonicalize(names) == labels
+    assert index.stats() == {'clusters': 3, 'aliases': 5}
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from dummy_data import generate_synthetic_transactions
+from utils_embeddings import _cluster_greedy, get_embedder
+
+
+def _baseline_clusters(vecs, sim_threshold):
+    """The one-name-at-a-time loop build_canonical_map_embeddings used before blocking"""
+    canon_vecs, assignment = [], []
+    for vec in vecs:
+        if not canon_vecs:
+            canon_vecs.append(vec)
+            assignment.append(0)
+            continue
+        sims = np.dot(np.vstack(canon_vecs), vec)
+        j = int(np.argmax(sims))
+        if sims[j] >= sim_threshold:
+            canon_vecs[j] = (canon_vecs[j] + vec) / np.linalg.norm(canon_vecs[j] + vec)
+            assignment.append(j)
+        else:
+            canon_vecs.append(vec)
+            assignment.append(len(canon_vecs) - 1)
+    return assignment
+
+
+@pytest.fixture(scope='module')
+def name_vectors():
+    # A fixed set of merchant names with "NETFLIX.COM" / "Netflix Inc" style variants
+    names = list(dict.fromkeys(t['name'] for t in generate_synthetic_transactions(
+        6000, num_users=4, num_merchants=150, variant_rate=0.5, seed=11)))
+    return get_embedder("hashing").encode(names)
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 1024])
+@pytest.mark.parametrize('threshold', [0.5, 0.7, 0.85])
+def test_blocked_clustering_matches_the_baseline_loop(name_vectors, block_size, threshold):
+    expected = _baseline_clusters(name_vectors, threshold)
+    assert len(set(expected)) > 10
+    assert _cluster_greedy(name_vectors, threshold, block_size=block_size) == expected
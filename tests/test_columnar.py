@@ -0,0 +1,26 @@
+from columnar import TransactionColumns, load_columns, save_columns
+
+
+TRANSACTIONS = [
+    {'id': 1001, 'date': '2025-06-15', 'amount': -15.99, 'name': 'NETFLIX.COM', 'category': 'Entertainment'},
+    {'id': 'tx-2', 'date': '2025-07-15T09:30:00', 'amount': -15.99, 'name': 'Netflix Inc',
+     'merchant_name': 'Netflix', 'account_id': 42, 'pending': False},
+    {'id': 'tx-3', 'date': '2025-08-15', 'amount': -15.99, 'name': 'Netflix Subscription'},
+]
+
+
+def test_unknown_fields_and_non_string_values_survive(tmp_path):
+    store = TransactionColumns.from_dicts(TRANSACTIONS)
+    assert store.to_dicts() == TRANSACTIONS
+    assert store[0]['category'] == 'Entertainment'
+    # Columns hold the str() form, lookups give the original value back
+    assert store.ids[0] == '1001' and store[0]['id'] == 1001
+
+    save_columns(TransactionColumns.concat([store, store]), str(tmp_path / "part"))
+    assert load_columns(str(tmp_path / "part")).to_dicts() == TRANSACTIONS * 2
+
+
+def test_rename_replaces_names_kept_in_extras():
+    store = TransactionColumns.from_dicts([{'date': '2025-06-01', 'amount': -9.0, 'name': 404}])
+    store.rename({'404': 'Not Found'})
+    assert store.to_dicts() == [{'date': '2025-06-01', 'amount': -9.0, 'name': 'Not Found'}]
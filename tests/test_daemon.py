@@ -0,0 +1,71 @@
+import json
+import socket
+import threading
+
+import pytest
+
+import daemon
+import metrics
+import utils
+from daemon_client import DaemonClient, forward
+
+if not hasattr(socket, 'AF_UNIX'):
+    pytest.skip("the daemon needs Unix sockets", allow_module_level=True)
+
+
+@pytest.fixture
+def running_daemon(derin_home, monkeypatch):
+    from main import cli
+
+    # warm_up() turns the data cache on for the rest of the process
+    monkeypatch.setattr(utils, 'CACHE_DATA', False)
+    path = str(derin_home / "d.sock")
+    server = daemon.DerinDaemon(cli, path)
+    server.warm_up()
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    yield path
+    daemon.stop_daemon(path)
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_commands_run_in_process_without_a_daemon(tmp_path):
+    path = str(tmp_path / "d.sock")
+    assert forward(['bills'], path) is None
+    assert DaemonClient.connect(path) is None
+
+    # A socket file left behind by a daemon that died
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    assert forward(['bills'], path) is None
+
+
+def test_local_commands_are_never_forwarded(running_daemon):
+    for argv in (['serve', '--stop'], ['ask'], ['--storage', 'sqlite', 'sync']):
+        assert forward(argv, running_daemon) is None
+
+
+def test_forwarded_commands_see_each_others_writes(running_daemon, derin_home, capsys):
+    assert forward(['demo'], running_daemon) == 0
+    assert "recurring bills!" in capsys.readouterr().out
+
+    rows = [{'id': f"w{m}", 'name': "City Water", 'amount': -61.5, 'date': f"2025-0{m}-04", 'account_id': 'a'}
+            for m in (6, 7, 8)]
+    path = derin_home / "water.json"
+    path.write_text(json.dumps(rows))
+    assert forward(['ingest', str(path)], running_daemon) == 0
+    assert forward(['bills'], running_daemon) == 0
+    assert "City Water" in capsys.readouterr().out
+
+
+def test_options_and_errors_stay_in_their_request(running_daemon, capsys):
+    backend = utils.STORAGE_BACKEND
+    assert forward(['--storage', 'sqlite', '--profile', 'bills'], running_daemon) == 0
+    assert utils.STORAGE_BACKEND == backend and not metrics.enabled()
+
+    assert forward(['no-such-command'], running_daemon) == 2
+    assert "No such command" in capsys.readouterr().err
+    # The daemon is still serving
+    assert forward(['bills'], running_daemon) == 0
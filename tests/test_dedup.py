@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+from click.testing import CliRunner
+
+from dedup import DedupIndex, transaction_keys
+from main import cli
+from utils import load_data
+
+
+def _purchase(amount=4.5, date='2025-09-01', **extra):
+    return dict({'date': date, 'amount': -amount, 'name': "Blue Bottle", 'account_id': 'checking'}, **extra)
+
+
+def _ingest(index, batch):
+    fresh = index.filter(batch)
+    index.add(fresh)
+    return fresh
+
+
+def test_identical_purchases_in_one_batch_are_all_kept(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    assert len(_ingest(index, [_purchase(), _purchase()])) == 2
+    # The same export again adds nothing; one with a third coffee adds just that one
+    assert _ingest(index, [_purchase(), _purchase()]) == []
+    assert len(_ingest(index, [_purchase(), _purchase(), _purchase()])) == 1
+
+
+def test_repeated_ids_are_one_transaction(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    assert len(_ingest(index, [_purchase(id='t1'), _purchase(id='t1'), _purchase(id='t2')])) == 2
+    assert _ingest(index, [_purchase(id='t2')]) == []
+
+
+def test_bloom_false_positives_fall_back_to_sqlite(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"), bloom=True)
+    _ingest(index, [_purchase(date='2025-09-01')])
+    # A saturated filter says "maybe seen" to everything; SQLite has the final word
+    index._get_bloom().bits[:] = np.uint8(0xFF)
+    fresh = index.filter([_purchase(date='2025-09-01'), _purchase(date='2025-09-02')])
+    assert [t['date'] for t in fresh] == ['2025-09-02']
+
+
+def test_rebuild_numbers_stored_duplicates_like_an_ingest(tmp_path):
+    stored = [_purchase(), _purchase(), _purchase(date='2025-09-02')]
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    token = index.rebuild(stored)
+    assert index.is_current(token) and not index.is_current(None)
+    assert index.filter([_purchase(), _purchase()]) == []
+    assert len(index.filter([_purchase(), _purchase(), _purchase()])) == 1
+    assert len(set(transaction_keys(stored))) == 3
+
+
+def test_reingesting_a_file_skips_every_row(derin_home):
+    runner = CliRunner()
+    rows = [_purchase(amount=60.0, date=f"2025-0{m}-03", name="City Water") for m in (6, 7, 8)]
+    path = derin_home / "water.json"
+    path.write_text(json.dumps(rows))
+
+    assert runner.invoke(cli, ['ingest', str(path)]).exit_code == 0
+    result = runner.invoke(cli, ['ingest', str(path)])
+    assert "Skipped 3 transactions already stored" in result.output
+    assert len(load_data()['transactions']) == 3
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from due_index import UPCOMING_WINDOW_DAYS, build_due_index, upcoming, upcoming_window
+
+
+BILLS = [
+    {'merchant': 'Rent', 'last_paid': '2025-08-01'},
+    {'merchant': 'Electric', 'last_paid': '2025-08-10'},
+    {'merchant': 'Insurance', 'last_paid': '2025-08-25'},
+]
+
+
+def test_upcoming_honours_the_window():
+    index = build_due_index(BILLS)
+    now = datetime(2025, 9, 3)
+
+    assert [m for m, _, _ in upcoming(index, now=now)] == ['Rent', 'Electric']
+    assert [m for m, _, _ in upcoming(index, now=now, days=2)] == ['Rent']
+    assert [m for m, _, _ in upcoming(index, now=now, days=30)] == ['Rent', 'Electric', 'Insurance']
+
+
+def test_upcoming_window_reads_the_preference():
+    assert upcoming_window({}) == UPCOMING_WINDOW_DAYS
+    assert upcoming_window({'user_profile': {'preferences': {'upcoming_days': 30}}}) == 30
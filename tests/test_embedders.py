@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+import utils_embeddings
+from main import cli
+from utils_embeddings import (Embedder, EmbeddingCache, HashingEmbedder, QuantizedEmbedder,
+                              TransformerEmbedder, _embed, get_embedder)
+
+
+class CountingEmbedder(Embedder):
+    """A cacheable backend that records what it was asked to encode"""
+
+    name = "counting"
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return HashingEmbedder().encode(texts)
+
+
+def test_hashing_vectors_are_deterministic_unit_vectors():
+    names = ["NETFLIX.COM", "Netflix Inc", "City Water"]
+    vecs = HashingEmbedder().encode(names)
+    assert vecs.dtype == np.float32 and vecs.shape == (3, utils_embeddings.NGRAM_DIM)
+    assert np.allclose(np.linalg.norm(vecs, axis=1), 1.0)
+    assert np.array_equal(vecs, HashingEmbedder().encode(names))
+    assert vecs[0] @ vecs[1] > vecs[0] @ vecs[2]
+    assert HashingEmbedder(dim=512).name != HashingEmbedder().name
+
+
+def test_backends_are_shared_and_chosen_by_name(monkeypatch):
+    assert get_embedder("hashing") is get_embedder("hashing")
+    monkeypatch.setattr(utils_embeddings, 'EMBEDDER', "hashing")
+    assert get_embedder() is get_embedder("hashing")
+    with pytest.raises(ValueError):
+        get_embedder("onnx")
+
+
+def test_batching_and_thread_settings(monkeypatch):
+    monkeypatch.setattr(utils_embeddings, 'EMBED_BATCH_SIZE', 256)
+    monkeypatch.setattr(utils_embeddings, 'EMBED_THREADS', 2)
+    default = TransformerEmbedder()
+    assert (default.batch_size, default.threads) == (256, 2)
+    explicit = TransformerEmbedder(batch_size=8, threads=0)
+    assert (explicit.batch_size, explicit.threads) == (8, 0)
+
+    # Quantized vectors get their own cache namespace
+    quantized = QuantizedEmbedder(model_path="/models/minilm")
+    assert quantized.model_name == "/models/minilm" and quantized.name == "/models/minilm:int8"
+    assert quantized.name != TransformerEmbedder(model_name="/models/minilm").name
+
+
+def test_without_the_transformer_only_model_backends_fall_back(monkeypatch):
+    monkeypatch.setattr(utils_embeddings, 'transformer_available', lambda: False)
+    for backend in ("transformer", "quantized"):
+        monkeypatch.setattr(utils_embeddings, 'EMBEDDER', backend)
+        assert utils_embeddings.resolve_method("embeddings") == "ngram"
+    monkeypatch.setattr(utils_embeddings, 'EMBEDDER', "hashing")
+    assert utils_embeddings.resolve_method("embeddings") == "embeddings"
+    assert utils_embeddings.default_threshold("embeddings") == HashingEmbedder.sim_threshold
+
+
+def test_only_unseen_names_reach_the_backend(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    embedder = CountingEmbedder()
+    first = _embed(["Netflix", "netflix ", "Spotify"], cache=cache, embedder=embedder)
+    second = _embed(["Spotify", "Hulu", "NETFLIX"], cache=cache, embedder=embedder)
+
+    assert embedder.calls == [["netflix", "spotify"], ["hulu"]]
+    assert np.array_equal(first[0], second[2]) and np.array_equal(first[2], second[0])
+    # Another backend's vectors are never served from this one's entries
+    other = CountingEmbedder()
+    other.name = "counting-v2"
+    _embed(["Netflix"], cache=cache, embedder=other)
+    assert other.calls == [["netflix"]]
+
+
+def test_embedder_option_selects_the_backend(derin_home, monkeypatch):
+    monkeypatch.setattr(utils_embeddings, 'EMBEDDER', "transformer")
+    result = CliRunner().invoke(cli, ['--embedder', 'hashing', 'bills'])
+    assert result.exit_code == 0, result.output
+    assert utils_embeddings.EMBEDDER == "hashing"
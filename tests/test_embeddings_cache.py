@@ -0,0 +1,82 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import utils_embeddings
+from utils_embeddings import EmbeddingCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Minutes since the epoch, as the cache sees them"""
+    now = [1000]
+    monkeypatch.setattr(utils_embeddings.time, 'time', lambda: now[0] * utils_embeddings.LRU_RESOLUTION_SECONDS)
+    return now
+
+
+def _vec(i):
+    return np.full(4, i, dtype=np.float32)
+
+
+def _count(cache):
+    return cache._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "e.sqlite"), max_entries=3)
+    for i, name in enumerate("abc"):
+        clock[0] += 1
+        cache.put_many("m", {name: _vec(i)})
+    clock[0] += 1
+    assert set(cache.get_many("m", ["a"])) == {"a"}
+    clock[0] += 1
+    cache.put_many("m", {"d": _vec(3)})
+
+    assert set(cache.get_many("m", list("abcd"))) == {"a", "c", "d"}
+    assert cache.evictions == 1 and _count(cache) == 3
+
+
+def test_repeated_hits_within_a_step_write_nothing(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "e.sqlite"))
+    cache.put_many("m", {"a": _vec(1), "b": _vec(2)})
+    statements = []
+    cache._connect().set_trace_callback(statements.append)
+
+    for _ in range(5):
+        assert len(cache.get_many("m", ["a", "b", "zzz"])) == 2
+    assert not [s for s in statements if s.startswith("UPDATE")]
+
+    clock[0] += 1
+    cache.get_many("m", ["a", "b"])
+    assert len([s for s in statements if s.startswith("UPDATE")]) == 2
+    assert cache.stats()['hits'] == 12 and cache.stats()['misses'] == 5
+
+
+def test_the_row_count_is_shared_and_exact(tmp_path, clock):
+    path = str(tmp_path / "e.sqlite")
+    first, second = EmbeddingCache(path, max_entries=4), EmbeddingCache(path, max_entries=4)
+    first.put_many("m", {"a": _vec(1), "b": _vec(2)})
+    # Another process (a batch worker) fills the same file
+    second.put_many("m", {"b": _vec(2), "c": _vec(3)})
+    first.put_many("m", {"d": _vec(4), "e": _vec(5)})
+
+    assert _count(first) == 4 and first.evictions == 1
+    stored = first._connect().execute("SELECT value FROM meta WHERE key = 'entries'").fetchone()[0]
+    assert stored == 4
+
+
+def test_caches_from_before_the_count_are_counted_once(tmp_path, clock):
+    path = str(tmp_path / "e.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE embeddings (model TEXT NOT NULL, name TEXT NOT NULL, vec BLOB NOT NULL,"
+                 " last_used INTEGER NOT NULL, PRIMARY KEY (model, name))")
+    conn.executemany("INSERT INTO embeddings VALUES ('m', ?, ?, ?)",
+                     [(name, _vec(i).tobytes(), i) for i, name in enumerate("abc")])
+    conn.commit()
+    conn.close()
+
+    cache = EmbeddingCache(path, max_entries=3)
+    cache.put_many("m", {"d": _vec(3)})
+    # Old tick-numbered entries count as long unused
+    assert set(cache.get_many("m", list("abcd"))) == {"b", "c", "d"}
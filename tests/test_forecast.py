@@ -0,0 +1,45 @@
+from forecast import MAX_MONTHLY_TREND, TREND_DAMPING, forecast_bills
+from utils import build_bill_groups, evaluate_bill_group
+
+
+def _bill(name, payments):
+    """A bill as detection produces it, from (date, amount) payments"""
+    transactions = [{'name': name, 'date': day, 'amount': -amount} for day, amount in payments]
+    return evaluate_bill_group(name, build_bill_groups(transactions)[name])
+
+
+def _monthly_amounts(bill, months, start):
+    return forecast_bills([bill], months=months, start=start)['monthly_totals']
+
+
+def test_one_price_spike_does_not_set_the_trend():
+    # The demo's electric bill: two ordinary months, then a flagged spike
+    bill = _bill("Electric Bill", [('2025-06-20', 89.99), ('2025-07-20', 95.50), ('2025-08-20', 155.00)])
+    assert bill['amount_trend'] == 'increasing' and bill['anomaly']['is_anomaly']
+
+    amounts = _monthly_amounts(bill, 24, '2026-10-01')
+    # Fourteen months past the last payment and two years on, still near its usual amount
+    assert all(80 < amount < 140 for amount in amounts)
+    assert amounts == sorted(amounts)
+
+
+def test_steady_increase_is_followed_within_the_cap():
+    payments = [(f"2025-{month:02d}-03", 100.0 + 5 * i) for i, month in enumerate(range(1, 7))]
+    bill = _bill("City Water", payments)
+    assert bill['amount_trend'] == 'increasing' and not bill['anomaly']['is_anomaly']
+
+    amounts = _monthly_amounts(bill, 36, '2025-07-01')
+    # Continues from the last payment, each step smaller than the one before
+    assert 125 < amounts[0] <= 125 * (1 + MAX_MONTHLY_TREND)
+    steps = [later - earlier for earlier, later in zip(amounts, amounts[1:])]
+    assert all(0 < later < earlier for earlier, later in zip(steps, steps[1:]))
+    assert amounts[-1] < 125 * (1 + MAX_MONTHLY_TREND * TREND_DAMPING / (1 - TREND_DAMPING))
+
+
+def test_noisy_history_falls_back_to_the_average():
+    bill = _bill("Gas Company", [('2025-01-10', 100.0), ('2025-02-10', 60.0), ('2025-03-10', 140.0),
+                                 ('2025-04-10', 65.0), ('2025-05-10', 120.0), ('2025-06-10', 125.0)])
+    bill['amount_trend'] = 'increasing'
+
+    amounts = _monthly_amounts(bill, 6, '2025-07-01')
+    assert all(abs(amount - bill['amount']) < 1e-9 for amount in amounts)
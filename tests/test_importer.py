@@ -0,0 +1,54 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from importer import detect_format, new_import_stats, stream_transactions
+from main import cli
+from utils import load_data
+
+CSV_EXPORT = """\ufefftransaction_id,posted_date,amount,description,account
+w1,2025-06-03,-$60.00,City   Water,chk
+w2,07/03/2025,"-1,060.00",Monthly  Rent,chk
+bad,someday,-5.00,Coffee,chk
+w3,03.08.2025,-60.00,City Water,chk
+"""
+
+
+def test_csv_rows_are_mapped_validated_and_chunked(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text(CSV_EXPORT, encoding='utf-8')
+    stats = new_import_stats(str(path))
+
+    chunks = list(stream_transactions(str(path), chunk_size=2, stats=stats))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[0][1] == {'id': 'w2', 'date': '2025-07-03', 'amount': -1060.0,
+                            'name': "Monthly Rent", 'account_id': 'chk'}
+    assert [t['date'] for chunk in chunks for t in chunk] == ['2025-06-03', '2025-07-03', '2025-08-03']
+    assert stats['rows_read'] == 4 and stats['rows_rejected'] == 1
+    assert stats['bytes_read'] == stats['total_bytes']
+
+
+def test_the_format_comes_from_the_extension():
+    assert detect_format("a.CSV") == 'csv' and detect_format("b.ndjson") == 'jsonl'
+    with pytest.raises(ValueError):
+        detect_format("c.xlsx")
+
+
+def test_import_command_streams_chunks_and_skips_known_rows(derin_home):
+    path = derin_home / "export.jsonl"
+    rows = [{'transaction_id': f"r{m}", 'date': f"2025-0{m}-01", 'amount': -1200.0,
+             'description': "Monthly Rent Payment", 'account': 'chk'} for m in range(1, 8)]
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n")
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['import', str(path), '--chunk-size', '3'])
+    assert result.exit_code == 0, result.output
+    assert "Imported 7 of 7 rows (0 already stored, 0 rejected)" in result.output
+    data = load_data()
+    assert len(data['transactions']) == 7
+    assert [bill['merchant'] for bill in data['bills']] == ["Monthly Rent Payment"]
+
+    result = runner.invoke(cli, ['import', str(path)])
+    assert "Imported 0 of 7 rows (7 already stored, 0 rejected)" in result.output
+    assert len(load_data()['transactions']) == 7
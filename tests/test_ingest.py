@@ -0,0 +1,55 @@
+import copy
+
+import pytest
+
+import metrics
+import utils
+from dummy_data import generate_synthetic_transactions
+
+
+def _by_merchant(bills):
+    return {bill['merchant']: bill for bill in bills}
+
+
+@pytest.fixture
+def history():
+    return list(generate_synthetic_transactions(600, num_merchants=12, variant_rate=0, seed=5))
+
+
+def test_ingesting_in_chunks_matches_full_detection(derin_home, history):
+    expected = _by_merchant(utils.detect_recurring_bills(copy.deepcopy(history)))
+    assert expected
+
+    data = {'transactions': [], 'bill_groups': {}, 'bills': []}
+    for start in range(0, len(history), 97):
+        utils.ingest_transactions(data, copy.deepcopy(history[start:start + 97]))
+    bills = _by_merchant(data['bills'])
+
+    assert bills.keys() == expected.keys()
+    for merchant, bill in bills.items():
+        assert bill['amount'] == pytest.approx(expected[merchant]['amount'])
+        assert {k: v for k, v in bill.items() if k != 'amount'} == \
+            {k: v for k, v in expected[merchant].items() if k != 'amount'}
+
+
+def test_ingest_evaluates_only_the_touched_merchants(derin_home, history):
+    data = {'transactions': [], 'bill_groups': {}, 'bills': []}
+    utils.ingest_transactions(data, copy.deepcopy(history))
+    before = {bill['merchant']: bill for bill in data['bills']}
+    merchant, bill = next(iter(before.items()))
+
+    metrics.reset()
+    metrics.enable()
+    try:
+        touched = utils.ingest_transactions(data, [{'id': 'new', 'name': merchant, 'amount': -bill['amount'],
+                                                   'date': '2030-01-01', 'account_id': 'a'}])
+        evaluated = metrics.snapshot()['counters']['groups_evaluated']
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+    assert touched == [merchant] and evaluated == 1
+    after = _by_merchant(data['bills'])
+    # A gap of years ends the bill; every other bill is the same object as before
+    assert merchant not in after
+    assert all(after[name] is before[name] for name in after)
@@ -0,0 +1,41 @@
+import intents
+
+
+def _data(version, amount):
+    return {'data_version': version,
+            'bills': [{'merchant': 'Monthly Rent Payment', 'amount': amount, 'type': 'Rent/Mortgage',
+                       'last_paid': '2025-08-01', 'transaction_count': 3}]}
+
+
+def test_caches_are_dropped_when_the_data_changes():
+    question = "what is my total monthly bill amount"
+    for version in range(1, 6):
+        answer = intents.answer_question(_data(version, 1000.0 + version), question, "ngram", "Derek")
+        assert f"${1000.0 + version:.2f}" in answer
+
+    agg = intents.get_aggregates(_data(5, 1005.0))
+    # Only the current version's question is cached, not one entry per version seen
+    assert len(agg['routes']) == 1
+    assert len(agg['answers']) == 1
+
+
+def test_aggregates_follow_the_store_not_just_the_version():
+    question = "what is my total monthly bill amount"
+    json_data, sqlite_data = _data(3, 100.0), _data(3, 200.0)
+    assert "$100.00" in intents.answer_question(json_data, question, "ngram", "Derek", source=('json', 'a'))
+    assert "$200.00" in intents.answer_question(sqlite_data, question, "ngram", "Derek", source=('sqlite', 'b'))
+
+    # A deleted and recreated store can reach the same version again
+    old, new = dict(_data(1, 300.0), store_id='old'), dict(_data(1, 400.0), store_id='new')
+    assert "$300.00" in intents.answer_question(old, question, "ngram", "Derek", source=('json', 'a'))
+    assert "$400.00" in intents.answer_question(new, question, "ngram", "Derek", source=('json', 'a'))
+
+
+def test_recreated_store_gets_a_new_id(derin_home):
+    from utils import load_data, save_data
+
+    save_data(load_data())
+    first = load_data()['store_id']
+    assert load_data()['store_id'] == first
+    (derin_home / "bills.json").unlink()
+    assert load_data()['store_id'] != first
@@ -0,0 +1,22 @@
+import pytest
+
+import metrics
+from utils_embeddings import build_canonical_map, embed_texts
+
+
+@pytest.fixture
+def profiling():
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_ngram_embedding_is_timed_once(profiling):
+    embed_texts(["NETFLIX.COM", "Netflix Inc"], method="ngram")
+    build_canonical_map([{'name': "Spotify"}, {'name': "SPOTIFY USA"}], method="ngram")
+
+    snap = metrics.snapshot()
+    assert snap['stages']['embed']['calls'] == 2
+    assert snap['counters']['names_encoded'] == 4
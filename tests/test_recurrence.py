@@ -0,0 +1,93 @@
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils
+from columnar import TransactionColumns
+from recurrence import columns_from_transactions, detect_bills_columnar
+
+
+def _baseline_detect(transactions):
+    """detect_recurring_bills before the columnar core, after canonicalization"""
+    transaction_groups = defaultdict(list)
+    for transaction in transactions:
+        transaction_name = transaction.get('name', 'Unknown')
+        amount = abs(float(transaction.get('amount', 0)))
+        if amount < 5:
+            continue
+        transaction_groups[transaction_name].append({'amount': amount, 'date': transaction.get('date')})
+
+    recurring_bills = []
+    for transaction_name, transactions_list in transaction_groups.items():
+        if len(transactions_list) < 2:
+            continue
+        transactions_list.sort(key=lambda x: x['date'])
+        dates = [datetime.fromisoformat(t['date']) for t in transactions_list]
+        amounts = [t['amount'] for t in transactions_list]
+        if not all(25 <= (dates[i] - dates[i - 1]).days <= 35 for i in range(1, len(dates))):
+            continue
+        amount_variance = max(amounts) - min(amounts)
+        avg_amount = sum(amounts) / len(amounts)
+        if amount_variance / avg_amount >= 0.8:
+            continue
+        amount_trend = "stable"
+        if len(amounts) >= 3:
+            recent_avg = sum(amounts[-2:]) / 2
+            older_avg = sum(amounts[:-2]) / len(amounts[:-2])
+            if recent_avg > older_avg * 1.1:
+                amount_trend = "increasing"
+            elif recent_avg < older_avg * 0.9:
+                amount_trend = "decreasing"
+        is_anom, anom_score = utils.robust_anomaly_flag(amounts)
+        recurring_bills.append({
+            'merchant': transaction_name,
+            'amount': avg_amount,
+            'frequency': 'monthly',
+            'type': utils.classify_bill_type(transaction_name, avg_amount),
+            'last_paid': max(t['date'] for t in transactions_list),
+            'transaction_count': len(transactions_list),
+            'amount_trend': amount_trend,
+            'amount_history': amounts,
+            'anomaly': {'is_anomaly': is_anom, 'score': anom_score}
+        })
+    return recurring_bills
+
+
+def _history(rng, with_times):
+    """Shuffled payments of a few merchants; gaps straddle the 25-35 day window"""
+    rows = []
+    for m in range(rng.randint(1, 12)):
+        name = rng.choice(["Netflix", "City Power", "Rent", "Gym", "Phone", "Water"]) + f" {m}"
+        day = datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 60), hours=rng.randint(0, 23) if with_times else 0)
+        base = rng.choice([9.99, 45.0, 120.0, 1500.0, 3.0])
+        for _ in range(rng.randint(1, 14)):
+            amount = base * rng.choice([1, 1, 1, 1.05, 0.97, 2.5])
+            rows.append({'name': name, 'amount': -round(amount, 2),
+                         'date': day.isoformat() if with_times else day.date().isoformat()})
+            day += timedelta(days=rng.choice([24, 25, 28, 30, 31, 35, 36]),
+                             hours=rng.randint(-12, 12) if with_times else 0)
+    rng.shuffle(rows)
+    return rows
+
+
+@pytest.mark.parametrize('with_times', [False, True])
+def test_columnar_core_matches_the_baseline(with_times):
+    rng = random.Random(7 if with_times else 3)
+    for _ in range(300):
+        rows = _history(rng, with_times)
+        expected = _baseline_detect(rows)
+        ids, labels, dates, amounts, strings = columns_from_transactions(rows)
+        bills, _ = detect_bills_columnar(ids, labels, dates, amounts, date_strings=strings,
+                                         classify_many=utils.classify_bill_types)
+        assert bills == expected
+
+
+def test_columnar_store_counts_times_of_day(derin_home):
+    # 24 days 22 hours apart: the baseline saw a 24-day gap, not a monthly bill
+    rows = [{'id': str(i), 'name': "Netflix", 'amount': -15.99, 'date': date, 'account_id': 'a'}
+            for i, date in enumerate(['2025-06-15T23:00:00', '2025-07-10T21:00:00', '2025-08-10T21:00:00'])]
+    assert _baseline_detect(rows) == []
+    assert utils.detect_recurring_bills(TransactionColumns.from_dicts(rows)) == []
+    assert utils.detect_recurring_bills([dict(row) for row in rows]) == []
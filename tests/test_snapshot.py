@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+import utils
+from dummy_data import get_sample_transactions
+from main import cli
+from storage import JsonStorage
+
+
+@pytest.fixture
+def enriched_document(derin_home):
+    """A stored JSON document whose transactions carry fields outside the indexed columns"""
+    transactions = get_sample_transactions()
+    for i, transaction in enumerate(transactions):
+        transaction['category'] = ['Entertainment', 'Housing', 'Utilities'][i % 3]
+        transaction['pending'] = i % 2 == 0
+    transactions[0]['id'] = 1001
+    transactions[1]['date'] = transactions[1]['date'] + "T09:30:00"
+
+    bill_groups = {}
+    bills = utils.detect_recurring_bills([dict(t) for t in transactions], groups=bill_groups)
+    JsonStorage(utils.DATA_FILE).save({
+        'transactions': transactions, 'bills': bills, 'bill_groups': bill_groups,
+        'user_profile': {'name': 'Derek', 'preferences': {'alert_days_before': 5}},
+        'price_alerts': [], 'data_version': 7
+    })
+    with open(utils.DATA_FILE) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('source', ['json', 'sqlite'])
+def test_snapshot_round_trip_is_lossless(enriched_document, source):
+    runner = CliRunner()
+    if source == 'sqlite':
+        assert runner.invoke(cli, ['migrate']).exit_code == 0
+
+    result = runner.invoke(cli, ['export-snapshot', '--source', source])
+    assert result.exit_code == 0, result.output
+    os.remove(utils.DATA_FILE)
+    result = runner.invoke(cli, ['import-snapshot', '--target', 'json'])
+    assert result.exit_code == 0, result.output
+
+    with open(utils.DATA_FILE) as f:
+        document = json.load(f)
+    assert document == enriched_document
@@ -0,0 +1,175 @@
+import os
+import stat
+import threading
+
+import pytest
+
+import storage
+import utils
+from storage import FileLock, JsonStorage
+
+fcntl = pytest.importorskip("fcntl")
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def _rows(*ids):
+    return [{'id': i, 'date': '2025-09-01', 'amount': -10.0, 'name': "Gym", 'account_id': 'a'} for i in ids]
+
+
+def test_atomic_save_keeps_the_file_mode(tmp_path):
+    path = str(tmp_path / "bills.json")
+    umask = os.umask(0o022)
+    try:
+        JsonStorage(path).save({'transactions': []})
+    finally:
+        os.umask(umask)
+    assert _mode(path) == 0o644
+
+    os.chmod(path, 0o640)
+    JsonStorage(path).save({'transactions': _rows('t1')})
+    assert _mode(path) == 0o640
+
+
+def test_journal_replays_on_top_of_the_document(tmp_path):
+    store = JsonStorage(str(tmp_path / "bills.json"))
+    store.save({'transactions': _rows('t1'), 'bill_groups': {}, 'data_version': 1})
+    store.save_ingest({'bill_groups': {'Gym': {'n': 2}}, 'data_version': 2}, _rows('t2'), ['Gym'])
+    store.save_ingest({'bill_groups': {'Gym': {'n': 3}}, 'data_version': 3}, _rows('t3'), ['Gym'])
+
+    assert [r['seq'] for r in store.journal.read()] == [1, 2]
+    data = store.load()
+    assert [t['id'] for t in data['transactions']] == ['t1', 't2', 't3']
+    assert data['bill_groups'] == {'Gym': {'n': 3}} and data['data_version'] == 3
+
+
+def test_a_torn_journal_line_is_ignored_and_repaired(tmp_path):
+    store = JsonStorage(str(tmp_path / "bills.json"))
+    store.save_ingest({'data_version': 1}, _rows('t1'), [])
+    with open(store.journal.path, 'a') as f:
+        f.write('{"transactions": [{"id": "half')
+    assert [t['id'] for t in store.load()['transactions']] == ['t1']
+
+    # A new writer drops the torn tail before appending
+    JsonStorage(store.path).save_ingest({'data_version': 2}, _rows('t2'), [])
+    assert [t['id'] for t in store.load()['transactions']] == ['t1', 't2']
+
+
+def test_compaction_folds_the_journal_and_keeps_numbering(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'JOURNAL_COMPACT_BYTES', 0)
+    store = JsonStorage(str(tmp_path / "bills.json"))
+    store.save({'transactions': _rows('t1'), 'bill_groups': {}})
+    for i in range(2, 6):
+        store.save_ingest({'data_version': i}, _rows(f"t{i}"), [])
+
+    records = store.journal.read()
+    # Compacted: a checkpoint carries the numbering, later records follow it
+    assert set(records[0]) == {'seq'} and len(records) < 4
+    assert [r['seq'] for r in records] == list(range(records[0]['seq'], 5))
+    data = store.load()
+    assert [t['id'] for t in data['transactions']] == ['t1', 't2', 't3', 't4', 't5']
+    assert data['data_version'] == 5 and 'journal_seq' not in data
+
+
+def test_file_lock_is_reentrant_and_excludes_other_holders(tmp_path):
+    path = str(tmp_path / "bills.json.lock")
+    lock = FileLock(path)
+
+    def try_flock():
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+
+    with lock.shared():
+        # Upgrading to exclusive in the same thread doesn't deadlock
+        with lock.exclusive():
+            assert not try_flock()
+        assert not try_flock()
+    assert try_flock()
+
+    entered = threading.Event()
+    with lock.exclusive():
+        thread = threading.Thread(target=lambda: (lock.exclusive().__enter__(), entered.set()))
+        thread.start()
+        assert not entered.wait(0.2)
+    assert entered.wait(5)
+    thread.join()
+
+
+def test_concurrent_writers_do_not_lose_updates(tmp_path):
+    path = str(tmp_path / "bills.json")
+    JsonStorage(path).save({'count': 0})
+
+    def bump():
+        store = JsonStorage(path)
+        for _ in range(25):
+            with store.locked():
+                data = store.load()
+                data['count'] += 1
+                store.save(data)
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert JsonStorage(path).load()['count'] == 100
+
+
+def test_sqlite_round_trips_the_document(tmp_path):
+    store = storage.SqliteStorage(str(tmp_path / "bills.db"))
+    data = {'transactions': [{'id': 1001, 'date': '2025-09-01', 'amount': -10.0, 'name': "Gym",
+                              'account_id': 'a', 'category': ['Recreation']}],
+            'bills': [{'merchant': "Gym", 'amount': 10.0}, {'merchant': "Rent", 'amount': 900.0}],
+            'bill_groups': {'Gym': {'dates': ['2025-09-01'], 'amounts': [10.0]}},
+            'user_profile': {'name': "Derek"}, 'price_alerts': []}
+    store.save(data)
+
+    loaded = store.load()
+    # Non-string ids keep their type, extra fields survive, bills keep their order
+    assert loaded['transactions'] == data['transactions']
+    assert [bill['merchant'] for bill in loaded['bills']] == ["Gym", "Rent"]
+    assert loaded['bill_groups'] == data['bill_groups'] and loaded['user_profile'] == {'name': "Derek"}
+    assert loaded['data_version'] == 1
+
+
+def test_sqlite_loads_only_the_sections_asked_for(tmp_path):
+    store = storage.SqliteStorage(str(tmp_path / "bills.db"))
+    store.save({'transactions': _rows('t1', 't2'), 'bills': [{'merchant': "Gym"}], 'user_profile': {}})
+    assert set(store.load(('bills', 'data_version'))) == {'bills', 'data_version'}
+    assert store.load_transactions(merchant="Gym", start='2025-09-01', account_id='a')
+    assert store.load_transactions(merchant="Rent") == []
+
+
+def test_sqlite_ingest_appends_and_moves_the_version(tmp_path):
+    path = str(tmp_path / "bills.db")
+    store = storage.SqliteStorage(path)
+    store.save({'transactions': _rows('t1'), 'bill_groups': {'Gym': {'n': 1}, 'Rent': {'n': 1}}})
+    stale = store.load(store.ingest_sections)
+
+    data = store.load(store.ingest_sections)
+    data['bill_groups']['Gym'] = {'n': 2}
+    store.save_ingest(data, _rows('t2'), ['Gym'])
+    # A writer holding an older version still gets a fresh number
+    store.save_ingest(stale, [], [])
+    assert stale['data_version'] == data['data_version'] + 1
+
+    loaded = storage.SqliteStorage(path).load()
+    assert [t['id'] for t in loaded['transactions']] == ['t1', 't2']
+    assert loaded['bill_groups'] == {'Gym': {'n': 2}, 'Rent': {'n': 1}}
+
+
+def test_first_sqlite_run_migrates_the_json_file(derin_home, monkeypatch):
+    JsonStorage(utils.DATA_FILE).save({'transactions': _rows('t1', 't2'), 'bills': []})
+    monkeypatch.setattr(utils, 'STORAGE_BACKEND', "sqlite")
+    data = utils.load_data()
+    assert [t['id'] for t in data['transactions']] == ['t1', 't2']
+    assert 'Gym' in data['bill_groups']
+    assert os.path.exists(utils.SQLITE_FILE)
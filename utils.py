@@ -4,12 +4,15 @@ Utility functions
 """
 
 import os
-import json
+from bisect import bisect_right
 from datetime import datetime
-from collections import defaultdict
 from dateutil.relativedelta import relativedelta
 from statistics import median
-from utils_embeddings import build_canonical_map_embeddings, normalize_transactions_with_embeddings
+from storage import JsonStorage, SqliteStorage, SnapshotStorage, migrate_json_to_sqlite, export_snapshot
+import metrics
+from due_index import refresh_due_index, upcoming_window
+from anomaly import MAX_PRICE_ALERTS, score_new_transactions
+from bill_rules import get_classifier
 
 # User configuration
 USER_NAME = "Derek"
@@ -17,6 +20,27 @@ USER_NAME = "Derek"
 # Data file path
 DATA_FILE = os.path.expanduser("~/.derin_bills.json")
 
+# Storage backend: "json" (DATA_FILE), "sqlite" (SQLITE_FILE) or "snapshot" (SNAPSHOT_DIR)
+STORAGE_BACKEND = os.environ.get("DERIN_STORAGE", "json")
+SQLITE_FILE = os.path.expanduser("~/.derin_bills.db")
+SNAPSHOT_DIR = os.path.expanduser("~/.derin_snapshot")
+
+# Keep loaded data in memory between calls (enabled by the resident daemon)
+CACHE_DATA = False
+_data_cache = {}
+
+# Merchant-name canonicalizer: "embeddings" (sentence transformer) or "ngram" (model-free)
+CANONICALIZER = os.environ.get("DERIN_CANONICALIZER", "embeddings")
+
+# Resolve names through the persistent canonical index (canonical_index.py) instead of
+# reclustering every name on each run
+CANONICAL_INDEX = os.environ.get("DERIN_CANONICAL_INDEX", "1") != "0"
+
+# Skip re-imported transactions on ingest (dedup.py): matched by id, else by date/amount/name/account
+DEDUP = os.environ.get("DERIN_DEDUP", "1") != "0"
+# Front the dedup index with an in-memory Bloom filter (pays off for very large histories)
+DEDUP_BLOOM = os.environ.get("DERIN_DEDUP_BLOOM", "0") == "1"
+
 # --- Robust anomaly check on amount history (MAD z-score) ---
 def robust_anomaly_flag(amounts, z_thresh=3.5):
     """
@@ -34,138 +58,307 @@ def robust_anomaly_flag(amounts, z_thresh=3.5):
     last_z = z_scores[-1]
     return (abs(last_z) > z_thresh), float(last_z)
 
-def load_data():
-    """Load user data from JSON file"""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    
-    from dummy_data import get_default_user_data
-    return get_default_user_data()
+def get_storage(backend=None):
+    """Return the storage backend selected by STORAGE_BACKEND ("json", "sqlite" or "snapshot")"""
+    backend = backend or STORAGE_BACKEND
+    if backend == "sqlite":
+        storage = SqliteStorage(SQLITE_FILE)
+        json_storage = JsonStorage(DATA_FILE)
+        if not storage.exists() and json_storage.exists():
+            # First run on SQLite: carry over the existing JSON history
+            migrate_json_to_sqlite(json_storage, storage, build_groups=build_bill_groups)
+        return storage
+    if backend == "snapshot":
+        storage = SnapshotStorage(SNAPSHOT_DIR)
+        json_storage = JsonStorage(DATA_FILE)
+        if not storage.exists() and json_storage.exists():
+            export_snapshot(json_storage, storage, build_groups=build_bill_groups)
+        return storage
+    if backend == "json":
+        return JsonStorage(DATA_FILE)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+def data_source():
+    """(backend, path) that load_data reads from"""
+    paths = {"json": DATA_FILE, "sqlite": SQLITE_FILE, "snapshot": SNAPSHOT_DIR}
+    return STORAGE_BACKEND, paths.get(STORAGE_BACKEND)
+
+def load_data(sections=None):
+    """Load user data (optionally only the given top-level sections)"""
+    storage = get_storage()
+    if not CACHE_DATA:
+        return storage.load(sections)
+
+    # Reuse the in-memory copy until the stored data changes
+    key = (type(storage).__name__, storage.path)
+    version = storage.version()
+    cached = _data_cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, storage.load())
+        _data_cache[key] = cached
+    data = cached[1]
+    return {k: v for k, v in data.items() if sections is None or k in sections}
 
 def save_data(data):
-    """Save user data to JSON file"""
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
-
-def detect_recurring_bills(transactions):
-    """AI-powered detection of recurring bills from transactions"""
-    if not transactions:
-        return []
-    
-    canon_map = build_canonical_map_embeddings(transactions, sim_threshold=0.65)
-    transactions = normalize_transactions_with_embeddings(transactions, canon_map)
-    
-    
-    # Group transactions by transaction name
-    transaction_groups = defaultdict(list)
-    
+    """Save user data"""
+    invalidate_dedup_index(data)
+    get_storage().save(data)
+
+def open_dedup_index(storage, data):
+    """The dedup index of storage (None when DEDUP is off), rebuilt if it is out of step with data"""
+    if not DEDUP:
+        return None
+    from dedup import DedupIndex
+    index = DedupIndex(storage.path + ".dedup.sqlite", bloom=DEDUP_BLOOM)
+    if not index.is_current(data.get('dedup_token')):
+        stored = data['transactions'] if 'transactions' in data else storage.load_transactions()
+        data['dedup_token'] = index.rebuild(stored)
+    return index
+
+def invalidate_dedup_index(data):
+    """A full save may replace every transaction: rebuild the dedup index on the next ingest"""
+    data['dedup_token'] = None
+
+def _is_monthly_gap(days_diff):
+    """25-35 days between payments"""
+    return 25 <= days_diff <= 35
+
+def _days_between(earlier, later):
+    return (datetime.fromisoformat(later) - datetime.fromisoformat(earlier)).days
+
+def _canonical_map(names):
+    """Raw name -> canonical merchant name; names are in order of first appearance"""
+    if CANONICAL_INDEX:
+        from canonical_index import get_canonical_index
+        return get_canonical_index(CANONICALIZER).canonicalize(names)
+    from utils_embeddings import build_canonical_map
+    return build_canonical_map([{'name': name} for name in names], method=CANONICALIZER)
+
+@metrics.timed("canonicalize")
+def _canonicalize(transactions, known_names=()):
+    """Replace transaction names with canonical merchant names, in place"""
+    # Imported lazily: utils_embeddings pulls in numpy (and torch once the model loads)
+    from utils_embeddings import normalize_transactions_with_embeddings
+    from columnar import TransactionColumns
+
+    if isinstance(transactions, TransactionColumns):
+        # Cluster the name table rather than one dict per row
+        return transactions.rename(_canonical_map(transactions.distinct_names()))
+
+    known_names = list(known_names)
+    # Seed the clustering with existing group names so new variants join them
+    canon_map = _canonical_map(known_names + [t.get('name') for t in transactions])
+    for name in known_names:
+        canon_map[name] = name
+    return normalize_transactions_with_embeddings(transactions, canon_map)
+
+def _add_to_group(group, date, amount):
+    """Insert one payment into a group's sorted state, keeping the gap counters current"""
+    dates, amounts = group['dates'], group['amounts']
+    i = bisect_right(dates, date)
+    if 0 < i < len(dates) and not _is_monthly_gap(_days_between(dates[i - 1], dates[i])):
+        group['irregular_gaps'] -= 1
+    if i > 0 and not _is_monthly_gap(_days_between(dates[i - 1], date)):
+        group['irregular_gaps'] += 1
+    if i < len(dates) and not _is_monthly_gap(_days_between(date, dates[i])):
+        group['irregular_gaps'] += 1
+    dates.insert(i, date)
+    amounts.insert(i, amount)
+    if len(dates) >= 2:
+        group['last_gap'] = _days_between(dates[-2], dates[-1])
+
+def update_bill_groups(groups, transactions):
+    """Add (already canonicalized) transactions to the per-merchant state; returns touched names"""
+    touched = {}
     for transaction in transactions:
         # Use the full transaction name for grouping
         transaction_name = transaction.get('name', 'Unknown')
         amount = abs(float(transaction.get('amount', 0)))
-        
+
         # Skip very small amounts (likely not bills)
         if amount < 5:
             continue
-            
-        transaction_groups[transaction_name].append({
-            'amount': amount,
-            'date': transaction.get('date'),
-            'transaction': transaction
+
+        group = groups.setdefault(transaction_name, {
+            'dates': [],
+            'amounts': [],
+            'last_gap': None,
+            'irregular_gaps': 0
         })
-    
-    recurring_bills = []
-    
-    for transaction_name, transactions_list in transaction_groups.items():
-        if len(transactions_list) < 2:
-            continue
-        
-        # Sort by date
-        transactions_list.sort(key=lambda x: x['date'])
-        
-        # Check for recurring date pattern
-        dates = [datetime.fromisoformat(t['date']) for t in transactions_list]
-        amounts = [t['amount'] for t in transactions_list]
-        
-        # Check if dates are about a month apart
-        is_monthly = True
-        if len(dates) >= 2:
-            for i in range(1, len(dates)):
-                days_diff = (dates[i] - dates[i-1]).days
-                # 25-35 days between payments
-                if not (25 <= days_diff <= 35):
-                    is_monthly = False
-                    break
-        
-        if is_monthly:
-            # Calculate amount variance
-            amount_variance = max(amounts) - min(amounts) if amounts else 0
-            avg_amount = sum(amounts) / len(amounts)
-            
-            # More lenient variance check since we're using name matching
-            if amount_variance / avg_amount < 0.8:  # Allow up to 80% variance
-                # Bill type
-                bill_type = classify_bill_type(transaction_name, avg_amount)
-                
-                # Calculate amount trend
-                amount_trend = "stable"
-                if len(amounts) >= 3:
-                    recent_avg = sum(amounts[-2:]) / 2
-                    older_avg = sum(amounts[:-2]) / len(amounts[:-2])
-                    if recent_avg > older_avg * 1.1:  # 10% increase
-                        amount_trend = "increasing"
-                    elif recent_avg < older_avg * 0.9:  # 10% decrease
-                        amount_trend = "decreasing"
-                
-                is_anom, anom_score = robust_anomaly_flag(amounts)
-                
-                recurring_bills.append({
-                    'merchant': transaction_name,
-                    'amount': avg_amount,
-                    'frequency': 'monthly',
-                    'type': bill_type,
-                    'last_paid': max(t['date'] for t in transactions_list),
-                    'transaction_count': len(transactions_list),
-                    'amount_trend': amount_trend,
-                    'amount_history': amounts,
-                    'anomaly': {
-                        'is_anomaly': is_anom,
-                        'score': anom_score
-                    }
-                })
-    
+        _add_to_group(group, transaction.get('date'), amount)
+        touched[transaction_name] = True
+    return list(touched)
+
+def build_bill_groups(transactions):
+    """Build per-merchant group state (sorted dates, amount history, gap counters)"""
+    groups = {}
+    update_bill_groups(groups, transactions)
+    return groups
+
+def evaluate_bill_group(transaction_name, group):
+    """Return the recurring bill for one merchant group, or None if it isn't one"""
+    metrics.count("groups_evaluated")
+    dates, amounts = group['dates'], group['amounts']
+    if len(dates) < 2:
+        return None
+
+    # Check if dates are about a month apart
+    if group['irregular_gaps']:
+        return None
+
+    # Calculate amount variance
+    amount_variance = max(amounts) - min(amounts) if amounts else 0
+    avg_amount = sum(amounts) / len(amounts)
+
+    # More lenient variance check since we're using name matching
+    if amount_variance / avg_amount >= 0.8:  # Allow up to 80% variance
+        return None
+
+    # Bill type
+    bill_type = classify_bill_type(transaction_name, avg_amount)
+
+    # Calculate amount trend
+    amount_trend = "stable"
+    if len(amounts) >= 3:
+        recent_avg = sum(amounts[-2:]) / 2
+        older_avg = sum(amounts[:-2]) / len(amounts[:-2])
+        if recent_avg > older_avg * 1.1:  # 10% increase
+            amount_trend = "increasing"
+        elif recent_avg < older_avg * 0.9:  # 10% decrease
+            amount_trend = "decreasing"
+
+    is_anom, anom_score = robust_anomaly_flag(amounts)
+
+    return {
+        'merchant': transaction_name,
+        'amount': avg_amount,
+        'frequency': 'monthly',
+        'type': bill_type,
+        'last_paid': dates[-1],
+        'transaction_count': len(dates),
+        'amount_trend': amount_trend,
+        'amount_history': list(amounts),
+        'anomaly': {
+            'is_anomaly': is_anom,
+            'score': anom_score
+        }
+    }
+
+def detect_recurring_bills(transactions, groups=None):
+    """
+    AI-powered detection of recurring bills from transactions.
+    transactions is a list of dicts or a columnar.TransactionColumns store.
+    Pass an empty dict as groups to receive the per-merchant state for later ingests.
+    """
+    if not len(transactions):
+        return []
+
+    transactions = _canonicalize(transactions)
+
+    # Group and evaluate every merchant at once on sorted columns
+    from recurrence import detect_bills_columnar, columns_from_transactions, parse_dates
+    from columnar import TransactionColumns
+
+    with metrics.stage("columns"):
+        if isinstance(transactions, TransactionColumns):
+            merchant_ids, labels, dates, amounts = (transactions.name_ids, transactions.names.strings,
+                                                    transactions.dates, transactions.amounts)
+            date_strings = None
+            if transactions.date_overrides:
+                # Dates with a time of day: gaps count it, as the per-group path does
+                date_strings = transactions.date_strings()
+                dates = parse_dates(date_strings)
+        else:
+            merchant_ids, labels, dates, amounts, date_strings = columns_from_transactions(transactions)
+    recurring_bills, new_groups = detect_bills_columnar(
+        merchant_ids, labels, dates, amounts, date_strings=date_strings,
+        classify_many=classify_bill_types, with_groups=groups is not None
+    )
+    if groups is not None:
+        groups.update(new_groups)
+
     return recurring_bills
 
+@metrics.timed("ingest")
+def ingest_transactions(data, new_transactions, on_price_alert=None, dedup=None, backfill=False):
+    """
+    Append new transactions and re-evaluate only the merchant groups they touch.
+    Price spikes found on arrival are appended to data['price_alerts'], unless
+    backfill is set (e.g. an account's first sync): old history still updates the
+    rolling windows but raises no alerts.
+    With a dedup index (open_dedup_index), transactions already stored are removed
+    from new_transactions in place, so the caller saves only the new ones.
+    Returns the touched merchant names.
+    """
+    groups = data.get('bill_groups')
+    if groups is None:
+        # Data saved before group state existed: names are already canonical
+        groups = build_bill_groups(data.get('transactions', []))
+        data['bill_groups'] = groups
+
+    if not new_transactions:
+        return []
+
+    new_transactions = _canonicalize(new_transactions, known_names=groups.keys())
+    if dedup is not None:
+        # Fingerprints use canonical names, which stay stable across re-imports
+        new_transactions[:] = dedup.filter(new_transactions)
+        if not new_transactions:
+            return []
+        data['dedup_token'] = dedup.add(new_transactions)
+    data.setdefault('transactions', []).extend(new_transactions)
+
+    # Score price spikes on arrival, against each merchant's rolling window
+    with metrics.stage("anomaly"):
+        price_alerts, windows = score_new_transactions(groups, new_transactions)
+    if backfill:
+        price_alerts = []
+    data['price_alerts'] = (data.get('price_alerts', []) + price_alerts)[-MAX_PRICE_ALERTS:]
+    if on_price_alert:
+        for alert in price_alerts:
+            on_price_alert(alert)
+
+    touched = update_bill_groups(groups, new_transactions)
+    for transaction_name, window in windows.items():
+        groups[transaction_name]['anomaly_window'] = window
+    touched_set = set(touched)
+
+    # Re-evaluate touched merchants only, keep every other bill as is
+    bills = [bill for bill in data.get('bills', []) if bill['merchant'] not in touched_set]
+    for transaction_name in touched:
+        bill = evaluate_bill_group(transaction_name, groups[transaction_name])
+        if bill:
+            bills.append(bill)
+    metrics.count("bills_emitted", sum(1 for bill in bills if bill['merchant'] in touched_set))
+    data['bills'] = bills
+    refresh_due_index(data, touched)
+    bump_data_version(data)
+    return touched
+
 def classify_bill_type(merchant, amount):
     """Classify bill type based on merchant and amount"""
-    # Simple rule-based classification
-    merchant_lower = merchant.lower()
-    
-    if any(word in merchant_lower for word in ['rent', 'apartment', 'housing']):
-        return "Rent/Mortgage"
-    elif any(word in merchant_lower for word in ['electric', 'gas', 'water', 'trash', 'disposal','utility']):
-        return "Utilities"
-    elif any(word in merchant_lower for word in ['internet', 'cable', 'wifi', 'ethernet']):
-        return "Internet/Cable"
-    elif any(word in merchant_lower for word in ['phone', 'mobile', 'cellular']):
-        return "Phone/Mobile"
-    elif any(word in merchant_lower for word in ['insurance', 'auto', 'health']):
-        return "Insurance"
-    elif any(word in merchant_lower for word in ['netflix', 'spotify', 'subscription', 'streaming']):
-        return "Subscription"
-    elif any(word in merchant_lower for word in ['credit', 'card', 'payment']):
-        return "Credit Card"
-    elif any(word in merchant_lower for word in ['loan', 'mortgage']):
-        return "Loan Payment"
-    else:
-        return "Other"
+    # Rule-based classification, rules loaded from bill_rules.json
+    return get_classifier().classify(merchant)
+
+def classify_bill_types(merchants):
+    """Classify many merchants at once"""
+    return get_classifier().classify_many(merchants)
+
+def bump_data_version(data):
+    """Mark bills as changed so cached answers are recomputed"""
+    data['data_version'] = data.get('data_version', 0) + 1
 
 def get_insight(user_data, context=""):
     """Get basic insights about bills and financial health"""
+    if context:
+        # Route the question to a specific answer when it matches a known intent
+        from intents import answer_question
+        answer = answer_question(user_data, context, CANONICALIZER, USER_NAME,
+                                 upcoming_days=upcoming_window(user_data), source=data_source())
+        if answer:
+            return answer
+
     bills = user_data.get('bills', [])
-    transactions = user_data.get('transactions', [])
     
     total_monthly_bills = sum(bill['amount'] for bill in bills)
     bill_count = len(bills)
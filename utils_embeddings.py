@@ -1,19 +1,405 @@
 from __future__ import annotations
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import Dict, List
+import importlib.util
+import os
+import re
+import sqlite3
+import time
+import zlib
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-_model = None
+import metrics
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Embedder backend: "transformer", "quantized" (int8 CPU) or "hashing" (model-free)
+EMBEDDER = os.environ.get("DERIN_EMBEDDER", "transformer")
+# Local model directory for the quantized backend (default: MODEL_NAME)
+EMBEDDER_MODEL_PATH = os.environ.get("DERIN_EMBEDDER_PATH")
+EMBED_BATCH_SIZE = int(os.environ.get("DERIN_EMBED_BATCH_SIZE", "64"))
+# Torch intra-op threads; 0 keeps torch's default
+EMBED_THREADS = int(os.environ.get("DERIN_EMBED_THREADS", "0"))
+
+# On-disk embedding cache, keyed by (model name, normalized name)
+EMBEDDING_CACHE_FILE = os.path.expanduser("~/.derin_embeddings.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+# Granularity of the cache's access times: a hit rewrites an entry at most once per step
+LRU_RESOLUTION_SECONDS = 60
+
+_cache = None
+
+def normalize_name(name: str) -> str:
+    """Cache key form of a transaction name (the model is uncased)"""
+    return " ".join((name or "").lower().split())
+
+# --- Embedding-free canonicalizer: token normalization + character n-grams ---
+NGRAM_SIZE = 3
+NGRAM_DIM = 2048
+_NOISE_TOKENS = {"com", "net", "org", "www", "inc", "llc", "ltd", "co", "corp", "the"}
+
+def normalize_tokens(name: str) -> List[str]:
+    """Lowercase, split on non-alphanumerics and drop corporate/domain noise tokens"""
+    tokens = re.split(r"[^a-z0-9]+", (name or "").lower())
+    return [tok for tok in tokens if tok and tok not in _NOISE_TOKENS] or ["unknown"]
+
+def _embed_ngrams(texts: List[str], n: int = NGRAM_SIZE, dim: int = NGRAM_DIM) -> np.ndarray:
+    """Unit-norm hashed character n-gram count vectors (deterministic, no model)"""
+    metrics.count("names_encoded", len(texts))
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for tok in normalize_tokens(text):
+            padded = f" {tok} "
+            for i in range(max(len(padded) - n + 1, 1)):
+                out[row, zlib.crc32(padded[i:i + n].encode()) % dim] += 1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.maximum(norms, 1e-12)
+
+class EmbeddingCache:
+    """Size-bounded, least-recently-used vector cache stored in SQLite"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_FILE, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, name TEXT NOT NULL, vec BLOB NOT NULL,"
+                " last_used INTEGER NOT NULL, PRIMARY KEY (model, name))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            # Running row count, kept in step by every write; counted once for caches that predate it
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'entries', COUNT(*) FROM embeddings")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _now() -> int:
+        """Access time in LRU_RESOLUTION_SECONDS steps"""
+        return int(time.time()) // LRU_RESOLUTION_SECONDS
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return cached vectors for the given normalized keys and mark them as used"""
+        conn = self._connect()
+        now = self._now()
+        found: Dict[str, np.ndarray] = {}
+        stale = []
+        uniq = list(dict.fromkeys(keys))
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(uniq), 500):
+            chunk = uniq[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT name, vec, last_used FROM embeddings WHERE model = ? AND name IN ({marks})",
+                [model, *chunk],
+            ).fetchall()
+            for name, blob, last_used in rows:
+                found[name] = np.frombuffer(blob, dtype=np.float32)
+                if last_used < now:
+                    stale.append(name)
+        # Entries already used this step keep their time: repeated hits cost no write
+        if stale:
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND name = ?",
+                [(now, model, name) for name in stale],
+            )
+            conn.commit()
+        self.hits += len(found)
+        self.misses += len(uniq) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, np.ndarray]) -> None:
+        """Store vectors, evicting the least recently used entries over the size bound"""
+        if not items:
+            return
+        conn = self._connect()
+        before = conn.total_changes
+        # An entry another process stored meanwhile is kept: same model, same name, same vector
+        conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (model, name, vec, last_used) VALUES (?, ?, ?, ?)",
+            [(model, name, np.asarray(vec, dtype=np.float32).tobytes(), self._now())
+             for name, vec in items.items()],
+        )
+        added = conn.total_changes - before
+        conn.execute("UPDATE meta SET value = value + ? WHERE key = 'entries'", (added,))
+        total = conn.execute("SELECT value FROM meta WHERE key = 'entries'").fetchone()[0]
+        overflow = total - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+            conn.execute("UPDATE meta SET value = value - ? WHERE key = 'entries'", (overflow,))
+            self.evictions += overflow
+        conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# --- Embedder backends ---
+
+class Embedder:
+    """Turns texts into unit-norm float32 vectors; `name` namespaces the embedding cache"""
+
+    name = ""
+    sim_threshold = 0.65
+    requires_transformer = False
+    cacheable = True
+
+    def load(self):
+        return None
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+class TransformerEmbedder(Embedder):
+    """The sentence-transformer model, float32"""
+
+    requires_transformer = True
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: Optional[int] = None, threads: Optional[int] = None):
+        self.model_name = model_name
+        self.name = model_name
+        self.batch_size = batch_size or EMBED_BATCH_SIZE
+        self.threads = EMBED_THREADS if threads is None else threads
+        self.model = None
+
+    def _load_model(self) -> SentenceTransformer:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name)
+
+    def load(self) -> SentenceTransformer:
+        if self.model is None:
+            # Imported here so commands that never canonicalize don't pay for torch
+            with metrics.stage("model_load"):
+                if self.threads:
+                    import torch
+                    torch.set_num_threads(self.threads)
+                self.model = self._load_model()
+        return self.model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vecs = self.load().encode(list(texts), batch_size=self.batch_size,
+                                  normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vecs, dtype=np.float32)
+
+class QuantizedEmbedder(TransformerEmbedder):
+    """The transformer with int8 dynamically quantized Linear layers, on CPU"""
+
+    def __init__(self, model_path: Optional[str] = None, **kwargs):
+        super().__init__(model_name=model_path or EMBEDDER_MODEL_PATH or MODEL_NAME, **kwargs)
+        # Quantized vectors differ slightly, so they get their own cache entries
+        self.name = f"{self.model_name}:int8"
+
+    def _load_model(self) -> SentenceTransformer:
+        import torch
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(self.model_name, device="cpu")
+        model.eval()
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class HashingEmbedder(Embedder):
+    """Deterministic hashed character n-grams: no model, no cache needed"""
+
+    sim_threshold = 0.5
+    cacheable = False
+
+    def __init__(self, n: int = NGRAM_SIZE, dim: int = NGRAM_DIM):
+        self.n, self.dim = n, dim
+        self.name = f"hashing-{n}gram-{dim}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return _embed_ngrams(texts, n=self.n, dim=self.dim)
+
+EMBEDDERS = {"transformer": TransformerEmbedder, "quantized": QuantizedEmbedder, "hashing": HashingEmbedder}
+_embedders: Dict[str, Embedder] = {}
+
+def get_embedder(backend: Optional[str] = None) -> Embedder:
+    """Shared embedder instance for the backend (default: EMBEDDER)"""
+    backend = backend or EMBEDDER
+    if backend not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder backend: {backend}")
+    if backend not in _embedders:
+        _embedders[backend] = EMBEDDERS[backend]()
+    return _embedders[backend]
 
 def _get_model() -> SentenceTransformer:
-    global _model
-    if _model is None:
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
-    return _model
+    return get_embedder("transformer").load()
 
-def _embed(texts: List[str]) -> np.ndarray:
-    model = _get_model()
-    return model.encode(texts, normalize_embeddings=True)
+def measure_throughput(texts: List[str], backends=tuple(EMBEDDERS)) -> List[dict]:
+    """Encode texts with each backend (bypassing the cache); names/second per backend"""
+    import time
+    report = []
+    for backend in backends:
+        embedder = EMBEDDERS[backend]()
+        if embedder.requires_transformer and not transformer_available():
+            report.append({"backend": backend, "error": "sentence-transformers not installed"})
+            continue
+        start = time.perf_counter()
+        embedder.load()
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        embedder.encode(texts)
+        seconds = time.perf_counter() - start
+        report.append({
+            "backend": backend,
+            "load_seconds": load_seconds,
+            "encode_seconds": seconds,
+            "names_per_second": len(texts) / seconds if seconds else float("inf"),
+        })
+    return report
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
+
+@metrics.timed("embed")
+def _embed(texts: List[str], cache: Optional[EmbeddingCache] = None, embedder: Optional[Embedder] = None) -> np.ndarray:
+    """
+    Embed texts, only sending names the cache has never seen to the model. Every
+    backend goes through here, so the "embed" stage is timed once per call.
+    """
+    if embedder is None:
+        embedder = get_embedder()
+    if not embedder.cacheable:
+        return embedder.encode(texts)
+    if cache is None:
+        cache = get_embedding_cache()
+    keys = [normalize_name(t) for t in texts]
+    found = cache.get_many(embedder.name, keys)
+
+    missing = [k for k in dict.fromkeys(keys) if k not in found]
+    metrics.count("embedding_cache_hits", len(found))
+    metrics.count("names_encoded", len(missing))
+    if missing:
+        vecs = embedder.encode(missing)
+        fresh = {k: np.asarray(v, dtype=np.float32) for k, v in zip(missing, vecs)}
+        cache.put_many(embedder.name, fresh)
+        found.update(fresh)
+
+    return np.vstack([found[k] for k in keys])
+
+# Names are clustered in blocks; see _cluster_greedy
+CLUSTER_BLOCK_SIZE = 1024
+
+class _CentroidMatrix:
+    """Preallocated, growable (capacity x dim) matrix of unit-norm cluster centroids"""
+
+    def __init__(self, dim: int, capacity: int = 256, dtype=np.float32):
+        self.data = np.empty((max(capacity, 1), dim), dtype=dtype)
+        self.size = 0
+
+    @property
+    def active(self) -> np.ndarray:
+        return self.data[:self.size]
+
+    def append(self, vec: np.ndarray) -> int:
+        if self.size == self.data.shape[0]:
+            grown = np.empty((self.data.shape[0] * 2, self.data.shape[1]), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size] = vec
+        self.size += 1
+        return self.size - 1
+
+    def merge(self, j: int, vec: np.ndarray) -> None:
+        merged = self.data[j] + vec
+        self.data[j] = merged / np.linalg.norm(merged)
+
+@metrics.timed("cluster")
+def _cluster_greedy(vecs: np.ndarray, sim_threshold: float, block_size: int = CLUSTER_BLOCK_SIZE,
+                    centroids: Optional[_CentroidMatrix] = None) -> List[int]:
+    """
+    Single-pass greedy clustering: each vector joins its most similar centroid if the
+    cosine similarity reaches sim_threshold (the centroid is then re-normalized towards
+    it), otherwise it starts a new cluster. Returns the cluster index of every vector.
+    Pass existing centroids to continue a clustering; they are updated in place.
+
+    Similarities against centroids that existed before a block are computed with one
+    matrix product per block. Centroids merged or created inside the block are stale
+    in that product, so they are masked out of it and re-scored against the current
+    matrix row. The result matches the one-at-a-time loop exactly, up to float32
+    rounding (~1e-6) for similarities tied with the threshold or another centroid.
+    The work is still names x clusters with a Python step per name; blocking only
+    avoids re-stacking the centroids and one small product per name.
+    """
+    n = vecs.shape[0]
+    if n == 0:
+        return []
+    if centroids is None:
+        centroids = _CentroidMatrix(vecs.shape[1], capacity=min(n, 1024), dtype=vecs.dtype)
+    existing = centroids.size
+    assignment: List[int] = []
+
+    for start in range(0, n, block_size):
+        block = vecs[start:start + block_size]
+        k0 = centroids.size
+        sims = block @ centroids.active.T if k0 else None
+        dirty: List[int] = []
+        dirty_set = set()
+
+        for r in range(block.shape[0]):
+            vec = block[r]
+            best_j, best_sim = -1, -np.inf
+
+            # Centroids untouched since the block product was taken
+            if k0 and len(dirty_set) < k0:
+                j = int(np.argmax(sims[r]))
+                best_j, best_sim = j, sims[r, j]
+
+            # Centroids changed or created within this block
+            if dirty:
+                idx = np.asarray(dirty)
+                fresh = centroids.data[idx] @ vec
+                m = int(np.argmax(fresh))
+                j = int(idx[m])
+                if fresh[m] > best_sim or (fresh[m] == best_sim and j < best_j):
+                    best_j, best_sim = j, fresh[m]
+            if centroids.size > k0:
+                fresh = centroids.data[k0:centroids.size] @ vec
+                m = int(np.argmax(fresh))
+                if fresh[m] > best_sim:
+                    best_j, best_sim = k0 + m, fresh[m]
+
+            if best_j >= 0 and best_sim >= sim_threshold:
+                centroids.merge(best_j, vec)
+                if best_j < k0 and best_j not in dirty_set:
+                    dirty_set.add(best_j)
+                    dirty.append(best_j)
+                    sims[r + 1:, best_j] = -np.inf
+                assignment.append(best_j)
+            else:
+                assignment.append(centroids.append(vec))
+
+    metrics.count("clusters_formed", centroids.size - existing)
+    return assignment
 
 def build_canonical_map_embeddings(transactions: List[dict], sim_threshold: float = 0.85) -> Dict[str, str]:
     raw_names = [(t.get("name") or "").strip() or "Unknown" for t in transactions]
@@ -21,33 +407,74 @@ def build_canonical_map_embeddings(transactions: List[dict], sim_threshold: floa
     if not uniq_names:
         return {}
 
-    uniq_vecs = _embed(uniq_names)
+    uniq_vecs = np.asarray(_embed(uniq_names), dtype=np.float32)
+    assignment = _cluster_greedy(uniq_vecs, sim_threshold)
+
+    # A cluster is labelled by the first name that created it
     canon_labels: List[str] = []
-    canon_vecs: List[np.ndarray] = []
     name_to_canon: Dict[str, str] = {}
-
-    for i, name in enumerate(uniq_names):
-        vec = uniq_vecs[i]
-        if not canon_vecs:
+    for name, j in zip(uniq_names, assignment):
+        if j == len(canon_labels):
             canon_labels.append(name)
-            canon_vecs.append(vec)
-            name_to_canon[name] = name
-            continue
+        name_to_canon[name] = canon_labels[j]
+
+    return name_to_canon
+
+def build_canonical_map_ngrams(transactions: List[dict], sim_threshold: float = HashingEmbedder.sim_threshold) -> Dict[str, str]:
+    raw_names = [(t.get("name") or "").strip() or "Unknown" for t in transactions]
+    uniq_names = list(dict.fromkeys(raw_names))
+    if not uniq_names:
+        return {}
 
-        sims = np.dot(np.vstack(canon_vecs), vec)
-        j = int(np.argmax(sims))
-        max_sim = sims[j]
-        
-        if max_sim >= sim_threshold:
-            name_to_canon[name] = canon_labels[j]
-            canon_vecs[j] = (canon_vecs[j] + vec) / np.linalg.norm(canon_vecs[j] + vec)
-        else:
+    assignment = _cluster_greedy(_embed(uniq_names, embedder=get_embedder("hashing")), sim_threshold)
+    canon_labels: List[str] = []
+    name_to_canon: Dict[str, str] = {}
+    for name, j in zip(uniq_names, assignment):
+        if j == len(canon_labels):
             canon_labels.append(name)
-            canon_vecs.append(vec)
-            name_to_canon[name] = name
+        name_to_canon[name] = canon_labels[j]
 
     return name_to_canon
 
+# Default similarity threshold per canonicalizer ("embeddings" defers to the embedder backend)
+CANONICALIZER_THRESHOLDS = {"embeddings": TransformerEmbedder.sim_threshold, "ngram": HashingEmbedder.sim_threshold}
+
+def transformer_available() -> bool:
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+def resolve_method(method: str) -> str:
+    """The method actually used: 'embeddings' falls back to 'ngram' without the transformer"""
+    if method not in CANONICALIZER_THRESHOLDS:
+        raise ValueError(f"Unknown canonicalizer: {method}")
+    if method == "embeddings" and get_embedder().requires_transformer and not transformer_available():
+        return "ngram"
+    return method
+
+def embedding_space(method: str = "embeddings") -> str:
+    """Name of the vector space embed_texts uses for method (changes with the embedder backend)"""
+    if resolve_method(method) == "ngram":
+        return get_embedder("hashing").name
+    return get_embedder().name
+
+def default_threshold(method: str = "embeddings") -> float:
+    """Similarity threshold build_canonical_map uses for method"""
+    method = resolve_method(method)
+    return get_embedder().sim_threshold if method == "embeddings" else CANONICALIZER_THRESHOLDS[method]
+
+def embed_texts(texts: List[str], method: str = "embeddings") -> np.ndarray:
+    """Unit-norm vectors for arbitrary texts with the selected method"""
+    embedder = get_embedder("hashing") if resolve_method(method) == "ngram" else None
+    return np.asarray(_embed(texts, embedder=embedder), dtype=np.float32)
+
+def build_canonical_map(transactions: List[dict], method: str = "embeddings", sim_threshold: Optional[float] = None) -> Dict[str, str]:
+    """Canonicalize transaction names with the selected method ('embeddings' or 'ngram')"""
+    method = resolve_method(method)
+    if sim_threshold is None:
+        sim_threshold = default_threshold(method)
+    if method == "ngram":
+        return build_canonical_map_ngrams(transactions, sim_threshold=sim_threshold)
+    return build_canonical_map_embeddings(transactions, sim_threshold=sim_threshold)
+
 def normalize_transactions_with_embeddings(transactions: List[dict], canon_map: Dict[str, str]) -> List[dict]:
     for t in transactions:
         raw = (t.get("name") or "").strip() or "Unknown"